@@ -0,0 +1,333 @@
+"""
+Fork-server executor for user code snippets.
+
+Every snippet runs in its own short-lived process. A fresh Python would
+spend seconds importing gdsfactory, perceval and matplotlib, so a single
+long-lived parent (the zygote) pays that cost once:
+
+1. The server spawns the zygote, which imports the heavy libraries and the
+   service module, activates the default gdsfactory PDK and warms
+   matplotlib's font cache.
+2. The zygote listens on a private Unix socket. For each connection it
+   forks a child, which inherits everything already imported
+   copy-on-write.
+3. The child reports its pid, runs the requested function, sends back the
+   result with its timings and unique memory, and exits with ``os._exit``.
+   Children are reaped automatically.
+
+A child can also be attached: it is handed the connection itself and keeps
+serving it until the function returns (used for interactive sessions).
+
+The zygote is spawned, not forked, because the server process is threaded.
+If the fork server is unavailable or disabled (``QUANTUM_FORKSERVER=0``),
+callers fall back to running in-process.
+"""
+import importlib
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+ENABLED = os.environ.get("QUANTUM_FORKSERVER", "1") != "0" and hasattr(os, "fork")
+# Seconds a snippet may run before its process is killed
+TIMEOUT = float(os.environ.get("QUANTUM_SNIPPET_TIMEOUT", 60))
+STARTUP_TIMEOUT = 120.0
+
+PRELOAD = ("numpy", "matplotlib", "matplotlib.pyplot", "gdsfactory", "perceval")
+
+# Recent runs kept for latency and memory statistics
+HISTORY = 256
+
+
+class ExecutorUnavailable(RuntimeError):
+    pass
+
+
+class SnippetTimeout(RuntimeError):
+    pass
+
+
+def _warm_up(modules: Sequence[str]) -> Dict[str, Any]:
+    """Import libraries and prime their caches in the zygote"""
+    import matplotlib
+    matplotlib.use("Agg")
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    try:
+        import gdsfactory as gf
+        gf.get_active_pdk().activate()
+    except Exception:
+        pass
+
+    # Resolve fonts and draw text once so children start with a warm font cache
+    from matplotlib import font_manager
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    font_manager.findfont(font_manager.FontProperties())
+    fig = Figure(figsize=(2, 2))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set_title("warm-up")
+    ax.plot([0, 1], [0, 1])
+    fig.canvas.draw()
+    return timings
+
+
+def unique_memory() -> Dict[str, Optional[int]]:
+    """USS/PSS of this process from /proc (Linux), in bytes"""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return {"unique_bytes": None, "proportional_bytes": None}
+    return {
+        "unique_bytes": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "proportional_bytes": fields.get("Pss"),
+    }
+
+
+def _run_child(conn, accepted: float) -> None:
+    started = time.monotonic()
+    conn.send(("pid", os.getpid()))
+    mode, target, args, kwargs, submitted = conn.recv()
+    module_name, function_name = target.split(":")
+    function = getattr(importlib.import_module(module_name), function_name)
+    if mode == "attach":
+        function(conn, *args, **kwargs)
+        return
+    exec_started = time.monotonic()
+    try:
+        result, error = function(*args, **kwargs), None
+    except BaseException as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    finished = time.monotonic()
+    metrics = {
+        "spawn_to_exec_ms": (exec_started - submitted) * 1000,
+        "fork_ms": (started - accepted) * 1000,
+        "exec_ms": (finished - exec_started) * 1000,
+        **unique_memory(),
+    }
+    conn.send(("result", result, error, metrics))
+
+
+def _zygote_main(address: str, authkey: bytes, modules: Sequence[str], ready) -> None:
+    timings = _warm_up(modules)
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    # Let the kernel reap exited children
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    ready.send(("ready", os.getpid(), timings))
+    ready.close()
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception:
+            continue
+        accepted = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                listener.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                _run_child(conn, accepted)
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        conn.close()
+
+
+class ForkServer:
+    """Handle on the zygote process, started on first use"""
+
+    def __init__(self, modules: Sequence[str] = PRELOAD):
+        self.modules = tuple(modules)
+        self.process = None
+        self.address = None
+        self._socket_dir = None
+        self.authkey = secrets.token_bytes(32)
+        self.warmup = {}
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=HISTORY)
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.attached = 0
+
+    def start(self) -> None:
+        with self._lock:
+            self._start()
+
+    def _start(self) -> None:
+        """Start the zygote unless it is running. Call with ``_lock`` held."""
+        if self.process is not None and self.process.is_alive():
+            return
+        self._kill()
+        self._socket_dir = tempfile.mkdtemp(prefix="quantum-forkserver-")
+        self.address = os.path.join(self._socket_dir, "socket")
+        ctx = multiprocessing.get_context("spawn")
+        ready_recv, ready_send = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(
+            target=_zygote_main,
+            args=(self.address, self.authkey, self.modules, ready_send),
+            daemon=True,
+            name="quantum-forkserver",
+        )
+        try:
+            self.process.start()
+        except Exception as e:
+            self.process = None
+            self._kill()
+            raise ExecutorUnavailable(f"fork server could not start: {e}")
+        ready_send.close()
+        if not ready_recv.poll(STARTUP_TIMEOUT):
+            self._kill()
+            raise ExecutorUnavailable("fork server did not start in time")
+        try:
+            _, _, self.warmup = ready_recv.recv()
+        except EOFError:
+            self._kill()
+            raise ExecutorUnavailable("fork server exited during start-up")
+
+    def _kill(self) -> None:
+        """Stop the zygote and remove its socket directory. Call with ``_lock`` held."""
+        if self.process is not None:
+            self.process.kill()
+            self.process.join(timeout=5)
+            self.process = None
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._kill()
+
+    def _connect(self):
+        with self._lock:
+            self._start()
+            address = self.address
+        try:
+            return Client(address, family="AF_UNIX", authkey=self.authkey)
+        except OSError:
+            # The zygote died: start a new one once, unless another thread already has
+            with self._lock:
+                if self.address == address:
+                    self._kill()
+                self._start()
+                address = self.address
+            try:
+                return Client(address, family="AF_UNIX", authkey=self.authkey)
+            except (OSError, EOFError) as e:
+                raise ExecutorUnavailable(f"fork server is not accepting connections: {e}")
+
+    def run(self, target: str, *args, timeout: float = TIMEOUT, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Call ``module:function`` with the given arguments in a forked child.
+        Returns (result, metrics). Exceptions raised by the function are
+        re-raised here as RuntimeError.
+        """
+        submitted = time.monotonic()
+        conn = self._connect()
+        pid = None
+        try:
+            _, pid = conn.recv()
+            conn.send(("call", target, args, kwargs, submitted))
+            if not conn.poll(timeout):
+                os.kill(pid, signal.SIGKILL)
+                with self._lock:
+                    self.timeouts += 1
+                raise SnippetTimeout(f"Snippet exceeded the {timeout:g} s time limit")
+            _, result, error, metrics = conn.recv()
+        except EOFError:
+            with self._lock:
+                self.failures += 1
+            raise RuntimeError("Snippet process exited without a result")
+        finally:
+            conn.close()
+
+        metrics["pid"] = pid
+        metrics["total_ms"] = (time.monotonic() - submitted) * 1000
+        with self._lock:
+            self.runs += 1
+            self._history.append(metrics)
+        if error is not None:
+            raise RuntimeError(error)
+        return result, metrics
+
+    def attach(self, target: str, *args, **kwargs) -> Tuple[Any, int]:
+        """
+        Fork a child that runs ``module:function(conn, *args, **kwargs)`` for
+        as long as it likes. Returns the connection to it and its pid.
+        """
+        conn = self._connect()
+        try:
+            _, pid = conn.recv()
+            conn.send(("attach", target, args, kwargs, time.monotonic()))
+        except (EOFError, OSError):
+            conn.close()
+            with self._lock:
+                self.failures += 1
+            raise RuntimeError("Session process exited during start-up")
+        with self._lock:
+            self.attached += 1
+        return conn, pid
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            history = list(self._history)
+            alive = self.process is not None and self.process.is_alive()
+        summary: Dict[str, Any] = {
+            "enabled": ENABLED,
+            "running": alive,
+            "zygote_pid": self.process.pid if alive else None,
+            "warmup_import_ms": self.warmup,
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "attached": self.attached,
+        }
+        for key in ("spawn_to_exec_ms", "fork_ms", "exec_ms", "unique_bytes"):
+            values = sorted(m[key] for m in history if m.get(key) is not None)
+            if values:
+                summary[key] = {
+                    "mean": sum(values) / len(values),
+                    "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                    "max": values[-1],
+                }
+        return summary
+
+
+_server: Optional[ForkServer] = None
+
+
+def get_server(preload: Sequence[str] = ()) -> ForkServer:
+    """The shared fork server; ``preload`` adds modules for the zygote to import"""
+    global _server
+    if _server is None:
+        _server = ForkServer(PRELOAD + tuple(preload))
+    return _server
+
+
+def shutdown() -> None:
+    if _server is not None:
+        _server.shutdown()
@@ -0,0 +1,1061 @@
+"""
+Streaming GDSII reader and layout index.
+
+A GDSII stream is a flat sequence of records. Each record is a 4-byte
+header (length, record type, data type) followed by its data. The file is
+memory-mapped and walked record by record, and element data never becomes
+Python objects. For every polygon or path the index keeps only its cell,
+its layer/datatype, and the offset and point count of its XY record.
+Coordinates are then decoded in vectorized chunks straight from the
+mapping, read as big-endian words, to get each shape's bounding box and
+area.
+
+From that index:
+
+- the cell hierarchy: references and arrays with their transforms, and
+  the top cells
+- polygon counts and drawn area per layer, for each cell on its own and
+  flattened through its references. Both are computed over the hierarchy,
+  without flattening any geometry
+- the bounding box of every cell
+- text labels (port and pin names) in top-cell coordinates
+
+The preview flattens one top cell into per-layer polygon arrays and
+registers them with the tile pyramid (``tiles``). Instances beyond a
+vertex budget are drawn as per-layer bounding boxes instead.
+
+Uploads are stored and indexed under the SHA-256 of the file. The index
+is written next to the file as .npy arrays and memory-mapped back when
+needed, so re-analysing or previewing a known file skips the parse and
+doesn't load the index into memory.
+
+Areas are sums of shape areas, so overlaps count twice. A path counts as
+length x width, plus one width of length for extended ends. Bounding
+boxes cover shapes only, not text. A path's box covers each segment
+widened perpendicular to itself, plus half a width past the ends of an
+extended path; the outer corners of mitred bends are not included. A
+reference rotated by a non-right angle gets the box of its child's
+rotated box, which can be slightly larger than the exact one.
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from quantum_backend import tiles
+except ImportError:
+    import tiles
+
+CACHE_DIR = os.environ.get("QUANTUM_GDS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "quantum-gds-cache"))
+MAX_CACHE_BYTES = int(os.environ.get("QUANTUM_GDS_CACHE_MB", "4096")) * 2**20
+MAX_UPLOAD_BYTES = int(os.environ.get("QUANTUM_GDS_MAX_UPLOAD_MB", "2048")) * 2**20
+# Indexes kept open in memory
+MAX_OPEN_INDEXES = 16
+
+# Points decoded, and file words searched for boundaries, per vectorized chunk
+CHUNK_POINTS = 1 << 20
+CHUNK_WORDS = 1 << 24
+# Flattened preview geometry; instances beyond it are drawn as bounding boxes
+MAX_PREVIEW_VERTICES = 8_000_000
+# Instance transforms expanded per cell when flattening
+MAX_INSTANCES = 2_000_000
+MAX_LABELS = 10_000
+
+# Record types
+HEADER, BGNLIB, LIBNAME, UNITS, ENDLIB, BGNSTR, STRNAME, ENDSTR = 0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07
+BOUNDARY, PATH, SREF, AREF, TEXT, LAYER, DATATYPE, WIDTH, XY, ENDEL = (
+    0x08, 0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x0E, 0x0F, 0x10, 0x11
+)
+SNAME, COLROW, NODE, TEXTTYPE, STRING, STRANS, MAG, ANGLE = 0x12, 0x13, 0x15, 0x16, 0x19, 0x1A, 0x1B, 0x1C
+PATHTYPE, BOX, BOXTYPE = 0x21, 0x2D, 0x2E
+
+# Shape kinds in the index
+POLYGON, PATH_FLUSH, PATH_EXTENDED = 0, 1, 2
+
+_record = struct.Struct(">HBB")
+_int16 = struct.Struct(">h")
+_uint16 = struct.Struct(">H")
+_int32 = struct.Struct(">i")
+
+INDEX_ARRAYS = ("cell", "layer", "datatype", "offset", "points", "kind", "width", "bbox", "area")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def gds_real(data: bytes) -> float:
+    """An 8-byte GDSII real: sign bit, excess-64 base-16 exponent, 56-bit mantissa"""
+    value = int.from_bytes(data[:8], "big")
+    sign = -1.0 if value >> 63 else 1.0
+    exponent = (value >> 56) & 0x7F
+    mantissa = value & ((1 << 56) - 1)
+    return sign * mantissa / 2.0**56 * 16.0 ** (exponent - 64)
+
+
+def _string(buf, start: int, length: int) -> str:
+    return bytes(buf[start:start + length]).rstrip(b"\0").decode("ascii", "replace")
+
+
+def _index_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenated arange(start, start + count) for each pair"""
+    return np.arange(int(counts.sum())) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+
+
+def decode_points(words: np.ndarray, offsets: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    The XY points of records whose data starts at the given byte offsets,
+    as an (N, 2) int64 array. ``words`` is the file as big-endian uint16
+    (record data always starts at an even offset); coordinates are read as
+    int32 through the view aligned with each record.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.asarray(points, dtype=np.int64) * 2
+    aligned = words[:len(words) // 2 * 2].view(">i4")
+    shifted = words[1:1 + (len(words) - 1) // 2 * 2].view(">i4")
+    odd = (offsets // 2) % 2 == 1
+    first = _index_ranges(offsets // 4, counts)
+    if not odd.any():
+        values = aligned[first]
+    elif odd.all():
+        values = shifted[first]
+    else:
+        values = np.empty(len(first), dtype=np.int32)
+        mask = np.repeat(odd, counts)
+        values[~mask] = aligned[first[~mask]]
+        values[mask] = shifted[first[mask]]
+    return values.astype(np.int64).reshape(-1, 2)
+
+
+def path_boxes(xy: np.ndarray, counts: np.ndarray, half: np.ndarray, extended: np.ndarray) -> np.ndarray:
+    """
+    (N, 4) bounding boxes of N paths whose points are concatenated in ``xy``
+    (``counts`` points each, at least 2). Every segment is widened by
+    ``half`` perpendicular to itself; ``extended`` paths also reach ``half``
+    past their first and last point.
+    """
+    starts = np.cumsum(counts) - counts
+    first = starts - np.arange(len(counts))  # first segment of each path
+    last = first + counts - 2
+    within = np.ones(len(xy) - 1, dtype=bool)
+    within[(starts + counts - 1)[:-1]] = False  # pairs that span two paths
+    p0, p1 = xy[:-1][within], xy[1:][within]
+    h = np.repeat(half, counts - 1)[:, None]
+    d = p1 - p0
+    length = np.hypot(d[:, 0], d[:, 1])[:, None]
+    unit = np.divide(d, length, out=np.zeros_like(d), where=length > 0)
+    # Corner offsets are +-normal; a zero-length segment has no direction, so pad it all round
+    pad = np.where(length > 0, np.abs(unit[:, ::-1]) * h, h)
+    p0, p1 = p0.copy(), p1.copy()
+    p0[first[extended]] -= unit[first[extended]] * h[first[extended]]
+    p1[last[extended]] += unit[last[extended]] * h[last[extended]]
+    boxes = np.empty((len(counts), 4))
+    boxes[:, :2] = np.minimum.reduceat(np.minimum(p0, p1) - pad, first)
+    boxes[:, 2:] = np.maximum.reduceat(np.maximum(p0, p1) + pad, first)
+    return boxes
+
+
+def _transform(matrix: np.ndarray, translations: np.ndarray) -> np.ndarray:
+    """(n, 2, 3) affine transforms sharing one linear part"""
+    transforms = np.empty((len(translations), 2, 3))
+    transforms[:, :, :2] = matrix
+    transforms[:, :, 2] = translations
+    return transforms
+
+
+def _compose(outer: np.ndarray, inner: np.ndarray) -> np.ndarray:
+    """Every outer transform applied after every inner one: (n * k, 2, 3)"""
+    linear = np.einsum("nij,kjl->nkil", outer[:, :, :2], inner[:, :, :2])
+    shift = np.einsum("nij,kj->nki", outer[:, :, :2], inner[:, :, 2]) + outer[:, None, :, 2]
+    result = np.empty((len(outer), len(inner), 2, 3))
+    result[..., :2] = linear
+    result[..., 2] = shift
+    return result.reshape(-1, 2, 3)
+
+
+def _apply(transforms: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Points under each transform: (n * len(points), 2)"""
+    moved = np.einsum("nij,vj->nvi", transforms[:, :, :2], points) + transforms[:, None, :, 2]
+    return moved.reshape(-1, 2)
+
+
+class Reference:
+    """An SREF (one instance) or AREF (a columns x rows lattice) of a cell"""
+
+    __slots__ = ("cell", "matrix", "origin", "columns", "rows", "column_step", "row_step")
+
+    def __init__(self, cell, matrix, origin, columns=1, rows=1, column_step=(0.0, 0.0), row_step=(0.0, 0.0)):
+        self.cell = cell
+        self.matrix = np.asarray(matrix, dtype=float).reshape(2, 2)
+        self.origin = np.asarray(origin, dtype=float)
+        self.columns = int(columns)
+        self.rows = int(rows)
+        self.column_step = np.asarray(column_step, dtype=float)
+        self.row_step = np.asarray(row_step, dtype=float)
+
+    @property
+    def instances(self) -> int:
+        return self.columns * self.rows
+
+    @property
+    def scale(self) -> float:
+        """Area scale factor (magnification squared)"""
+        return float(abs(np.linalg.det(self.matrix)))
+
+    def transforms(self) -> np.ndarray:
+        c, r = np.meshgrid(np.arange(self.columns), np.arange(self.rows), indexing="ij")
+        translations = self.origin + c.reshape(-1, 1) * self.column_step + r.reshape(-1, 1) * self.row_step
+        return _transform(self.matrix, translations)
+
+    def corner_transforms(self) -> np.ndarray:
+        """The lattice corners, enough to bound every instance"""
+        translations = [
+            self.origin + c * self.column_step + r * self.row_step
+            for c in {0, self.columns - 1} for r in {0, self.rows - 1}
+        ]
+        return _transform(self.matrix, np.array(translations))
+
+    def as_json(self) -> Dict[str, Any]:
+        return {
+            "cell": self.cell,
+            "matrix": self.matrix.ravel().tolist(),
+            "origin": self.origin.tolist(),
+            "columns": self.columns,
+            "rows": self.rows,
+            "column_step": self.column_step.tolist(),
+            "row_step": self.row_step.tolist(),
+        }
+
+
+def _reference_matrix(strans: int, magnification: float, angle: float) -> np.ndarray:
+    """STRANS/MAG/ANGLE as a 2x2 matrix: reflect about x, scale, then rotate"""
+    theta = np.deg2rad(angle)
+    rotation = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    reflection = np.diag([1.0, -1.0 if strans & 0x8000 else 1.0])
+    return magnification * rotation @ reflection
+
+
+class GDSIndex:
+    """Shape index and hierarchy of one GDSII file"""
+
+    def __init__(self, file_hash: str, path: str, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        self.file_hash = file_hash
+        self.path = path
+        self.library = meta["library"]
+        self.user_unit = meta["user_unit"]
+        self.meters_per_unit = meta["meters_per_unit"]
+        self.file_bytes = meta["file_bytes"]
+        self.records = meta["records"]
+        self.cells: List[str] = meta["cells"]
+        self.references: List[List[Reference]] = [
+            [Reference(**ref) for ref in refs] for refs in meta["references"]
+        ]
+        self.labels: List[List[Tuple[str, int, int, float, float]]] = [
+            [tuple(label) for label in labels] for labels in meta["labels"]
+        ]
+        self.timings_ms = meta.get("timings_ms", {})
+        self.arrays = arrays
+        self._hierarchy = None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values() if not isinstance(a, np.memmap))
+
+    def meta(self) -> Dict[str, Any]:
+        return {
+            "library": self.library,
+            "user_unit": self.user_unit,
+            "meters_per_unit": self.meters_per_unit,
+            "file_bytes": self.file_bytes,
+            "records": self.records,
+            "cells": self.cells,
+            "references": [[ref.as_json() for ref in refs] for refs in self.references],
+            "labels": self.labels,
+            "timings_ms": self.timings_ms,
+        }
+
+    def save(self, directory: str) -> None:
+        tmp = directory + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(tmp, f"{name}.npy"), self.arrays[name])
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(self.meta(), f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, file_hash: str, path: str, directory: str) -> "GDSIndex":
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in INDEX_ARRAYS
+        }
+        return cls(file_hash, path, meta, arrays)
+
+    # Hierarchy and statistics
+
+    def hierarchy(self) -> Dict[str, Any]:
+        """
+        Per-cell layer statistics and bounding boxes, local and flattened,
+        from a bottom-up pass over the reference graph
+        """
+        if self._hierarchy is not None:
+            return self._hierarchy
+        a = self.arrays
+        n_cells = len(self.cells)
+        cell_ids = {name: i for i, name in enumerate(self.cells)}
+        missing = sorted({ref.cell for refs in self.references for ref in refs if ref.cell not in cell_ids})
+
+        codes = a["layer"].astype(np.int64) << 16 | a["datatype"].astype(np.int64)
+        layer_codes, layer_index = np.unique(codes, return_inverse=True)
+        n_layers = len(layer_codes)
+        keys = a["cell"].astype(np.int64) * n_layers + layer_index
+        local_count = np.bincount(keys, minlength=n_cells * n_layers).reshape(n_cells, n_layers)
+        local_area = np.bincount(keys, weights=a["area"], minlength=n_cells * n_layers).reshape(n_cells, n_layers)
+
+        bbox = np.full((n_cells, 4), np.nan)
+        if len(keys):
+            order = np.argsort(a["cell"], kind="stable")
+            cells, first = np.unique(np.asarray(a["cell"])[order], return_index=True)
+            boxes = np.asarray(a["bbox"])[order]
+            bbox[cells, :2] = np.minimum.reduceat(boxes[:, :2], first)
+            bbox[cells, 2:] = np.maximum.reduceat(boxes[:, 2:], first)
+        local_bbox = bbox.copy()
+
+        order = self._children_first(cell_ids)
+        flat_count = local_count.astype(np.int64)
+        flat_area = local_area.copy()
+        for cell in order:
+            for ref in self.references[cell]:
+                child = cell_ids.get(ref.cell)
+                if child is None:
+                    continue
+                flat_count[cell] += ref.instances * flat_count[child]
+                flat_area[cell] += ref.instances * ref.scale * flat_area[child]
+                if np.isnan(bbox[child, 0]):
+                    continue
+                x0, y0, x1, y1 = bbox[child]
+                corners = _apply(ref.corner_transforms(), np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]]))
+                bbox[cell, :2] = np.fmin(bbox[cell, :2], corners.min(axis=0))
+                bbox[cell, 2:] = np.fmax(bbox[cell, 2:], corners.max(axis=0))
+
+        referenced = {cell_ids[ref.cell] for refs in self.references for ref in refs if ref.cell in cell_ids}
+        self._hierarchy = {
+            "cell_ids": cell_ids,
+            "layers": [(int(code >> 16), int(code & 0xFFFF)) for code in layer_codes],
+            "layer_index": layer_index,
+            "local_count": local_count,
+            "local_area": local_area,
+            "flat_count": flat_count,
+            "flat_area": flat_area,
+            "local_bbox": local_bbox,
+            "bbox": bbox,
+            "top_cells": [i for i in range(n_cells) if i not in referenced],
+            "missing_cells": missing,
+            "parents_first": order[::-1],
+        }
+        return self._hierarchy
+
+    def _children_first(self, cell_ids: Dict[str, int]) -> List[int]:
+        """Cells ordered so that every cell comes after the cells it references"""
+        state = [0] * len(self.cells)  # 0 new, 1 on the stack, 2 done
+        order = []
+        for root in range(len(self.cells)):
+            if state[root]:
+                continue
+            stack = [(root, iter(self.references[root]))]
+            state[root] = 1
+            while stack:
+                cell, refs = stack[-1]
+                for ref in refs:
+                    child = cell_ids.get(ref.cell)
+                    if child is None or state[child] == 2:
+                        continue
+                    if state[child] == 1:
+                        raise ValueError(f"Cell '{ref.cell}' references itself through '{self.cells[cell]}'")
+                    state[child] = 1
+                    stack.append((child, iter(self.references[child])))
+                    break
+                else:
+                    stack.pop()
+                    state[cell] = 2
+                    order.append(cell)
+        return order
+
+    def instances(self, top: int) -> Tuple[Dict[int, np.ndarray], List[str]]:
+        """Transforms from each cell under ``top`` into top-cell coordinates"""
+        h = self.hierarchy()
+        pending: Dict[int, List[np.ndarray]] = {top: [np.eye(2, 3)[None]]}
+        placed: Dict[int, np.ndarray] = {}
+        truncated = []
+        for cell in h["parents_first"]:
+            if cell not in pending:
+                continue
+            placed[cell] = np.concatenate(pending.pop(cell))
+            for ref in self.references[cell]:
+                child = h["cell_ids"].get(ref.cell)
+                if child is None:
+                    continue
+                total = sum(len(t) for t in pending.get(child, ())) + len(placed[cell]) * ref.instances
+                if total > MAX_INSTANCES:
+                    truncated.append(f"{self.cells[cell]} -> {ref.cell}")
+                    continue
+                pending.setdefault(child, []).append(_compose(placed[cell], ref.transforms()))
+        return placed, truncated
+
+    # Geometry
+
+    def _cell_shapes(self, words: np.ndarray, cell: int, order: np.ndarray, bounds: np.ndarray):
+        """The cell's own shapes as polygons: (layer index, vertices, counts) per layer"""
+        h = self.hierarchy()
+        selected = order[bounds[cell]:bounds[cell + 1]]
+        if not len(selected):
+            return []
+        a = self.arrays
+        kind = np.asarray(a["kind"])[selected]
+        points = np.asarray(a["points"])[selected].astype(np.int64)
+        coords = decode_points(words, np.asarray(a["offset"])[selected], points) * self.meters_per_unit * 1e6
+        starts = np.cumsum(points) - points
+        layer_index = h["layer_index"][selected]
+
+        shapes = []
+        polygons = kind == POLYGON
+        if polygons.any():
+            # Drop each boundary's closing point
+            keep = np.ones(len(coords), dtype=bool)
+            keep[(starts + points - 1)[polygons]] = False
+            keep &= np.repeat(polygons, points)
+            shapes.append((layer_index[polygons], coords[keep], points[polygons] - 1))
+        paths = ~polygons
+        if paths.any():
+            # One quad per path segment
+            seg_first = _index_ranges(starts[paths], points[paths] - 1)
+            p0, p1 = coords[seg_first], coords[seg_first + 1]
+            direction = p1 - p0
+            length = np.hypot(direction[:, 0], direction[:, 1])
+            length[length == 0] = 1
+            half_width = np.repeat(np.asarray(a["width"])[selected][paths], points[paths] - 1) / 2
+            normal = np.stack([-direction[:, 1], direction[:, 0]], axis=1) / length[:, None] * half_width[:, None]
+            quads = np.stack([p0 + normal, p1 + normal, p1 - normal, p0 - normal], axis=1).reshape(-1, 2)
+            shapes.append((np.repeat(layer_index[paths], points[paths] - 1), quads, np.full(len(p0), 4)))
+
+        per_layer = []
+        for layers, vertices, counts in shapes:
+            vertex_layers = np.repeat(layers, counts)
+            for li in np.unique(layers):
+                per_layer.append((int(li), vertices[vertex_layers == li], counts[layers == li]))
+        return per_layer
+
+    def preview(self, top: int) -> Tuple[tiles.LayoutPolygons, Dict[str, Any]]:
+        """Flatten a top cell into per-layer polygons for the tile pyramid"""
+        h = self.hierarchy()
+        placed, truncated = self.instances(top)
+        a = self.arrays
+        order = np.argsort(a["cell"], kind="stable")
+        bounds = np.searchsorted(np.asarray(a["cell"])[order], np.arange(len(self.cells) + 1))
+
+        # Preview vertices of each cell's own shapes: polygons without the closing point, a quad per path segment
+        segments = np.asarray(a["points"]) - 1
+        cell_vertices = np.bincount(
+            a["cell"], weights=np.where(np.asarray(a["kind"]) == POLYGON, segments, 4 * segments), minlength=len(self.cells)
+        )
+
+        # Every placed cell is reserved the cost of drawing its instances as boxes; the
+        # rest of the budget upgrades cells to full detail, parents first
+        layer_counts = (h["local_count"] > 0).sum(axis=1)
+        drawn = [cell for cell in h["parents_first"] if cell in placed and layer_counts[cell]]
+        box_cost = {cell: len(placed[cell]) * 4 * int(layer_counts[cell]) for cell in drawn}
+        spare = MAX_PREVIEW_VERTICES - sum(box_cost.values())
+
+        vertex_total = 0
+        layers: Dict[int, Tuple[List[np.ndarray], List[np.ndarray]]] = {}
+        as_boxes = []
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            words = None
+            try:
+                words = np.frombuffer(mm, dtype=">u2", count=len(mm) // 2)
+                for cell in drawn:
+                    transforms = placed[cell]
+                    if spare < 0:
+                        # Not even boxes fit: leave this cell out
+                        truncated.append(self.cells[cell])
+                        spare += box_cost[cell]
+                        continue
+                    upgrade = len(transforms) * int(cell_vertices[cell]) - box_cost[cell]
+                    if upgrade <= spare:
+                        spare -= upgrade
+                        shapes = self._cell_shapes(words, cell, order, bounds)
+                    else:
+                        # Level of detail: each instance as the bounding box of its shapes on each layer
+                        as_boxes.append(self.cells[cell])
+                        shapes = [
+                            (li, np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]]), np.array([4]))
+                            for li, (x0, y0, x1, y1) in self._layer_boxes(cell, order, bounds)
+                        ]
+                    for li, vertices, counts in shapes:
+                        layers.setdefault(li, ([], []))
+                        layers[li][0].append(_apply(transforms, vertices))
+                        layers[li][1].append(np.tile(counts, len(transforms)))
+                        vertex_total += len(transforms) * len(vertices)
+            finally:
+                words = None
+                mm.close()
+
+        polygons = {
+            h["layers"][li]: tiles.LayerPolygons.from_arrays(np.concatenate(v), np.concatenate(c))
+            for li, (v, c) in sorted(layers.items())
+        }
+        layout_id = hashlib.sha1(f"{self.file_hash}:{self.cells[top]}".encode()).hexdigest()[:16]
+        layout = tiles.LayoutPolygons(layout_id, self.cells[top], polygons)
+        return layout, {
+            "vertices": vertex_total,
+            "cells_as_boxes": as_boxes,
+            "omitted": truncated,
+        }
+
+    def _layer_boxes(self, cell: int, order: np.ndarray, bounds: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        selected = order[bounds[cell]:bounds[cell + 1]]
+        layer_index = self.hierarchy()["layer_index"][selected]
+        boxes = np.asarray(self.arrays["bbox"])[selected]
+        return [
+            (int(li), np.concatenate([boxes[layer_index == li, :2].min(axis=0), boxes[layer_index == li, 2:].max(axis=0)]))
+            for li in np.unique(layer_index)
+        ]
+
+    def flat_labels(self, top: int, placed: Dict[int, np.ndarray]) -> List[Dict[str, Any]]:
+        labels = []
+        for cell, transforms in placed.items():
+            for text, layer, texttype, x, y in self.labels[cell]:
+                for px, py in _apply(transforms[:MAX_LABELS - len(labels)], np.array([[x, y]])):
+                    labels.append({
+                        "text": text,
+                        "layer": f"{layer}/{texttype}",
+                        "x": float(px),
+                        "y": float(py),
+                        "cell": self.cells[cell],
+                    })
+                if len(labels) >= MAX_LABELS:
+                    return labels
+        return labels
+
+    def analysis(self, top: Optional[int] = None) -> Dict[str, Any]:
+        """Hierarchy, statistics and labels, flattened for one top cell"""
+        h = self.hierarchy()
+        if top is None:
+            if not h["top_cells"]:
+                raise ValueError("The library has no cells")
+            top = max(h["top_cells"], key=lambda c: h["flat_count"][c].sum())
+        placed, truncated = self.instances(top)
+
+        def box(row):
+            return None if np.isnan(row[0]) else row.tolist()
+
+        cells = [
+            {
+                "name": name,
+                "polygons": int(h["local_count"][i].sum()),
+                "flattened_polygons": int(h["flat_count"][i].sum()),
+                "references": [{"cell": ref.cell, "instances": ref.instances} for ref in self.references[i]],
+                "labels": len(self.labels[i]),
+                "bbox": box(h["bbox"][i]),
+            }
+            for i, name in enumerate(self.cells)
+        ]
+        layers = [
+            {
+                "layer": f"{layer}/{datatype}",
+                "polygons": int(h["flat_count"][top, li]),
+                "area_um2": float(h["flat_area"][top, li]),
+                "cells": int((h["local_count"][list(placed), li] > 0).sum()),
+            }
+            for li, (layer, datatype) in enumerate(h["layers"])
+            if h["flat_count"][top, li]
+        ]
+        return {
+            "file_hash": self.file_hash,
+            "file_bytes": self.file_bytes,
+            "library": self.library,
+            "units": {"user_unit": self.user_unit, "meters_per_unit": self.meters_per_unit, "coordinates": "um"},
+            "records": self.records,
+            "shapes": int(len(self.arrays["cell"])),
+            "top_cell": self.cells[top],
+            "top_cells": [self.cells[i] for i in h["top_cells"]],
+            "missing_cells": h["missing_cells"],
+            "bbox": box(h["bbox"][top]),
+            "layers": layers,
+            "labels": self.flat_labels(top, placed),
+            "cells": cells,
+            "instances_omitted": truncated,
+            "index_timings_ms": self.timings_ms,
+        }
+
+
+# Words of a BOUNDARY element as most writers emit it: BOUNDARY, LAYER (value
+# at +4), DATATYPE (value at +7), then the XY header (length at +8); ENDEL
+# follows the coordinates
+_BOUNDARY_WORDS = ((0, 0x0004), (1, 0x0800), (2, 0x0006), (3, 0x0D02), (5, 0x0006), (6, 0x0E02), (9, 0x1003))
+
+
+def _find_boundaries(words: np.ndarray, lo: int, hi: int) -> Dict[str, np.ndarray]:
+    """
+    Candidate BOUNDARY elements starting at word indexes in [lo, hi),
+    matched on their fixed header words and the ENDEL after their XY data.
+    A match inside coordinate data is possible in principle, so callers
+    only accept candidates that the record chain actually reaches.
+    """
+    last = len(words) - 12
+    hi = min(hi, last)
+    if hi <= lo:
+        return {"start": np.empty(0, dtype=np.int64)}
+    # The LAYER record header is the most selective word; check the rest only there
+    start = np.flatnonzero(words[lo + 3:hi + 3] == 0x0D02).astype(np.int64) + lo
+    for offset, value in _BOUNDARY_WORDS:
+        start = start[words[start + offset] == value]
+    xy_bytes = words[start + 8].astype(np.int64)
+    valid = (xy_bytes >= 36) & (xy_bytes % 8 == 4)
+    start, xy_bytes = start[valid], xy_bytes[valid]
+    endel = start + 10 + (xy_bytes - 4) // 2
+    valid = endel < len(words) - 1
+    start, xy_bytes, endel = start[valid], xy_bytes[valid], endel[valid]
+    valid = (words[endel] == 0x0004) & (words[endel + 1] == 0x1100)
+    start, xy_bytes, endel = start[valid], xy_bytes[valid], endel[valid]
+    return {
+        "start": start,
+        "end": endel + 2,
+        "layer": words[start + 4].astype(np.uint16),
+        "datatype": words[start + 7].astype(np.uint16),
+        "offset": (start + 10) * 2,
+        "points": ((xy_bytes - 4) // 8).astype(np.int32),
+    }
+
+
+class _Scanner:
+    """Record walker state; canonical BOUNDARY runs are taken from ``_find_boundaries``"""
+
+    def __init__(self, mm: mmap.mmap, size: int):
+        self.mm = mm
+        self.size = size
+        self.cells: List[str] = []
+        self.references: List[List[Dict[str, Any]]] = []
+        self.labels: List[List[Tuple[str, int, int, int, int]]] = []
+        self.library, self.user_unit, self.meters_per_unit = "", 1e-3, 1e-9
+        self.records = 0
+        self.cell = -1
+        self.ended = False
+        # Shapes found by walking, and runs of canonical boundaries as arrays
+        self.walked = {
+            "cell": array("i"), "layer": array("H"), "datatype": array("H"), "offset": array("q"),
+            "points": array("i"), "kind": array("b"), "width": array("d"),
+        }
+        self.runs: List[Dict[str, np.ndarray]] = []
+        self.element = None
+        self.layer = self.datatype = self.pathtype = self.strans = 0
+        self.columns = self.rows = 1
+        self.width, self.magnification, self.angle = 0.0, 1.0, 0.0
+        self.xy_offset = self.xy_bytes = 0
+        self.sname = self.text = ""
+
+    def take_run(self, run: Dict[str, np.ndarray], first: int, last: int) -> int:
+        """Accept candidates first..last-1 (contiguous in the file); returns the new position"""
+        if self.cell < 0:
+            raise ValueError(f"Corrupt GDSII file: element outside a cell at byte {2 * run['start'][first]}")
+        count = int(last - first)
+        self.runs.append({
+            "cell": np.full(count, self.cell, dtype=np.int32),
+            "layer": run["layer"][first:last],
+            "datatype": run["datatype"][first:last],
+            "offset": run["offset"][first:last],
+            "points": run["points"][first:last],
+            "kind": np.zeros(count, dtype=np.int8),
+            "width": np.zeros(count),
+        })
+        self.records += 5 * count
+        return int(run["end"][last - 1]) * 2
+
+    def _shape(self, kind: int, points: int, width: float) -> None:
+        w = self.walked
+        w["cell"].append(self.cell)
+        w["layer"].append(self.layer)
+        w["datatype"].append(self.datatype)
+        w["offset"].append(self.xy_offset)
+        w["points"].append(points)
+        w["kind"].append(kind)
+        w["width"].append(width)
+
+    def walk(self, pos: int, limit: int) -> int:
+        """Process records from ``pos`` until reaching ``limit`` (or ENDLIB); returns the new position"""
+        mm, size, unpack = self.mm, self.size, _record.unpack_from
+        while pos < limit and not self.ended:
+            if pos + 4 > size:
+                self.ended = True
+                break
+            length, rtype, _ = unpack(mm, pos)
+            if length < 4:
+                if length == 0:
+                    # Zero padding after the last record
+                    self.ended = True
+                    break
+                raise ValueError(f"Corrupt GDSII record at byte {pos}")
+            if pos + length > size:
+                raise ValueError(f"Truncated GDSII record at byte {pos}")
+            self.records += 1
+            data = pos + 4
+            if rtype == XY:
+                self.xy_offset, self.xy_bytes = data, length - 4
+            elif rtype == LAYER:
+                self.layer = _uint16.unpack_from(mm, data)[0]
+            elif rtype == DATATYPE or rtype == TEXTTYPE or rtype == BOXTYPE:
+                self.datatype = _uint16.unpack_from(mm, data)[0]
+            elif rtype == ENDEL:
+                self._end_element()
+            elif rtype in (BOUNDARY, PATH, SREF, AREF, TEXT, BOX, NODE):
+                if self.cell < 0:
+                    raise ValueError(f"Corrupt GDSII file: element outside a cell at byte {pos}")
+                self.element = rtype
+                self.layer = self.datatype = self.pathtype = self.strans = 0
+                self.width, self.magnification, self.angle = 0.0, 1.0, 0.0
+                self.columns = self.rows = 1
+            elif rtype == WIDTH:
+                self.width = abs(_int32.unpack_from(mm, data)[0])
+            elif rtype == PATHTYPE:
+                self.pathtype = _int16.unpack_from(mm, data)[0]
+            elif rtype == SNAME:
+                self.sname = _string(mm, data, length - 4)
+            elif rtype == STRING:
+                self.text = _string(mm, data, length - 4)
+            elif rtype == STRANS:
+                self.strans = _uint16.unpack_from(mm, data)[0]
+            elif rtype == MAG:
+                self.magnification = gds_real(mm[data:data + 8])
+            elif rtype == ANGLE:
+                self.angle = gds_real(mm[data:data + 8])
+            elif rtype == COLROW:
+                self.columns, self.rows = struct.unpack_from(">2h", mm, data)
+            elif rtype == STRNAME:
+                self.cells.append(_string(mm, data, length - 4))
+                self.references.append([])
+                self.labels.append([])
+                self.cell = len(self.cells) - 1
+            elif rtype == ENDSTR:
+                self.cell = -1
+            elif rtype == UNITS:
+                self.user_unit, self.meters_per_unit = gds_real(mm[data:data + 8]), gds_real(mm[data + 8:data + 16])
+            elif rtype == LIBNAME:
+                self.library = _string(mm, data, length - 4)
+            elif rtype == ENDLIB:
+                self.ended = True
+            pos += length
+        return pos
+
+    def _end_element(self) -> None:
+        element, points = self.element, self.xy_bytes // 8
+        if element == BOUNDARY or element == BOX:
+            if points >= 4:
+                self._shape(POLYGON, points, 0.0)
+        elif element == PATH:
+            if points >= 2 and self.width:
+                self._shape(PATH_EXTENDED if self.pathtype in (1, 2) else PATH_FLUSH, points, self.width)
+        elif element == SREF or element == AREF:
+            ref = {
+                "cell": self.sname,
+                "strans": self.strans,
+                "magnification": self.magnification,
+                "angle": self.angle,
+                "xy": struct.unpack_from(f">{2 * points}i", self.mm, self.xy_offset),
+            }
+            if element == AREF:
+                ref.update(columns=self.columns, rows=self.rows)
+            self.references[self.cell].append(ref)
+        elif element == TEXT:
+            self.labels[self.cell].append((self.text, self.layer, self.datatype, *struct.unpack_from(">2i", self.mm, self.xy_offset)))
+        self.element = None
+
+    def shapes(self) -> Dict[str, np.ndarray]:
+        parts = [{name: np.frombuffer(values, dtype=values.typecode) for name, values in self.walked.items()}]
+        parts += self.runs
+        return {name: np.concatenate([part[name] for part in parts]) for name in self.walked}
+
+
+def scan(path: str, file_hash: str) -> GDSIndex:
+    """Walk the records of a GDSII file and build its shape index"""
+    timings = {}
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 4:
+            raise ValueError("Not a GDSII file: too short")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    words = None
+    try:
+        length, rtype, _ = _record.unpack_from(mm, 0)
+        if rtype != HEADER or length != 6:
+            raise ValueError("Not a GDSII file: missing HEADER record")
+        words = np.frombuffer(mm, dtype=">u2", count=size // 2)
+
+        scanner = _Scanner(mm, size)
+        pos = 0
+        for lo in range(0, len(words), CHUNK_WORDS):
+            run = _find_boundaries(words, lo, lo + CHUNK_WORDS)
+            starts = run["start"]
+            if not len(starts) or scanner.ended:
+                continue
+            # Split the candidates into runs of back-to-back elements
+            breaks = np.flatnonzero(run["end"][:-1] != starts[1:]) + 1
+            edges = np.concatenate([[0], breaks, [len(starts)]])
+            for first, last in zip(edges[:-1], edges[1:]):
+                if int(starts[first]) * 2 > pos:
+                    pos = scanner.walk(pos, int(starts[first]) * 2)
+                if scanner.ended:
+                    break
+                # Accept the run from the element the record chain reached, if any
+                k = first + int(np.searchsorted(starts[first:last], pos // 2))
+                if k < last and int(starts[k]) * 2 == pos:
+                    pos = scanner.take_run(run, k, last)
+        scanner.walk(pos, size)
+        timings["scan_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        start = time.perf_counter()
+        arrays = scanner.shapes()
+        scale = scanner.meters_per_unit * 1e6  # database units to µm
+        offsets, kinds = arrays["offset"], arrays["kind"]
+        points = arrays["points"].astype(np.int64)
+        widths = arrays["width"] = arrays["width"] * scale
+        bbox = np.empty((len(offsets), 4))
+        area = np.empty(len(offsets))
+        ends = np.cumsum(points)
+        lo = 0
+        while lo < len(offsets):
+            # Shapes whose points fit in one chunk (at least one shape)
+            hi = max(lo + 1, int(np.searchsorted(ends, (ends[lo - 1] if lo else 0) + CHUNK_POINTS, side="right")))
+            counts = points[lo:hi]
+            xy = decode_points(words, offsets[lo:hi], counts) * scale
+            starts = np.cumsum(counts) - counts
+            bbox[lo:hi, :2] = np.minimum.reduceat(xy, starts)
+            bbox[lo:hi, 2:] = np.maximum.reduceat(xy, starts)
+            paths = np.flatnonzero(kinds[lo:hi] != POLYGON)
+            if len(paths):
+                bbox[lo + paths] = path_boxes(
+                    xy[_index_ranges(starts[paths], counts[paths])],
+                    counts[paths],
+                    widths[lo:hi][paths] / 2,
+                    kinds[lo:hi][paths] == PATH_EXTENDED,
+                )
+            # Shoelace terms for polygons and segment lengths for paths, within each shape
+            x, y = xy[:, 0], xy[:, 1]
+            last = starts + counts - 1
+            cross = np.append(x[:-1] * y[1:] - x[1:] * y[:-1], 0.0)
+            segment = np.append(np.hypot(np.diff(x), np.diff(y)), 0.0)
+            cross[last] = 0.0
+            segment[last] = 0.0
+            polygon_area = np.abs(np.add.reduceat(cross, starts)) / 2
+            path_length = np.add.reduceat(segment, starts) + np.where(kinds[lo:hi] == PATH_EXTENDED, widths[lo:hi], 0.0)
+            area[lo:hi] = np.where(kinds[lo:hi] == POLYGON, polygon_area, path_length * widths[lo:hi])
+            lo = hi
+        arrays["bbox"], arrays["area"] = bbox, area
+        timings["decode_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    finally:
+        words = None
+        mm.close()
+
+    def reference(ref: Dict[str, Any]) -> Dict[str, Any]:
+        xy = np.asarray(ref["xy"], dtype=float).reshape(-1, 2) * scale
+        result = {
+            "cell": ref["cell"],
+            "matrix": _reference_matrix(ref["strans"], ref["magnification"], ref["angle"]).ravel().tolist(),
+            "origin": xy[0].tolist(),
+        }
+        if "columns" in ref and len(xy) >= 3:
+            columns, rows = max(ref["columns"], 1), max(ref["rows"], 1)
+            result.update(
+                columns=columns,
+                rows=rows,
+                column_step=((xy[1] - xy[0]) / columns).tolist(),
+                row_step=((xy[2] - xy[0]) / rows).tolist(),
+            )
+        return result
+
+    meta = {
+        "library": scanner.library,
+        "user_unit": scanner.user_unit,
+        "meters_per_unit": scanner.meters_per_unit,
+        "file_bytes": size,
+        "records": scanner.records,
+        "cells": scanner.cells,
+        "references": [[reference(ref) for ref in refs] for refs in scanner.references],
+        "labels": [[(t, l, d, x * scale, y * scale) for t, l, d, x, y in labels] for labels in scanner.labels],
+        "timings_ms": timings,
+    }
+    return GDSIndex(file_hash, path, meta, arrays)
+
+
+# Upload store and index cache
+
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+_indexes: "OrderedDict[str, GDSIndex]" = OrderedDict()
+_previews: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+
+def _gds_path(file_hash: str) -> str:
+    return os.path.join(CACHE_DIR, f"{file_hash}.gds")
+
+
+def _index_dir(file_hash: str) -> str:
+    return os.path.join(CACHE_DIR, f"{file_hash}.index")
+
+
+def is_valid_hash(file_hash: str) -> bool:
+    return len(file_hash) == 64 and all(c in "0123456789abcdef" for c in file_hash)
+
+
+def is_known(file_hash: str) -> bool:
+    return is_valid_hash(file_hash) and os.path.exists(_gds_path(file_hash))
+
+
+class Upload:
+    """Streams an upload to the cache directory while hashing it"""
+
+    def __init__(self):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".part")
+        self.file = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"GDS uploads are limited to {MAX_UPLOAD_BYTES // 2**20} MB")
+        self.digest.update(chunk)
+        self.file.write(chunk)
+
+    def finish(self) -> str:
+        """Close the upload and return its hash; a known file is not stored twice"""
+        self.file.close()
+        if not self.size:
+            os.unlink(self.tmp_path)
+            raise ValueError("Empty upload: send the GDS file as the request body")
+        file_hash = self.digest.hexdigest()
+        if os.path.exists(_gds_path(file_hash)):
+            os.unlink(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, _gds_path(file_hash))
+        _evict(keep=file_hash)
+        return file_hash
+
+    def abort(self) -> None:
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+
+def _evict(keep: str) -> None:
+    """Drop the least recently used files and indexes beyond the disk budget"""
+    entries = {}
+    for name in os.listdir(CACHE_DIR):
+        file_hash = name.split(".")[0]
+        path = os.path.join(CACHE_DIR, name)
+        if not is_valid_hash(file_hash):
+            continue
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        else:
+            size = os.path.getsize(path)
+        used, newest = entries.get(file_hash, (0, 0.0))
+        entries[file_hash] = (used + size, max(newest, os.path.getmtime(path)))
+    total = sum(size for size, _ in entries.values())
+    for file_hash, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= MAX_CACHE_BYTES:
+            break
+        if file_hash == keep:
+            continue
+        with _lock:
+            _indexes.pop(file_hash, None)
+            for key in [key for key in _previews if key[0] == file_hash]:
+                del _previews[key]
+        shutil.rmtree(_index_dir(file_hash), ignore_errors=True)
+        if os.path.exists(_gds_path(file_hash)):
+            os.unlink(_gds_path(file_hash))
+        total -= size
+
+
+def get_index(file_hash: str) -> Tuple[GDSIndex, bool]:
+    """The index of a stored file, and whether it was cached (in memory or on disk)"""
+    with _lock:
+        index = _indexes.get(file_hash)
+        if index is not None:
+            _indexes.move_to_end(file_hash)
+            return index, True
+    with _build_lock:
+        with _lock:
+            index = _indexes.get(file_hash)
+        cached = index is not None
+        if index is None:
+            path, directory = _gds_path(file_hash), _index_dir(file_hash)
+            try:
+                index, cached = GDSIndex.load(file_hash, path, directory), True
+            except (OSError, ValueError, KeyError):
+                index = scan(path, file_hash)
+                index.save(directory)
+                # Reopen memory-mapped so the parsed arrays can be freed
+                index = GDSIndex.load(file_hash, path, directory)
+            os.utime(path)
+        with _lock:
+            _indexes[file_hash] = index
+            while len(_indexes) > MAX_OPEN_INDEXES:
+                _indexes.popitem(last=False)
+        return index, cached
+
+
+def analyze(file_hash: str, cell: Optional[str] = None) -> Dict[str, Any]:
+    """Analysis of a stored file, with a tiled preview of one top cell"""
+    if not is_known(file_hash):
+        raise KeyError(f"Unknown GDS file {file_hash}")
+    start = time.perf_counter()
+    index, cached = get_index(file_hash)
+    timings = {"index_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    start = time.perf_counter()
+    top = None
+    if cell is not None:
+        top = index.hierarchy()["cell_ids"].get(cell)
+        if top is None:
+            raise ValueError(f"No cell named '{cell}'")
+    result = index.analysis(top)
+    timings["analysis_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    start = time.perf_counter()
+    key = (file_hash, result["top_cell"])
+    with _lock:
+        preview = _previews.get(key)
+    if preview is None or tiles.get_layout(preview["layout_id"]) is None:
+        layout, info = index.preview(index.hierarchy()["cell_ids"][result["top_cell"]])
+        preview = {**tiles.adopt(layout).metadata(), **info}
+        with _lock:
+            _previews[key] = preview
+    timings["preview_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return {**result, "preview": preview, "cached": cached, "timings_ms": timings}
+
+
+def index_stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "open_indexes": len(_indexes),
+            "index_bytes_in_memory": sum(index.nbytes for index in _indexes.values()),
+            "cache_dir": CACHE_DIR,
+        }
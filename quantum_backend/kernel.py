@@ -0,0 +1,745 @@
+"""
+Interactive kernel sessions with incremental re-execution.
+
+The code editors send the whole script on every edit. A session keeps the
+script's namespace alive between submissions and only re-runs what an edit
+affected:
+
+- A submission is split into cells, one per top-level statement. From each
+  cell's syntax tree come the names it reads, the names it binds, and the
+  names it changes in place (attribute or item assignment, ``<<``/``//``,
+  method calls other than well-known read-only ones, and names passed as
+  arguments to any other call, e.g. ``np.random.shuffle(a)``).
+- A cell reads each name from the closest earlier cell that wrote it. Its
+  key hashes its syntax tree together with the keys of those providers, so
+  an edit changes the key of the edited cell and of every cell downstream.
+  Comments and formatting don't change keys.
+- Cells whose key has not run yet are re-executed. So are the providers of
+  a re-executed cell that changes its inputs in place, or that reads a name
+  a later cell overwrites, and the later writers of any name a re-executed
+  cell writes. The namespace then ends up as a full run would leave it.
+- A name bound from an expression over other names (``b = a``, ``b = a[0]``,
+  ``b = f(a)``) may alias them, so changing it in place counts as changing
+  those names too.
+
+Each session runs in a long-lived child of the fork server. The child has
+an address-space limit and a unique-memory cap, and it is closed once idle
+for too long. Without the fork server, sessions run in-process and only the
+idle timeout applies.
+"""
+import ast
+import builtins
+import contextlib
+import hashlib
+import linecache
+import os
+import secrets
+import signal
+import threading
+import time
+import traceback
+from collections import defaultdict
+from io import StringIO
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    from quantum_backend import forkserver, rendering, tiles
+    from quantum_backend.serialization import complex_matrix_rows, dumps
+except ImportError:
+    import forkserver, rendering, tiles
+    from serialization import complex_matrix_rows, dumps
+
+KINDS = ("gdsfactory", "perceval")
+
+# Seconds without a message before a session is closed
+IDLE_TIMEOUT = float(os.environ.get("QUANTUM_KERNEL_IDLE_SECONDS", 600))
+# Unique memory a session process may use on top of the fork server's
+MEMORY_LIMIT = int(os.environ.get("QUANTUM_KERNEL_MEMORY_MB", 1024)) * 1024 * 1024
+MAX_SESSIONS = int(os.environ.get("QUANTUM_KERNEL_MAX_SESSIONS", 32))
+STARTUP_TIMEOUT = 30.0
+
+# Method calls that don't change their receiver
+READ_ONLY_METHODS = {
+    "copy", "plot", "show", "describe", "pdisplay", "display", "keys", "values", "items",
+    "index", "count", "format", "startswith", "endswith", "join", "split",
+}
+READ_ONLY_PREFIXES = ("get_", "compute_", "to_", "write_", "plot_", "is_", "has_")
+# Builtins that don't change their arguments
+READ_ONLY_FUNCTIONS = {
+    "print", "len", "repr", "str", "int", "float", "bool", "complex", "abs", "round",
+    "min", "max", "sum", "any", "all", "sorted", "reversed", "enumerate", "zip", "range",
+    "isinstance", "issubclass", "type", "id", "hash", "iter", "list", "tuple", "set",
+    "frozenset", "dict", "format", "getattr", "hasattr", "callable", "divmod", "pow",
+}
+
+# plt.show is patched per cell; in-process sessions share the module from threadpool threads
+_SHOW_LOCK = threading.Lock()
+
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+
+
+class Cell:
+    """One top-level statement and the names it touches"""
+
+    __slots__ = ("index", "node", "line", "reads", "binds", "mutates", "aliases", "augmented", "providers", "key")
+
+    def __init__(self, index: int, node: ast.stmt):
+        self.index = index
+        self.node = node
+        self.line = node.lineno
+        self.reads: Set[str] = set()
+        self.binds: Set[str] = set()
+        self.mutates: Set[str] = set()
+        self.aliases: Dict[str, Set[str]] = defaultdict(set)  # bound name -> names it may alias
+        self.augmented: Set[str] = set()  # names rebound by ``+=`` and co, which may change in place
+        self.providers: Dict[str, int] = {}
+        self.key = ""
+
+    @property
+    def writes(self) -> Set[str]:
+        return self.binds | self.mutates
+
+
+def _module_scope(node: ast.AST):
+    """A statement and the nodes it evaluates at module scope (function, class and lambda bodies are skipped)"""
+    yield node
+    stack = list(ast.iter_child_nodes(node))
+    while stack:
+        child = stack.pop()
+        yield child
+        if not isinstance(child, _SCOPES):
+            stack.extend(ast.iter_child_nodes(child))
+
+
+def _base_name(node: ast.AST) -> Optional[str]:
+    """``c`` for ``c``, ``c.ports["o1"]`` or ``c.ref().x``"""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _target_names(target: ast.AST, binds: Set[str], mutates: Set[str]) -> None:
+    if isinstance(target, ast.Name):
+        binds.add(target.id)
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for element in target.elts:
+            _target_names(element, binds, mutates)
+    elif isinstance(target, ast.Starred):
+        _target_names(target.value, binds, mutates)
+    else:
+        name = _base_name(target)
+        if name:
+            mutates.add(name)
+
+
+def _alias(target: ast.AST, value: ast.AST, aliases: Dict[str, Set[str]]) -> None:
+    """Record that the names bound by ``target`` may alias the names ``value`` reads"""
+    # Called functions and builtins hand out values, they aren't aliased
+    callees = {id(n.func) for n in ast.walk(value) if isinstance(n, ast.Call)}
+    sources = {
+        n.id for n in ast.walk(value)
+        if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)
+        and id(n) not in callees and not hasattr(builtins, n.id)
+    }
+    if not sources:
+        return
+    targets = [target]
+    while targets:
+        node = targets.pop()
+        if isinstance(node, ast.Name):
+            aliases[node.id] |= sources
+        elif isinstance(node, (ast.Tuple, ast.List)):
+            targets.extend(node.elts)
+        elif isinstance(node, ast.Starred):
+            targets.append(node.value)
+
+
+def _read_only(method: str) -> bool:
+    return method in READ_ONLY_METHODS or method.startswith(READ_ONLY_PREFIXES)
+
+
+def _analyze(cell: Cell) -> None:
+    node = cell.node
+    cell.reads = {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)}
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        cell.binds.add(node.name)
+    for sub in _module_scope(node) if not isinstance(node, _SCOPES) else ():
+        if isinstance(sub, ast.Assign):
+            for target in sub.targets:
+                _target_names(target, cell.binds, cell.mutates)
+                _alias(target, sub.value, cell.aliases)
+        elif isinstance(sub, ast.AugAssign):
+            _target_names(sub.target, cell.binds, cell.mutates)
+            if isinstance(sub.target, ast.Name):
+                cell.augmented.add(sub.target.id)
+        elif isinstance(sub, ast.AnnAssign):
+            _target_names(sub.target, cell.binds, cell.mutates)
+            if sub.value is not None:
+                _alias(sub.target, sub.value, cell.aliases)
+        elif isinstance(sub, (ast.For, ast.AsyncFor)):
+            _target_names(sub.target, cell.binds, cell.mutates)
+            _alias(sub.target, sub.iter, cell.aliases)
+        elif isinstance(sub, ast.withitem) and sub.optional_vars is not None:
+            _target_names(sub.optional_vars, cell.binds, cell.mutates)
+            _alias(sub.optional_vars, sub.context_expr, cell.aliases)
+        elif isinstance(sub, ast.NamedExpr):
+            cell.binds.add(sub.target.id)
+            _alias(sub.target, sub.value, cell.aliases)
+        elif isinstance(sub, ast.Delete):
+            for target in sub.targets:
+                _target_names(target, cell.binds, cell.mutates)
+        elif isinstance(sub, (ast.Import, ast.ImportFrom)):
+            for alias in sub.names:
+                if alias.name != "*":
+                    cell.binds.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(sub, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            cell.binds.add(sub.name)
+        elif isinstance(sub, ast.Call):
+            if isinstance(sub.func, ast.Attribute):
+                read_only = _read_only(sub.func.attr)
+                name = _base_name(sub.func.value)
+                if name and not read_only:
+                    cell.mutates.add(name)
+            else:
+                read_only = isinstance(sub.func, ast.Name) and sub.func.id in READ_ONLY_FUNCTIONS
+            if not read_only:
+                # The callee may change what it is given (``np.random.shuffle(a)``, ``gf.add_pins(c)``)
+                for arg in [*sub.args, *(keyword.value for keyword in sub.keywords)]:
+                    if isinstance(arg, ast.Starred):
+                        arg = arg.value
+                    if isinstance(arg, (ast.Name, ast.Attribute, ast.Subscript)):
+                        name = _base_name(arg)
+                        if name:
+                            cell.mutates.add(name)
+        elif isinstance(sub, ast.BinOp) and isinstance(sub.op, (ast.LShift, ast.FloorDiv)):
+            # gdsfactory ``c << cell`` adds a reference, perceval ``c // op`` appends
+            name = _base_name(sub.left)
+            if name:
+                cell.mutates.add(name)
+
+
+def split_cells(code: str, modules: Set[str] = frozenset()) -> List[Cell]:
+    """
+    Split a script into cells with their dependencies and keys.
+    ``modules`` are preloaded names that are never considered mutated.
+    Raises SyntaxError.
+    """
+    tree = ast.parse(code)
+    cells = [Cell(i, node) for i, node in enumerate(tree.body)]
+    for cell in cells:
+        _analyze(cell)
+
+    # Modules are shared, not state: calling gf.components.x() doesn't change gf
+    imported = set(modules)
+    for cell in cells:
+        if isinstance(cell.node, (ast.Import, ast.ImportFrom)):
+            imported |= cell.binds
+    last_writer: Dict[str, Cell] = {}
+    # Names each name may alias, as of the current cell (transitively closed)
+    alias_of: Dict[str, Set[str]] = {}
+    for cell in cells:
+        # Changing a name in place may change whatever it aliases, here or earlier
+        changed = cell.mutates | cell.augmented
+        for name in changed:
+            cell.mutates |= alias_of.get(name, set())
+            for source in cell.aliases.get(name, ()):
+                cell.mutates |= {source} | alias_of.get(source, set())
+        cell.mutates -= imported
+        digest = hashlib.sha256(ast.dump(cell.node).encode())
+        for name in sorted(cell.reads | cell.mutates):
+            provider = last_writer.get(name)
+            if provider is not None:
+                cell.providers[name] = provider.index
+                digest.update(f"\0{name}={provider.key}".encode())
+        cell.key = digest.hexdigest()
+        for name in cell.writes:
+            last_writer[name] = cell
+        for name in cell.binds - cell.augmented:
+            alias_of.pop(name, None)
+        for name, sources in cell.aliases.items():
+            closure = set(sources)
+            for source in sources:
+                closure |= alias_of.get(source, set())
+            alias_of[name] = (alias_of.get(name, set()) | closure) - imported - {name}
+    return cells
+
+
+def _render_options(render: Optional[Dict[str, Any]]) -> SimpleNamespace:
+    fields = ("format", "dpi", "width", "height", "thumbnail")
+    return SimpleNamespace(**{field: (render or {}).get(field) for field in fields})
+
+
+class Kernel:
+    """A persistent namespace that runs submissions incrementally"""
+
+    def __init__(self, kind: str):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown session kind '{kind}'. Use one of: {', '.join(KINDS)}")
+        self.kind = kind
+        self.filename = f"<{kind}-session>"
+        self._preload = self._modules()
+        self.reset()
+
+    def _modules(self) -> Dict[str, Any]:
+        import matplotlib.pyplot as plt
+        if self.kind == "gdsfactory":
+            import gdsfactory as gf
+            return {"gf": gf, "np": np, "plt": plt}
+        try:
+            import perceval as pcvl
+        except ImportError:
+            try:
+                import perceval_quandela as pcvl
+            except ImportError:
+                raise ValueError("Perceval is not installed. Please install with 'pip install perceval-quandela'")
+        return {"pcvl": pcvl, "np": np, "plt": plt}
+
+    def reset(self) -> None:
+        self.namespace: Dict[str, Any] = {"__builtins__": builtins, "__name__": "__main__", **self._preload}
+        self.versions: Dict[str, str] = {}  # name -> key of the cell whose value it holds
+        self.executed: Set[str] = set()
+        self.outputs: Dict[str, Dict[str, Any]] = {}  # cell key -> last output
+        self._preview: Optional[Tuple[str, int, str]] = None  # (component name, object id, layout id)
+
+    def _plan(self, cells: List[Cell]) -> Set[int]:
+        """Indices of the cells that must run for the namespace to match a full run"""
+        writers: Dict[str, List[int]] = defaultdict(list)
+        readers: Dict[int, List[int]] = defaultdict(list)
+        for cell in cells:
+            for name in cell.writes:
+                writers[name].append(cell.index)
+            for provider in set(cell.providers.values()):
+                readers[provider].append(cell.index)
+        last_writer = {name: indices[-1] for name, indices in writers.items()}
+
+        run = {cell.index for cell in cells if cell.key not in self.executed}
+        # Names whose current value isn't the one the script leaves behind
+        run |= {i for name, i in last_writer.items() if self.versions.get(name) != cells[i].key}
+
+        pending = list(run)
+        while pending:
+            cell = cells[pending.pop()]
+            needed = set(readers[cell.index])
+            for name in cell.writes:
+                needed.update(i for i in writers[name] if i > cell.index)
+            for name, provider in cell.providers.items():
+                # The namespace holds the final value, which isn't the one this cell needs
+                if name in cell.mutates or last_writer[name] != provider:
+                    needed.add(provider)
+            for i in needed - run:
+                run.add(i)
+                pending.append(i)
+        return run
+
+    def _run_cell(self, cell: Cell, options: SimpleNamespace) -> Dict[str, Any]:
+        import matplotlib.pyplot as plt
+        code = compile(ast.Module(body=[cell.node], type_ignores=[]), self.filename, "exec")
+        output = StringIO()
+        plots = []
+        error = None
+
+        def capture_show(*args, **kwargs):
+            plots.append(rendering.render_pyplot_figure(plt.gcf(), options, kind="pyplot").to_base64())
+            plt.close()
+
+        start = time.perf_counter()
+        with _SHOW_LOCK:
+            original_show = plt.show
+            plt.show = capture_show
+            try:
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                    exec(code, self.namespace)
+            except (Exception, SystemExit) as e:
+                # Drop this frame from the traceback
+                error = "".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next))
+            finally:
+                plt.show = original_show
+        return {
+            "index": cell.index,
+            "line": cell.line,
+            "stdout": output.getvalue(),
+            "error": error,
+            "plots": plots,
+            "ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    def execute(self, code: str, render: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            cells = split_cells(code, set(self._preload))
+        except SyntaxError as e:
+            return {
+                "type": "result",
+                "error": f"SyntaxError: {e}",
+                "cells": [],
+                "executed": 0,
+                "reused": 0,
+                "failed": True,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+            }
+        # Tracebacks show the submitted source
+        linecache.cache[self.filename] = (len(code), None, code.splitlines(True), self.filename)
+        options = _render_options(render)
+
+        # Forget names that no cell defines any more
+        defined = set().union(*(cell.writes for cell in cells)) if cells else set()
+        for name in [name for name in self.versions if name not in defined]:
+            self.namespace.pop(name, None)
+            del self.versions[name]
+            if name in self._preload:
+                self.namespace[name] = self._preload[name]
+
+        run = self._plan(cells)
+        results = []
+        failed = False
+        touched: Set[str] = set()
+        for cell in cells:
+            if cell.index not in run:
+                previous = self.outputs.get(cell.key, {})
+                results.append({**previous, "index": cell.index, "line": cell.line, "status": "reused"})
+                continue
+            if failed:
+                self.executed.discard(cell.key)
+                results.append({"index": cell.index, "line": cell.line, "status": "skipped"})
+                continue
+            result = self._run_cell(cell, options)
+            if result["error"] is None:
+                result["status"] = "executed"
+                self.executed.add(cell.key)
+                for name in cell.writes:
+                    self.versions[name] = cell.key
+                touched |= cell.writes
+            else:
+                result["status"] = "error"
+                self.executed.discard(cell.key)
+                failed = True
+            self.outputs[cell.key] = {k: result[k] for k in ("stdout", "error", "plots")}
+            results.append(result)
+
+        live = {cell.key for cell in cells}
+        self.executed &= live
+        self.outputs = {key: output for key, output in self.outputs.items() if key in live}
+        executed = sum(r["status"] in ("executed", "error") for r in results)
+        reply = {
+            "type": "result",
+            "cells": results,
+            "executed": executed,
+            "reused": sum(r["status"] == "reused" for r in results),
+            "failed": failed,
+            "execute_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+        artifacts = self._gdsfactory_artifacts if self.kind == "gdsfactory" else self._perceval_artifacts
+        try:
+            reply.update(artifacts(touched if executed else None, options))
+        except Exception as e:
+            reply["artifact_error"] = f"{type(e).__name__}: {e}"
+        reply["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return reply
+
+    def _gdsfactory_artifacts(self, touched: Optional[Set[str]], options: SimpleNamespace) -> Dict[str, Any]:
+        """
+        The preview of the first component in the namespace. It is only
+        re-rendered if a cell that ran wrote it and its geometry changed.
+        """
+        import gdsfactory as gf
+        name = next(
+            (k for k, v in self.namespace.items() if not k.startswith("_") and isinstance(v, gf.Component)),
+            None,
+        )
+        if name is None:
+            self._preview = None
+            return {"preview": None, "preview_changed": True}
+        component = self.namespace[name]
+        if self._preview is not None and self._preview[:2] == (name, id(component)) and name not in (touched or ()):
+            return {"preview": None, "preview_changed": False}
+
+        layout = tiles.register(component)
+        unchanged = self._preview == (name, id(component), layout.layout_id)
+        self._preview = (name, id(component), layout.layout_id)
+        if unchanged:
+            return {"preview": None, "preview_changed": False}
+        preview = rendering.render_layout(layout.polygons_by_layer(), layout.bbox, options, title=name)
+        return {
+            "preview": preview.to_data_url(),
+            "preview_changed": True,
+            "component": name,
+            "render_metrics": preview.metadata(),
+            "tiles": layout.metadata(),
+            "layout": layout,
+        }
+
+    def _perceval_artifacts(self, touched: Optional[Set[str]], options: SimpleNamespace) -> Dict[str, Any]:
+        """The unitary of the last circuit in the namespace, if any cell ran"""
+        if touched is None:
+            return {"unitary": None, "unitary_changed": False}
+        pcvl = self._preload["pcvl"]
+        circuits = [v for k, v in self.namespace.items() if not k.startswith("_") and isinstance(v, pcvl.Circuit)]
+        if not circuits:
+            return {"unitary": None, "unitary_changed": True}
+        u_matrix = np.asarray(circuits[-1].compute_unitary())
+        if np.iscomplexobj(u_matrix):
+            u_matrix = complex_matrix_rows(u_matrix)
+        return {"unitary": dumps(u_matrix).decode("utf-8"), "unitary_changed": True}
+
+    def handle(self, message: Tuple) -> Dict[str, Any]:
+        if message[0] == "execute":
+            return self.execute(*message[1:])
+        if message[0] == "reset":
+            self.reset()
+            return {"type": "reset"}
+        raise ValueError(f"Unknown message '{message[0]}'")
+
+
+def _vm_size() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def serve(conn, kind: str, memory_limit: int) -> None:
+    """
+    Session-process entry point: serve kernel messages on ``conn`` until
+    the server closes it or the session outgrows ``memory_limit``
+    """
+    try:
+        kernel = Kernel(kind)
+    except Exception as e:
+        conn.send({"type": "error", "error": str(e)})
+        return
+    # Allocations past the limit fail with MemoryError instead of starving the host
+    vm = _vm_size()
+    if vm is not None:
+        try:
+            import resource
+            _, hard = resource.getrlimit(resource.RLIMIT_AS)
+            soft = vm + memory_limit
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+        except (ImportError, ValueError, OSError):
+            pass
+    baseline = forkserver.unique_memory()["unique_bytes"] or 0
+    conn.send({"type": "ready", "pid": os.getpid()})
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "close":
+            return
+        try:
+            reply = kernel.handle(message)
+        except Exception as e:
+            reply = {"type": "error", "error": f"{type(e).__name__}: {e}"}
+        memory = forkserver.unique_memory()
+        reply["memory"] = {**memory, "limit_bytes": memory_limit}
+        if memory["unique_bytes"] is not None and memory["unique_bytes"] - baseline > memory_limit:
+            reply["closing"] = "memory"
+        conn.send(reply)
+        if reply.get("closing"):
+            return
+
+
+class Session:
+    """Server-side handle on one kernel, in a session process or in-process"""
+
+    def __init__(self, kind: str, memory_limit: int = MEMORY_LIMIT):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown session kind '{kind}'. Use one of: {', '.join(KINDS)}")
+        self.session_id = secrets.token_urlsafe(16)
+        self.kind = kind
+        self.memory_limit = memory_limit
+        self.created = self.last_active = time.monotonic()
+        self.submissions = 0
+        self.closed = False
+        self.pid = None
+        self._conn = None
+        self._kernel = None
+        self._lock = threading.Lock()
+        if forkserver.ENABLED:
+            try:
+                self._conn, self.pid = forkserver.get_server().attach(f"{__name__}:serve", kind, memory_limit)
+            except forkserver.ExecutorUnavailable:
+                self._conn = None
+        if self._conn is None:
+            self._kernel = Kernel(kind)
+            return
+        if not self._conn.poll(STARTUP_TIMEOUT):
+            self.close()
+            raise RuntimeError("Session process did not start in time")
+        try:
+            ready = self._conn.recv()
+        except EOFError:
+            self.close()
+            raise RuntimeError("Session process exited during start-up")
+        if ready["type"] == "error":
+            self.close()
+            raise ValueError(ready["error"])
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def _request(self, message: Tuple, timeout: float = forkserver.TIMEOUT) -> Dict[str, Any]:
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Session is closed")
+            self.last_active = time.monotonic()
+            try:
+                if self._kernel is not None:
+                    return self._kernel.handle(message)
+                try:
+                    self._conn.send(message)
+                    if not self._conn.poll(timeout):
+                        self._close()
+                        raise forkserver.SnippetTimeout(f"Submission exceeded the {timeout:g} s time limit")
+                    reply = self._conn.recv()
+                except (EOFError, OSError):
+                    self._close()
+                    raise RuntimeError("Session process exited (out of memory?)")
+                # Keep the child's polygons for tile requests
+                if reply.get("layout") is not None:
+                    tiles.adopt(reply["layout"])
+                if reply.get("closing"):
+                    self._close()
+                return reply
+            finally:
+                self.last_active = time.monotonic()
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Answer one client message"""
+        kind = message.get("type")
+        if kind == "execute":
+            code = message.get("code")
+            if not isinstance(code, str):
+                raise ValueError("'execute' needs a 'code' string")
+            self.submissions += 1
+            reply = self._request(("execute", code, message.get("render")))
+            reply.pop("layout", None)
+            if reply.get("closing") == "memory":
+                reply["error"] = f"Session exceeded its {self.memory_limit // (1024 * 1024)} MB memory limit and was closed"
+            return reply
+        if kind == "reset":
+            return self._request(("reset",))
+        if kind == "ping":
+            self.last_active = time.monotonic()
+            return {"type": "pong"}
+        raise ValueError(f"Unknown message type '{kind}'. Use execute, reset or ping")
+
+    def _close(self) -> None:
+        self.closed = True
+        if self._conn is not None:
+            try:
+                self._conn.send(("close",))
+            except (OSError, ValueError):
+                pass
+            self._conn.close()
+            self._conn = None
+        if self.pid is not None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self._kernel = None
+
+    def close(self) -> None:
+        self._close()
+
+    def info(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "session_id": self.session_id,
+            "kind": self.kind,
+            "pid": self.pid,
+            "isolated": self.pid is not None,
+            "idle_timeout": IDLE_TIMEOUT,
+            "memory_limit_bytes": self.memory_limit if self.pid is not None else None,
+            "age_seconds": round(now - self.created, 3),
+            "idle_seconds": round(now - self.last_active, 3),
+            "submissions": self.submissions,
+        }
+
+
+class SessionManager:
+    """Open sessions by id, with idle expiry and a session count limit"""
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, max_sessions: int = MAX_SESSIONS):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.expired = 0
+
+    def open(self, kind: str, session_id: Optional[str] = None) -> Session:
+        """Resume ``session_id`` if it is still open, otherwise start a new session"""
+        self.reap()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and session.kind == kind and not session.closed:
+                session.last_active = time.monotonic()
+                return session
+            if len(self._sessions) >= self.max_sessions:
+                raise RuntimeError(f"Too many open sessions (limit {self.max_sessions})")
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_forever, daemon=True, name="kernel-reaper")
+                self._reaper.start()
+        session = Session(kind)
+        with self._lock:
+            self._sessions[session.session_id] = session
+        return session
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+
+    def reap(self) -> None:
+        """Close sessions idle for longer than the timeout, and forget closed ones"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                s for s in self._sessions.values()
+                if s.closed or (not s.busy and now - s.last_active > self.idle_timeout)
+            ]
+            for session in expired:
+                del self._sessions[session.session_id]
+                self.expired += not session.closed
+        for session in expired:
+            session.close()
+
+    def _reap_forever(self) -> None:
+        while True:
+            time.sleep(min(60.0, self.idle_timeout / 2))
+            self.reap()
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        self.reap()
+        with self._lock:
+            sessions = [s.info() for s in self._sessions.values()]
+        return {
+            "open": len(sessions),
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "expired": self.expired,
+            "sessions": sessions,
+        }
+
+
+sessions = SessionManager()
@@ -0,0 +1,206 @@
+"""
+Monte-Carlo noise engine for quantum network links.
+
+Every edge runs many heralded entanglement attempts. An attempt either
+detects a photon (channel transmittance x detector efficiency), clicks on
+a dark count only, heralding a maximally mixed state (fidelity 1/4), or
+does nothing. Per edge, the photon detections are drawn as one binomial
+over all attempts and the dark-count-only clicks as one binomial over the
+attempts left, in float64, so even tiny probabilities keep their value.
+Storage times are drawn only for the detected photons, in chunks.
+
+A heralded photon pair starts as a Werner state with the source fidelity. It
+is depolarized along the fiber, and decoheres in memory during the classical
+heralding round trip plus a random wait before it is used. The engine
+returns per-edge means with normal-approximation confidence intervals.
+Work is split into seeded shards (see ``sharding``), so results are
+reproducible for a given seed whatever the number of worker processes.
+"""
+import time
+from statistics import NormalDist
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    from quantum_backend import sharding
+except ImportError:
+    import sharding
+
+SPEED_OF_LIGHT_FIBER = 2e5  # km/s
+
+# Storage-time draws per chunk (32 MiB of float64)
+MAX_CHUNK_ELEMENTS = 1 << 22
+# Edge-attempts per shard, small enough that typical requests spread over the
+# pool; shard boundaries never depend on the worker count
+SHARD_ELEMENTS = 1 << 20
+
+MAX_ATTEMPTS_PER_EDGE = 10 ** 9
+
+
+def werner_parameter(fidelity):
+    return (4 * np.asarray(fidelity, dtype=float) - 1) / 3
+
+
+def werner_fidelity(w):
+    return (1 + 3 * w) / 4
+
+
+def _simulate_shard(
+    lo: int,
+    distances: np.ndarray,
+    transmittance: np.ndarray,
+    attempts: int,
+    seed: np.random.SeedSequence,
+    params: Dict[str, float],
+):
+    """
+    Run ``attempts`` attempts on a block of edges starting at edge ``lo``.
+    Returns (lo, photon counts, click counts, fidelity sum, fidelity^2 sum).
+    """
+    rng = np.random.default_rng(seed)
+    num_edges = len(distances)
+    p_photon = np.clip(transmittance * params["detector_efficiency"], 0.0, 1.0)
+    photon_counts = rng.binomial(attempts, p_photon).astype(np.int64)
+    # Attempts without a photon click on a dark count alone
+    click_counts = photon_counts + rng.binomial(attempts - photon_counts, params["dark_count_probability"])
+
+    # Werner parameter after the fiber, and the deterministic part of storage time
+    w_fiber = werner_parameter(params["initial_fidelity"]) * np.exp(-distances / params["depolarization_length"])
+    heralding_delay = 2 * distances / SPEED_OF_LIGHT_FIBER
+
+    fidelity_sum = np.zeros(num_edges)
+    fidelity_sq_sum = np.zeros(num_edges)
+
+    # Detected photons, numbered edge by edge, in chunks
+    ends = np.cumsum(photon_counts)
+    total = int(ends[-1]) if num_edges else 0
+    for start in range(0, total, MAX_CHUNK_ELEMENTS):
+        stop = min(start + MAX_CHUNK_ELEMENTS, total)
+        rows = np.searchsorted(ends, np.arange(start, stop), side="right")
+        storage = heralding_delay[rows] + rng.exponential(params["memory_wait_time"], stop - start)
+        fidelity = werner_fidelity(w_fiber[rows] * np.exp(-storage / params["memory_coherence_time"]))
+        fidelity_sum += np.bincount(rows, weights=fidelity, minlength=num_edges)
+        fidelity_sq_sum += np.bincount(rows, weights=fidelity ** 2, minlength=num_edges)
+    return lo, photon_counts, click_counts, fidelity_sum, fidelity_sq_sum
+
+
+def simulate_links(
+    distances: np.ndarray,
+    transmittance: np.ndarray,
+    attempts: int,
+    seed: Optional[int] = None,
+    workers: Optional[int] = None,
+    attempt_rate: float = 1e6,
+    detector_efficiency: float = 0.1,
+    dark_count_probability: float = 1e-6,
+    initial_fidelity: float = 0.95,
+    depolarization_length: float = 10.0,
+    memory_coherence_time: float = 1e-3,
+    memory_wait_time: float = 1e-5,
+    confidence: float = 0.95,
+) -> Dict[str, Any]:
+    """
+    Run ``attempts`` entanglement attempts on each edge.
+    ``distances`` are in km and ``transmittance`` is the channel loss factor
+    per edge (see ``calculate_channel_loss``). The work is sharded over
+    ``workers`` processes. Results depend only on ``seed``, not on the
+    worker count. Returns per-edge arrays.
+    """
+    if not 0 < attempts <= MAX_ATTEMPTS_PER_EDGE:
+        raise ValueError(f"attempts must be between 1 and {MAX_ATTEMPTS_PER_EDGE}")
+    distances = np.asarray(distances, dtype=float)
+    transmittance = np.asarray(transmittance, dtype=float)
+    num_edges = len(distances)
+    params = {
+        "detector_efficiency": detector_efficiency,
+        "dark_count_probability": dark_count_probability,
+        "initial_fidelity": initial_fidelity,
+        "depolarization_length": depolarization_length,
+        "memory_coherence_time": memory_coherence_time,
+        "memory_wait_time": memory_wait_time,
+    }
+
+    # Shard over blocks of edges and blocks of attempts
+    edges_per_shard = max(1, min(num_edges, SHARD_ELEMENTS))
+    attempts_per_shard = max(1, SHARD_ELEMENTS // edges_per_shard)
+    blocks = [
+        (lo, hi, a_hi - a_lo)
+        for lo, hi in sharding.shard_bounds(num_edges, edges_per_shard)
+        for a_lo, a_hi in sharding.shard_bounds(attempts, attempts_per_shard)
+    ]
+    seeds = sharding.spawn_seeds(seed, len(blocks))
+    shard_args = [
+        (lo, distances[lo:hi], transmittance[lo:hi], count, shard_seed, params)
+        for (lo, hi, count), shard_seed in zip(blocks, seeds)
+    ]
+
+    photon_counts = np.zeros(num_edges, dtype=np.int64)
+    click_counts = np.zeros(num_edges, dtype=np.int64)
+    fidelity_sum = np.zeros(num_edges)
+    fidelity_sq_sum = np.zeros(num_edges)
+
+    def merge(acc, part):
+        lo, photons, clicks, f_sum, f_sq_sum = part
+        hi = lo + len(photons)
+        photon_counts[lo:hi] += photons
+        click_counts[lo:hi] += clicks
+        fidelity_sum[lo:hi] += f_sum
+        fidelity_sq_sum[lo:hi] += f_sq_sum
+        return acc
+
+    start = time.perf_counter()
+    sharding.run_sharded(_simulate_shard, shard_args, merge, workers=workers)
+    elapsed = time.perf_counter() - start
+
+    # Dark-count-only clicks herald a maximally mixed state
+    dark_counts = click_counts - photon_counts
+    fidelity_sum += 0.25 * dark_counts
+    fidelity_sq_sum += 0.0625 * dark_counts
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    success = click_counts / attempts
+    success_half_width = z * np.sqrt(success * (1 - success) / attempts)
+    success_ci = np.stack([success - success_half_width, success + success_half_width], axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fidelity_mean = fidelity_sum / click_counts
+        fidelity_var = np.maximum(fidelity_sq_sum / click_counts - fidelity_mean ** 2, 0.0)
+        fidelity_half_width = z * np.sqrt(fidelity_var / click_counts)
+        dark_fraction = dark_counts / click_counts
+
+    total_attempts = attempts * num_edges
+    return {
+        "attempts_per_edge": attempts,
+        "successes": click_counts,
+        "success_probability": success,
+        "success_probability_ci": success_ci,
+        "entanglement_rate": success * attempt_rate,
+        "entanglement_rate_ci": success_ci * attempt_rate,
+        "fidelity": np.where(click_counts > 0, fidelity_mean, np.nan),
+        "fidelity_ci": np.stack(
+            [fidelity_mean - fidelity_half_width, fidelity_mean + fidelity_half_width], axis=1
+        ),
+        "dark_count_fraction": np.where(click_counts > 0, dark_fraction, np.nan),
+        "confidence": confidence,
+        "shards": len(shard_args),
+        "workers": sharding.resolve_workers(workers),
+        "elapsed_seconds": elapsed,
+        "attempts_per_second": total_attempts / elapsed if elapsed > 0 else None,
+    }
+
+
+def link_statistics_by_edge(edge_keys, stats: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Re-key per-edge arrays as {"source-target": {...}} for the API response"""
+    per_edge = {}
+    for i, key in enumerate(edge_keys):
+        per_edge[key] = {
+            "successes": int(stats["successes"][i]),
+            "entanglement_rate": float(stats["entanglement_rate"][i]),
+            "entanglement_rate_ci": stats["entanglement_rate_ci"][i],
+            "fidelity": float(stats["fidelity"][i]),
+            "fidelity_ci": stats["fidelity_ci"][i],
+            "dark_count_fraction": float(stats["dark_count_fraction"][i]),
+        }
+    return per_edge
+
@@ -0,0 +1,351 @@
+"""
+Load-testing harness that replays recorded frontend traffic.
+
+``loadtest_fixtures.json`` holds requests shaped like the ones the pages
+send (circuit simulator, network simulator, BB84 card, Perceval and
+GDSFactory editors). Named mixes weight them per endpoint. The generator
+is open-loop: arrivals form a Poisson process at the offered rate, and
+latency is counted from each request's scheduled send time. A slow server
+can't hold arrivals back, so queueing shows up in the percentiles instead
+of being hidden (no coordinated omission).
+
+For each offered rate the report gives throughput, p50/p95/p99 latency and
+error rates, overall and per fixture. The resident memory of the server,
+including its fork server and worker children, is sampled throughout. The
+capacity is the highest rate that stays within the error and latency
+objectives:
+
+    python -m quantum_backend.loadtest --mix frontend --rates 1,2,4,8 --duration 30
+
+This starts a local uvicorn instance unless ``--url`` points at a running one.
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_fixtures.json")
+READY_PATH = "/api/render/stats"
+STARTUP_TIMEOUT = 120.0
+RSS_INTERVAL = 0.5
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, float]]]:
+    """Fixtures by name, and the named mixes"""
+    with open(path) as f:
+        data = json.load(f)
+    fixtures = {fixture["name"]: fixture for fixture in data["fixtures"]}
+    for name, weights in data["mixes"].items():
+        unknown = set(weights) - set(fixtures)
+        if unknown:
+            raise ValueError(f"Mix '{name}' refers to unknown fixtures: {', '.join(sorted(unknown))}")
+    return fixtures, data["mixes"]
+
+
+def parse_mix(spec: str, fixtures: Dict[str, Any], mixes: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """A named mix, or ``fixture=weight,...``"""
+    if spec in mixes:
+        return dict(mixes[spec])
+    weights = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in fixtures:
+            raise ValueError(f"Unknown mix or fixture '{name}'. Mixes: {', '.join(mixes)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """Resident memory of a process and all its descendants, from /proc (Linux)"""
+    children = defaultdict(list)
+    rss = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Fields after the parenthesized command: state, ppid, ...
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{entry}/statm") as f:
+                rss[int(entry)] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+        children[int(fields[1])].append(int(entry))
+    if pid not in rss:
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, ()))
+    return total
+
+
+def start_server(port: int, env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """Start the service under uvicorn on localhost"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "quantum_backend.quantum_service:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=root,
+        env={**os.environ, **(env or {})},
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, timeout: float = STARTUP_TIMEOUT) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url + READY_PATH)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not become ready within {timeout:g} s")
+
+
+async def sample_rss(pid: int, samples: List[Tuple[float, int]], origin: float, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        rss = process_tree_rss(pid)
+        if rss is not None:
+            samples.append((round(time.monotonic() - origin, 3), rss))
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _send(client: httpx.AsyncClient, url: str, fixture: Dict[str, Any], scheduled: float, serial: int, cold: bool):
+    body = fixture.get("body")
+    if cold and fixture.get("snippet"):
+        # A unique comment defeats the snippet cache
+        body = {**body, "code": body["code"] + f"\n# load test request {serial} {secrets.token_hex(4)}\n"}
+    started = time.monotonic()
+    status, error, size = None, None, 0
+    try:
+        response = await client.request(fixture["method"], url + fixture["path"], json=body)
+        status, size = response.status_code, len(response.content)
+        if status >= 400:
+            error = f"HTTP {status}"
+    except httpx.TimeoutException:
+        error = "timeout"
+    except httpx.TransportError as e:
+        error = type(e).__name__
+    finished = time.monotonic()
+    return {
+        "fixture": fixture["name"],
+        "status": status,
+        "error": error,
+        "bytes": size,
+        "latency_ms": (finished - scheduled) * 1000,
+        "service_ms": (finished - started) * 1000,
+    }
+
+
+async def run_step(
+    client: httpx.AsyncClient,
+    url: str,
+    fixtures: Dict[str, Dict[str, Any]],
+    weights: Dict[str, float],
+    rate: float,
+    duration: float,
+    rng: np.random.Generator,
+    cold: bool = False,
+) -> Tuple[List[Dict[str, Any]], float]:
+    """Offer ``rate`` requests/s for ``duration`` s. Returns the records and the wall time."""
+    names = list(weights)
+    p = np.array([weights[name] for name in names], dtype=float)
+    p /= p.sum()
+    arrivals = np.cumsum(rng.exponential(1 / rate, int(rate * duration * 2) + 16))
+    arrivals = arrivals[arrivals < duration]
+    choices = rng.choice(len(names), size=len(arrivals), p=p)
+
+    origin = time.monotonic()
+    tasks = []
+    for serial, (offset, choice) in enumerate(zip(arrivals, choices)):
+        delay = origin + offset - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(
+            _send(client, url, fixtures[names[choice]], origin + offset, serial, cold)
+        ))
+    records = await asyncio.gather(*tasks)
+    return list(records), max(duration, time.monotonic() - origin)
+
+
+def summarize(records: Sequence[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    latencies = np.array([r["latency_ms"] for r in records if r["error"] is None])
+    errors = defaultdict(int)
+    for r in records:
+        if r["error"] is not None:
+            errors[r["error"]] += 1
+    summary = {
+        "sent": len(records),
+        "ok": int(len(latencies)),
+        "errors": dict(errors),
+        "error_rate": round(sum(errors.values()) / len(records), 4) if records else 0.0,
+        "throughput": round(len(latencies) / duration, 3) if duration > 0 else None,
+        "mean_bytes": round(float(np.mean([r["bytes"] for r in records])), 1) if records else 0,
+    }
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary.update(p50_ms=round(p50, 1), p95_ms=round(p95, 1), p99_ms=round(p99, 1), max_ms=round(latencies.max(), 1))
+    return summary
+
+
+def capacity(steps: Sequence[Dict[str, Any]], slo_ms: float, max_error_rate: float) -> Dict[str, Any]:
+    """The highest offered rate whose step met the objectives"""
+    sustained = None
+    for step in steps:
+        overall = step["overall"]
+        if (
+            overall["error_rate"] <= max_error_rate
+            and overall.get("p95_ms", float("inf")) <= slo_ms
+            and overall["throughput"] >= 0.9 * step["achieved_rate"]
+        ):
+            sustained = step
+    return {
+        "slo_p95_ms": slo_ms,
+        "max_error_rate": max_error_rate,
+        "sustained_rate": sustained["offered_rate"] if sustained else None,
+        "per_fixture": sustained["fixtures"] if sustained else None,
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Markdown tables: one row per rate step, then per fixture at the sustained rate"""
+    lines = [
+        f"# Capacity report: mix `{report['mix']}`",
+        "",
+        "| offered/s | sent | ok/s | errors | p50 ms | p95 ms | p99 ms | peak RSS MB |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for step in report["steps"]:
+        o = step["overall"]
+        rss = step.get("peak_rss_bytes")
+        rss_mb = f"{rss / 2**20:.0f}" if rss else "-"
+        lines.append(
+            f"| {step['offered_rate']:g} | {o['sent']} | {o['throughput']} | {o['error_rate']:.2%} "
+            f"| {o.get('p50_ms', '-')} | {o.get('p95_ms', '-')} | {o.get('p99_ms', '-')} | {rss_mb} |"
+        )
+    cap = report["capacity"]
+    lines += ["", f"Sustained rate (p95 <= {cap['slo_p95_ms']:g} ms, errors <= {cap['max_error_rate']:.1%}): "
+              f"{cap['sustained_rate'] if cap['sustained_rate'] is not None else 'none'} req/s"]
+    if cap["per_fixture"]:
+        lines += ["", "| fixture | sent | errors | p50 ms | p95 ms | p99 ms |", "|---|---|---|---|---|---|"]
+        for name, f in sorted(cap["per_fixture"].items()):
+            lines.append(
+                f"| {name} | {f['sent']} | {f['error_rate']:.2%} | {f.get('p50_ms', '-')} "
+                f"| {f.get('p95_ms', '-')} | {f.get('p99_ms', '-')} |"
+            )
+    return "\n".join(lines)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fixtures, mixes = load_fixtures(args.fixtures)
+    weights = parse_mix(args.mix, fixtures, mixes)
+    rates = [float(r) for r in args.rates.split(",")]
+    rng = np.random.default_rng(args.seed)
+
+    server = None
+    url = args.url.rstrip("/") if args.url else f"http://127.0.0.1:{args.port}"
+    pid = args.server_pid
+    if not args.url:
+        server = start_server(args.port)
+        pid = server.pid
+
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    rss_samples: List[Tuple[float, int]] = []
+    stop = asyncio.Event()
+    origin = time.monotonic()
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            await wait_ready(client, url)
+            sampler = asyncio.create_task(sample_rss(pid, rss_samples, origin, stop)) if pid else None
+            if args.warmup:
+                # One request per fixture so start-up costs don't land in the first step
+                await asyncio.gather(*(_send(client, url, fixtures[name], time.monotonic(), -1, False) for name in weights))
+
+            steps = []
+            for rate in rates:
+                step_start = time.monotonic() - origin
+                records, elapsed = await run_step(client, url, fixtures, weights, rate, args.duration, rng, args.cold)
+                step_end = time.monotonic() - origin
+                by_fixture = defaultdict(list)
+                for record in records:
+                    by_fixture[record["fixture"]].append(record)
+                step_rss = [rss for t, rss in rss_samples if step_start <= t <= step_end]
+                steps.append({
+                    "offered_rate": rate,
+                    "achieved_rate": round(len(records) / args.duration, 3),
+                    "elapsed_seconds": round(elapsed, 3),
+                    "overall": summarize(records, elapsed),
+                    "fixtures": {name: summarize(rs, elapsed) for name, rs in by_fixture.items()},
+                    "peak_rss_bytes": max(step_rss) if step_rss else None,
+                })
+                print(f"rate {rate:g}/s: {json.dumps(steps[-1]['overall'])}", file=sys.stderr)
+            stop.set()
+            if sampler:
+                await sampler
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    return {
+        "mix": args.mix,
+        "weights": weights,
+        "url": url,
+        "duration_per_step": args.duration,
+        "cold_snippets": args.cold,
+        "steps": steps,
+        "capacity": capacity(steps, args.slo_ms, args.max_error_rate),
+        "rss_timeline": rss_samples,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mix", default="frontend", help="named mix or fixture=weight,...")
+    parser.add_argument("--rates", default="1,2,4,8", help="offered request rates (req/s), one step each")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per rate step")
+    parser.add_argument("--url", help="target a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765, help="port for the local server")
+    parser.add_argument("--server-pid", type=int, help="pid to sample RSS from when using --url")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--cold", action="store_true", help="make every snippet unique to bypass the snippet cache")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout (s)")
+    parser.add_argument("--max-connections", type=int, default=512)
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="p95 latency objective")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Compact measurement outputs for simulated state vectors.
+
+Instead of returning all 2**N amplitudes, the circuit endpoint can return
+sampled counts for a number of shots or the k most likely basis states.
+
+Counts are sampled by the simulator: state vector devices run with shots,
+and an MPS is sampled site by site from its tensors (``sample_mps``), so
+no state vector is returned and the response grows with the shots. The
+top k need the whole distribution and are taken from the state vector,
+chunk by chunk, so they never need a second dense 2**N array. The batch
+endpoint also samples counts this way from the states it already holds.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+OUTPUT_MODES = ("state", "counts", "top_k")
+
+# Amplitudes processed per chunk
+CHUNK_SIZE = 1 << 18
+
+MAX_SHOTS = 10_000_000
+# Shots drawn when a state too large to return is sampled instead
+DEFAULT_SHOTS = 1000
+MAX_TOP_K = 100_000
+
+# Approximate JSON bytes per returned basis state
+BYTES_PER_ENTRY = 64
+
+# Shots x bond dimension amplitudes held at once while sampling an MPS
+MPS_SAMPLE_ELEMENTS = 1 << 20
+
+
+def validate_output(mode: str, shots: Optional[int], top_k: Optional[int]) -> None:
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode '{mode}'. Use one of: {', '.join(OUTPUT_MODES)}")
+    if mode == "counts" and not (shots and 0 < shots <= MAX_SHOTS):
+        raise ValueError(f"'counts' output needs 1 <= shots <= {MAX_SHOTS}")
+    if mode == "top_k" and not (top_k and 0 < top_k <= MAX_TOP_K):
+        raise ValueError(f"'top_k' output needs 1 <= top_k <= {MAX_TOP_K}")
+
+
+def sampled_output_bytes(num_wires: int, mode: str, shots: Optional[int] = None, top_k: Optional[int] = None,
+                         from_state: bool = False) -> int:
+    """
+    Memory for a counts/top-k response. Counts sampled by the simulator
+    only hold the entries; top-k, or counts sampled from a returned state
+    (``from_state``), also hold a copy of the state vector.
+    """
+    entries = min((shots if mode == "counts" else top_k) or 0, 2 ** num_wires)
+    state = (2 ** num_wires) * 16 if mode == "top_k" or from_state else 0
+    return state + entries * BYTES_PER_ENTRY
+
+
+def _chunk_probabilities(chunk: np.ndarray) -> np.ndarray:
+    if np.iscomplexobj(chunk):
+        return chunk.real ** 2 + chunk.imag ** 2
+    return chunk ** 2
+
+
+def _chunk_bounds(size: int, chunk_size: int):
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+def sample_counts(
+    state: np.ndarray,
+    shots: int,
+    rng: np.random.Generator,
+    chunk_size: int = CHUNK_SIZE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Draw ``shots`` computational-basis samples from a state vector.
+    Shots are first split across chunks by their total probability, then
+    sampled within each chunk. Returns (basis indices, counts), sorted by index.
+    """
+    state = np.asarray(state).ravel()
+    bounds = _chunk_bounds(len(state), chunk_size)
+    masses = np.array([_chunk_probabilities(state[lo:hi]).sum() for lo, hi in bounds])
+    shots_per_chunk = rng.multinomial(shots, masses / masses.sum())
+
+    indices, counts = [], []
+    for (lo, hi), chunk_shots in zip(bounds, shots_per_chunk):
+        if not chunk_shots:
+            continue
+        probs = _chunk_probabilities(state[lo:hi])
+        chunk_counts = rng.multinomial(chunk_shots, probs / probs.sum())
+        nonzero = np.flatnonzero(chunk_counts)
+        indices.append(nonzero + lo)
+        counts.append(chunk_counts[nonzero])
+    if not indices:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(indices), np.concatenate(counts)
+
+
+def sample_mps(tensors: Sequence[np.ndarray], shots: int, rng: np.random.Generator) -> Dict[str, int]:
+    """
+    Draw ``shots`` computational-basis samples from a right-canonical MPS,
+    given as site tensors shaped (left bond, 2, right bond). All shots are
+    drawn together, one site at a time: each shot keeps its left environment
+    vector, and in right-canonical form the probability of the next bit is
+    the squared norm of the environment times that bit's slice. Memory is
+    shots x bond dimension per chunk. Returns counts by bitstring.
+    """
+    num_wires = len(tensors)
+    chunk_size = max(1, MPS_SAMPLE_ELEMENTS // max(t.shape[2] for t in tensors))
+    counts: Dict[str, int] = {}
+    for lo in range(0, shots, chunk_size):
+        size = min(chunk_size, shots - lo)
+        env = np.ones((size, 1), dtype=complex)
+        bits = np.empty((size, num_wires), dtype=np.uint8)
+        for site, tensor in enumerate(tensors):
+            zero, one = env @ tensor[:, 0, :], env @ tensor[:, 1, :]
+            p_zero = _chunk_probabilities(zero).sum(axis=1)
+            p_one = _chunk_probabilities(one).sum(axis=1)
+            take_one = rng.random(size) * (p_zero + p_one) >= p_zero
+            bits[:, site] = take_one
+            env = np.where(take_one[:, None], one, zero)
+            env /= np.sqrt(np.where(take_one, p_one, p_zero))[:, None]
+        rows, row_counts = np.unique(bits, axis=0, return_counts=True)
+        labels = np.ascontiguousarray(rows + ord("0")).view(f"S{num_wires}").ravel()
+        for label, count in zip(labels, row_counts.tolist()):
+            label = label.decode()
+            counts[label] = counts.get(label, 0) + count
+    return counts
+
+
+def top_k_states(state: np.ndarray, k: int, chunk_size: int = CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k most likely basis states, keeping a running top-k across chunks.
+    Returns (basis indices, probabilities), most likely first.
+    """
+    state = np.asarray(state).ravel()
+    best_idx = np.empty(0, dtype=np.int64)
+    best_prob = np.empty(0, dtype=float)
+    for lo, hi in _chunk_bounds(len(state), chunk_size):
+        probs = _chunk_probabilities(state[lo:hi])
+        if len(probs) > k:
+            keep = np.argpartition(probs, -k)[-k:]
+        else:
+            keep = np.arange(len(probs))
+        best_idx = np.concatenate([best_idx, keep + lo])
+        best_prob = np.concatenate([best_prob, probs[keep]])
+        if len(best_prob) > k:
+            keep = np.argpartition(best_prob, -k)[-k:]
+            best_idx, best_prob = best_idx[keep], best_prob[keep]
+    order = np.argsort(-best_prob, kind="stable")
+    return best_idx[order], best_prob[order]
+
+
+def bitstrings(indices: np.ndarray, num_wires: int) -> List[str]:
+    """Basis-state labels, wire 0 as the most significant bit (PennyLane order)"""
+    return [np.binary_repr(int(index), width=num_wires) for index in indices]
+
+
+def measurement_output(
+    state: np.ndarray,
+    num_wires: int,
+    mode: str,
+    shots: Optional[int] = None,
+    top_k: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> Tuple[Dict[str, Any], List[str], np.ndarray]:
+    """
+    Build the response fields for a counts or top-k request from a state.
+    Returns (fields, labels, values) where labels/values feed the histogram.
+    """
+    if mode == "counts":
+        rng = np.random.default_rng(seed)
+        indices, counts = sample_counts(state, shots, rng)
+        return counts_output(dict(zip(bitstrings(indices, num_wires), counts.tolist())), shots)
+
+    indices, probabilities = top_k_states(state, top_k)
+    labels = bitstrings(indices, num_wires)
+    return (
+        {
+            "top_k": [
+                {"state": label, "index": int(index), "probability": float(prob)}
+                for label, index, prob in zip(labels, indices, probabilities)
+            ],
+            "probability_mass": float(probabilities.sum()),
+        },
+        labels,
+        probabilities,
+    )
+
+
+def counts_output(counts: Dict[str, int], shots: int) -> Tuple[Dict[str, Any], List[str], np.ndarray]:
+    """Response fields for counts by bitstring, as ``measurement_output`` returns them"""
+    labels = sorted(counts)
+    values = np.array([counts[label] for label in labels], dtype=float)
+    return (
+        {"shots": shots, "counts": {label: counts[label] for label in labels}},
+        labels,
+        values / shots,
+    )
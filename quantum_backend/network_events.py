@@ -0,0 +1,256 @@
+"""
+Discrete-event simulation of entanglement distribution over repeater chains.
+
+Each connection request follows its shortest path through the network.
+Time-ordered events drive the simulation, on a binary heap:
+
+- ``GENERATE``: a link heralds an elementary pair. The failed attempts
+  before it are skipped with one geometric draw, but still counted.
+- ``SWAP_DONE``: a repeater's Bell measurement result reaches both ends of
+  the merged pair after the classical signalling delay.
+- ``EXPIRE``: a stored pair hits its memory cutoff and is discarded.
+
+Pairs are Werner states. Their Werner parameter decays in memory with the
+coherence times of the two nodes that hold them. Decay is applied lazily
+whenever a pair is swapped or delivered.
+
+Events are plain tuples, and per-route state is kept in flat Python lists
+indexed by path position. A run with thousands of nodes and millions of
+events therefore allocates almost nothing per event.
+"""
+import heapq
+import itertools
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+SPEED_OF_LIGHT_FIBER = 2e5  # km/s
+
+GENERATE, SWAP_DONE, EXPIRE = 0, 1, 2
+
+MAX_EVENTS = 20_000_000
+
+
+def werner_fidelity(w: float) -> float:
+    return (1 + 3 * w) / 4
+
+
+class _Route:
+    """Flat per-route state. Segment arrays are indexed by their left path position."""
+
+    __slots__ = (
+        "nodes", "hop_distance", "cum_distance", "hop_p", "hop_period", "hop_w0",
+        "decay", "swap_eff", "generating", "covered_by",
+        "seg_end", "seg_w", "seg_t", "seg_ready", "seg_token",
+        "delivered", "fidelity_sum", "fidelity_sq_sum", "attempts",
+        "swaps", "swap_failures", "expired", "latency_sum", "first_gen",
+    )
+
+    def __init__(self, nodes, hop_distance, hop_p, hop_period, hop_w0, decay, swap_eff):
+        n = len(nodes)
+        self.nodes = nodes
+        self.hop_distance = hop_distance
+        self.cum_distance = [0.0] + list(itertools.accumulate(hop_distance))
+        self.hop_p = hop_p
+        self.hop_period = hop_period
+        self.hop_w0 = hop_w0
+        self.decay = decay  # 1/T2 per path position
+        self.swap_eff = swap_eff
+        self.generating = [False] * (n - 1)
+        self.covered_by = [-1] * (n - 1)  # left position of the segment covering each hop
+        self.seg_end = [-1] * n
+        self.seg_w = [0.0] * n
+        self.seg_t = [0.0] * n
+        self.seg_ready = [0.0] * n
+        self.seg_token = [0] * n
+        self.delivered = 0
+        self.fidelity_sum = 0.0
+        self.fidelity_sq_sum = 0.0
+        self.attempts = 0
+        self.swaps = 0
+        self.swap_failures = 0
+        self.expired = 0
+        self.latency_sum = 0.0
+        self.first_gen = [0.0] * n
+
+
+def simulate(
+    routes: Sequence[Sequence[int]],
+    hop_distances: Sequence[Sequence[float]],
+    coherence_time: np.ndarray,
+    swap_efficiency: np.ndarray,
+    duration: float,
+    rng: np.random.Generator,
+    transmittance_fn=None,
+    detector_efficiency: float = 0.1,
+    attempt_rate: float = 1e6,
+    initial_fidelity: float = 0.95,
+    depolarization_length: float = 10.0,
+    cutoff_time: Optional[float] = None,
+    max_events: int = MAX_EVENTS,
+) -> Dict[str, Any]:
+    """
+    Run the event loop until ``duration`` seconds of simulated time or
+    ``max_events`` events. ``routes`` are node index paths and
+    ``hop_distances`` their per-hop lengths in km. ``coherence_time``
+    (seconds) and ``swap_efficiency`` are per node.
+    """
+    if duration <= 0:
+        raise ValueError("duration must be positive")
+    if max_events > MAX_EVENTS:
+        raise ValueError(f"max_events must be at most {MAX_EVENTS}")
+    if transmittance_fn is None:
+        transmittance_fn = lambda d: 10 ** (-0.2 * np.asarray(d) / 10)
+
+    w_source = (4 * initial_fidelity - 1) / 3
+    state: List[_Route] = []
+    for nodes, distances in zip(routes, hop_distances):
+        distances = np.asarray(distances, dtype=float)
+        p = np.clip(transmittance_fn(distances) * detector_efficiency, 1e-300, 1.0)
+        period = 2 * distances / SPEED_OF_LIGHT_FIBER + 1.0 / attempt_rate
+        w0 = w_source * np.exp(-distances / depolarization_length)
+        decay = [1.0 / coherence_time[n] for n in nodes]
+        swap = [float(swap_efficiency[n]) for n in nodes]
+        state.append(_Route(list(nodes), distances.tolist(), p.tolist(), period.tolist(), w0.tolist(), decay, swap))
+
+    heap: list = []
+    seq = itertools.count()
+    push = heapq.heappush
+    pop = heapq.heappop
+    geometric = rng.geometric
+    uniform = rng.random
+
+    def start_generation(r: int, route: _Route, hop: int, now: float) -> None:
+        if route.generating[hop] or route.covered_by[hop] >= 0:
+            return
+        route.generating[hop] = True
+        k = int(geometric(route.hop_p[hop]))
+        route.attempts += k
+        push(heap, (now + k * route.hop_period[hop], next(seq), GENERATE, r, hop, 0))
+
+    def release(r: int, route: _Route, left: int, now: float) -> None:
+        # Free the memories of a segment and restart generation on its hops
+        right = route.seg_end[left]
+        route.seg_end[left] = -1
+        route.seg_token[left] += 1
+        for hop in range(left, right):
+            route.covered_by[hop] = -1
+        for hop in range(left, right):
+            start_generation(r, route, hop, now)
+
+    def w_at(route: _Route, left: int, now: float) -> float:
+        right = route.seg_end[left]
+        age = now - route.seg_t[left]
+        return route.seg_w[left] * math.exp(-age * (route.decay[left] + route.decay[right]))
+
+    def place(r: int, route: _Route, left: int, right: int, w: float, t_ref: float, ready: float, origin: float) -> int:
+        route.seg_end[left] = right
+        route.seg_w[left] = w
+        route.seg_t[left] = t_ref
+        route.seg_ready[left] = ready
+        route.seg_token[left] += 1
+        route.first_gen[left] = origin
+        for hop in range(left, right):
+            route.covered_by[hop] = left
+        if cutoff_time is not None:
+            push(heap, (t_ref + cutoff_time, next(seq), EXPIRE, r, left, route.seg_token[left]))
+        return route.seg_token[left]
+
+    def try_swap(r: int, route: _Route, node: int, now: float) -> None:
+        # Swap at an intermediate path position holding two ready segments
+        if node == 0 or node == len(route.nodes) - 1:
+            return
+        left = route.covered_by[node - 1]
+        if left < 0 or route.seg_end[left] != node or route.seg_ready[left] > now:
+            return
+        if route.seg_end[node] < 0 or route.seg_ready[node] > now:
+            return
+        right = route.seg_end[node]
+        route.swaps += 1
+        if uniform() >= route.swap_eff[node]:
+            route.swap_failures += 1
+            release(r, route, node, now)
+            release(r, route, left, now)
+            return
+        w = w_at(route, left, now) * w_at(route, node, now)
+        origin = min(route.first_gen[left], route.first_gen[node])
+        route.seg_end[node] = -1
+        route.seg_token[node] += 1
+        delay = max(
+            route.cum_distance[node] - route.cum_distance[left],
+            route.cum_distance[right] - route.cum_distance[node],
+        ) / SPEED_OF_LIGHT_FIBER
+        token = place(r, route, left, right, w, now, now + delay, origin)
+        push(heap, (now + delay, next(seq), SWAP_DONE, r, left, token))
+
+    def segment_ready(r: int, route: _Route, left: int, now: float) -> None:
+        right = route.seg_end[left]
+        if left == 0 and right == len(route.nodes) - 1:
+            fidelity = werner_fidelity(w_at(route, left, now))
+            route.delivered += 1
+            route.fidelity_sum += fidelity
+            route.fidelity_sq_sum += fidelity * fidelity
+            route.latency_sum += now - route.first_gen[left]
+            release(r, route, left, now)
+            return
+        try_swap(r, route, left, now)
+        if route.seg_end[left] == right:
+            try_swap(r, route, right, now)
+
+    for r, route in enumerate(state):
+        for hop in range(len(route.nodes) - 1):
+            start_generation(r, route, hop, 0.0)
+
+    events = 0
+    wall_start = time.perf_counter()
+    now = 0.0
+    while heap and events < max_events:
+        now, _, kind, r, index, token = pop(heap)
+        if now > duration:
+            now = duration
+            break
+        events += 1
+        route = state[r]
+        if kind == GENERATE:
+            route.generating[index] = False
+            place(r, route, index, index + 1, route.hop_w0[index], now, now, now)
+            segment_ready(r, route, index, now)
+        elif kind == SWAP_DONE:
+            if route.seg_token[index] == token:
+                segment_ready(r, route, index, now)
+        elif route.seg_token[index] == token and route.seg_end[index] >= 0:
+            route.expired += 1
+            release(r, route, index, now)
+    wall = time.perf_counter() - wall_start
+
+    results = []
+    for route in state:
+        delivered = route.delivered
+        mean = route.fidelity_sum / delivered if delivered else None
+        std = (
+            math.sqrt(max(route.fidelity_sq_sum / delivered - mean * mean, 0.0))
+            if delivered else None
+        )
+        results.append({
+            "path": route.nodes,
+            "length_km": route.cum_distance[-1],
+            "delivered_pairs": delivered,
+            "rate": delivered / now if now > 0 else 0.0,
+            "fidelity_mean": mean,
+            "fidelity_std": std,
+            "mean_latency": route.latency_sum / delivered if delivered else None,
+            "generation_attempts": route.attempts,
+            "swaps": route.swaps,
+            "swap_failures": route.swap_failures,
+            "expired_pairs": route.expired,
+        })
+    return {
+        "routes": results,
+        "simulated_time": now,
+        "events_processed": events,
+        "event_limit_reached": events >= max_events,
+        "wall_seconds": wall,
+        "events_per_second": events / wall if wall > 0 else None,
+    }
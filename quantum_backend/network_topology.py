@@ -0,0 +1,590 @@
+"""
+Columnar quantum network topologies and streaming bulk import.
+
+A ``Topology`` keeps a network as flat NumPy columns: node type codes,
+x/y positions, one float column per numeric node parameter, edge
+endpoints as node indices, and edge lengths. The simulate endpoint works
+on these columns, whether the network came from the JSON request or from
+a bulk import. It only builds a NetworkX graph for exact metrics on small
+networks and to route discrete-event requests.
+
+Bulk imports take node and edge lists as CSV (with a header row) or
+NDJSON, streamed chunk by chunk. Complete lines are parsed as they
+arrive, and their values go straight into growable arrays, so memory
+follows the final columns rather than one Python object per node or link.
+Parquet is also accepted when pyarrow is installed. It needs the whole
+file, so it is spooled to disk and read back in record batches.
+
+Node columns: ``id`` (optional), ``type``, ``x``, ``y``. In NDJSON they
+can also be nested as ``position`` and ``parameters`` objects, as in the
+JSON API. Any other column is a numeric node parameter, and a missing
+value falls back to the simulation default. Edge columns: ``source`` and
+``target``. These are node ids, or row indices when the nodes have no ids.
+An optional ``distance`` (km) overrides the straight-line distance
+between the two positions.
+
+Imports are kept in memory under an id derived from the uploaded bytes.
+An edge import derives its id from its node import as well.
+
+Graph metrics are exact (NetworkX) on small graphs. Above
+``EXACT_METRIC_NODES`` nodes they come from a sparse adjacency matrix
+(SciPy): clustering is exact, and the average path length is estimated
+from a seeded sample of sources.
+"""
+import codecs
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+MAX_UPLOAD_BYTES = int(os.environ.get("QUANTUM_TOPOLOGY_MAX_UPLOAD_MB", "512")) * 2**20
+# Imported topologies kept in memory, least recently used dropped first
+MAX_TOPOLOGIES = int(os.environ.get("QUANTUM_TOPOLOGY_CACHE", "8"))
+# Above this many nodes, metrics come from the sparse adjacency matrix
+EXACT_METRIC_NODES = 1000
+# Sources sampled for the average shortest path length of large graphs
+PATH_SAMPLE_SOURCES = 64
+# Rows per batch when reading Parquet
+PARQUET_BATCH_ROWS = 65536
+
+FORMATS = ("csv", "ndjson", "parquet")
+_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/vnd.apache.parquet": "parquet",
+}
+
+NODE_COLUMNS = ("id", "type", "x", "y")
+EDGE_COLUMNS = ("source", "target", "distance")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def upload_format(fmt: Optional[str], content_type: Optional[str]) -> str:
+    """The import format from an explicit name, else from the content type"""
+    if fmt is None:
+        fmt = _CONTENT_TYPES.get((content_type or "").split(";")[0].strip().lower(), "csv")
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown topology format '{fmt}'. Expected one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+def _floats(values: Sequence[Any], name: str) -> np.ndarray:
+    """A column as float64, with empty cells and nulls as NaN"""
+    if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+        return values.astype(np.float64)
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return np.array([np.nan if v is None or v == "" else v for v in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f"Column '{name}' is not numeric")
+
+
+class _Column:
+    """A growable 1-D array"""
+
+    def __init__(self, dtype, fill=0, size: int = 0):
+        self.fill = fill
+        self.data = np.full(max(1024, size), fill, dtype=dtype)
+        self.size = size
+
+    def _reserve(self, extra: int) -> None:
+        needed = self.size + extra
+        if needed > len(self.data):
+            grown = np.full(max(needed, 2 * len(self.data)), self.fill, dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+    def extend(self, values: np.ndarray) -> None:
+        self._reserve(len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def pad(self, count: int) -> None:
+        self._reserve(count)
+        self.size += count
+
+    def array(self) -> np.ndarray:
+        """The values, trimmed in place; the column can't be extended afterwards"""
+        data, self.data = self.data, None
+        data.resize(self.size, refcheck=False)
+        return data
+
+
+class Topology:
+    """A network as node and edge columns"""
+
+    def __init__(
+        self,
+        topology_id: str,
+        type_names: List[str],
+        types: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        parameters: Dict[str, np.ndarray],
+        ids: Optional[List[str]] = None,
+        source: Optional[np.ndarray] = None,
+        target: Optional[np.ndarray] = None,
+        distance: Optional[np.ndarray] = None,
+        timings_ms: Optional[Dict[str, float]] = None,
+    ):
+        self.topology_id = topology_id
+        self.type_names = type_names  # type code -> name
+        self.types = types
+        self.x = x
+        self.y = y
+        self.parameters = parameters
+        self.ids = ids
+        self.source = np.zeros(0, dtype=np.int64) if source is None else source
+        self.target = np.zeros(0, dtype=np.int64) if target is None else target
+        self.distance = np.zeros(0) if distance is None else distance
+        self.timings_ms = timings_ms or {}
+        self._id_index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_network(cls, nodes: Sequence[Any], connections: Sequence[Dict[str, int]]) -> "Topology":
+        """The columns of a JSON network (NetworkNode models and source/target dicts)"""
+        builder = _NodeBuilder()
+        builder.append({
+            "type": [node.type for node in nodes],
+            "x": [node.position["x"] for node in nodes],
+            "y": [node.position["y"] for node in nodes],
+        })
+        names = sorted({
+            name for node in nodes for name, value in node.parameters.items()
+            if isinstance(value, (int, float))
+        } - set(NODE_COLUMNS))
+        for name in names:
+            values = [node.parameters.get(name) for node in nodes]
+            builder.parameters[name] = _Column(np.float64, np.nan)
+            builder.parameters[name].extend(np.array([
+                value if isinstance(value, (int, float)) else np.nan for value in values
+            ], dtype=np.float64))
+        topology = builder.finish("")
+        edges = _EdgeBuilder(topology)
+        edges.append({
+            "source": [conn["source"] for conn in connections],
+            "target": [conn["target"] for conn in connections],
+        })
+        return edges.finish("")
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.types)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.source)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.types, self.x, self.y, self.source, self.target, self.distance, *self.parameters.values()]
+        return int(sum(a.nbytes for a in arrays))
+
+    @property
+    def id_index(self) -> Dict[str, int]:
+        if self._id_index is None:
+            self._id_index = {node_id: i for i, node_id in enumerate(self.ids)}
+        return self._id_index
+
+    def node_index(self, node: Any) -> int:
+        """The row of a node given by id, or by row index when the nodes have no ids"""
+        if self.ids is not None:
+            index = self.id_index.get(str(node))
+            if index is None:
+                raise ValueError(f"Unknown node '{node}'")
+            return index
+        try:
+            index = int(node)
+        except (TypeError, ValueError):
+            index = -1
+        if index != node or not 0 <= index < self.num_nodes:
+            raise ValueError(f"Unknown node {node!r}: nodes are numbered 0 to {self.num_nodes - 1}")
+        return index
+
+    def node_label(self, index: int) -> str:
+        return str(index) if self.ids is None else self.ids[index]
+
+    def edge_labels(self, edges: Iterable[Tuple[int, int]]) -> List[str]:
+        label = self.node_label
+        return [f"{label(u)}-{label(v)}" for u, v in edges]
+
+    def node_indices(self, kind: str) -> np.ndarray:
+        """Indices of the nodes of one type"""
+        if kind not in self.type_names:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.types == self.type_names.index(kind))
+
+    def node_parameter(self, name: str, default: Any) -> np.ndarray:
+        """A node parameter for every node; ``default`` (scalar or array) where unset"""
+        values = self.parameters.get(name)
+        if values is None:
+            return np.broadcast_to(np.asarray(default, dtype=np.float64), (self.num_nodes,)).copy()
+        return np.where(np.isnan(values), default, values)
+
+    def graph(self) -> nx.Graph:
+        """The NetworkX graph: nodes by index, edges with their ``distance``"""
+        G = nx.Graph()
+        G.add_nodes_from(range(self.num_nodes))
+        G.add_edges_from(zip(
+            self.source.tolist(),
+            self.target.tolist(),
+            ({"distance": d} for d in self.distance.tolist()),
+        ))
+        return G
+
+    def _last_edges(self) -> np.ndarray:
+        """Rows of the last occurrence of each undirected edge, in row order"""
+        lo = np.minimum(self.source, self.target)
+        hi = np.maximum(self.source, self.target)
+        keys = lo * self.num_nodes + hi
+        _, last = np.unique(keys[::-1], return_index=True)
+        return np.sort(len(keys) - 1 - last)
+
+    def links(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Source, target and distance of each distinct link (the edges of
+        ``graph()``); a repeated edge keeps its last distance and orientation
+        """
+        keep = self._last_edges()
+        return self.source[keep], self.target[keep], self.distance[keep]
+
+    def adjacency(self) -> sparse.csr_matrix:
+        """Symmetric distance matrix; a repeated edge keeps its last distance, as in NetworkX"""
+        n = self.num_nodes
+        lo = np.minimum(self.source, self.target)
+        hi = np.maximum(self.source, self.target)
+        keep = self._last_edges()
+        keep = keep[lo[keep] != hi[keep]]
+        # Zero-length links would vanish from a sparse matrix
+        weights = np.maximum(self.distance[keep], np.finfo(float).tiny)
+        rows = np.concatenate([lo[keep], hi[keep]])
+        cols = np.concatenate([hi[keep], lo[keep]])
+        return sparse.csr_matrix((np.concatenate([weights, weights]), (rows, cols)), shape=(n, n))
+
+    def metrics(self, G: Optional[nx.Graph] = None, seed: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Average shortest path length and clustering, exact or from the sparse
+        matrix. ``G`` is only needed (and built if not given) for small graphs.
+        """
+        if self.num_nodes <= EXACT_METRIC_NODES:
+            G = self.graph() if G is None else G
+            return {
+                "avg_path_length": nx.average_shortest_path_length(G, weight="distance"),
+                "clustering": nx.average_clustering(G),
+            }
+        adjacency = self.adjacency()
+        n = self.num_nodes
+        if csgraph.connected_components(adjacency, directed=False, return_labels=False) > 1:
+            raise ValueError("Graph is not connected.")
+        sources = np.random.default_rng(seed).choice(n, min(n, PATH_SAMPLE_SOURCES), replace=False)
+        lengths = csgraph.dijkstra(adjacency, directed=False, indices=sources)
+
+        # Local clustering from triangle counts: (A @ A) * A summed per row
+        links = (adjacency > 0).astype(np.float64)
+        triangles = np.asarray((links @ links).multiply(links).sum(axis=1)).ravel() / 2
+        degree = np.asarray(links.sum(axis=1)).ravel()
+        pairs = degree * (degree - 1) / 2
+        local = np.divide(triangles, pairs, out=np.zeros(n), where=pairs > 0)
+        return {
+            "avg_path_length": float(lengths.sum() / (len(sources) * (n - 1))),
+            "avg_path_length_sources": len(sources),
+            "clustering": float(local.mean()),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        counts = np.bincount(self.types, minlength=len(self.type_names))
+        summary = {
+            "topology_id": self.topology_id,
+            "nodes": self.num_nodes,
+            "edges": self.num_edges,
+            "node_types": {name: int(count) for name, count in zip(self.type_names, counts)},
+            "node_ids": self.ids is not None,
+            "parameters": sorted(self.parameters),
+            "bbox": [
+                [float(self.x.min()), float(self.y.min())],
+                [float(self.x.max()), float(self.y.max())],
+            ] if self.num_nodes else None,
+            "bytes": self.nbytes,
+            "timings_ms": self.timings_ms,
+        }
+        if self.num_edges:
+            components = csgraph.connected_components(self.adjacency(), directed=False, return_labels=False)
+            summary.update({
+                "total_distance": float(self.distance.sum()),
+                "max_distance": float(self.distance.max()),
+                "connected_components": int(components),
+            })
+        return summary
+
+
+class _NodeBuilder:
+    def __init__(self):
+        self.type_codes: Dict[str, int] = {}
+        self.types = _Column(np.int32)
+        self.x = _Column(np.float64)
+        self.y = _Column(np.float64)
+        self.parameters: Dict[str, _Column] = {}
+        self.ids: Optional[List[str]] = None
+        self.rows = 0
+
+    def append(self, batch: Dict[str, Sequence[Any]]) -> None:
+        size = len(next(iter(batch.values()), ()))
+        if not size:
+            return
+        for name in ("type", "x", "y"):
+            if name not in batch:
+                raise ValueError(f"Node column '{name}' is missing")
+        if self.rows == 0:
+            self.ids = [] if "id" in batch else None
+        if ("id" in batch) != (self.ids is not None):
+            raise ValueError(f"Nodes from row {self.rows} on {'lack' if self.ids is not None else 'add'} an 'id' column")
+        if self.ids is not None:
+            self.ids.extend(str(v) for v in batch["id"])
+
+        codes = self.type_codes
+        self.types.extend(np.array([codes.setdefault(str(t), len(codes)) for t in batch["type"]], dtype=np.int32))
+        for name, column in (("x", self.x), ("y", self.y)):
+            values = _floats(batch[name], name)
+            if np.isnan(values).any():
+                row = self.rows + int(np.flatnonzero(np.isnan(values))[0])
+                raise ValueError(f"Node {row} has no '{name}' position")
+            column.extend(values)
+
+        for name, values in batch.items():
+            if name in NODE_COLUMNS:
+                continue
+            if name not in self.parameters:
+                self.parameters[name] = _Column(np.float64, np.nan, self.rows)
+            self.parameters[name].extend(_floats(values, name))
+        for name, column in self.parameters.items():
+            if name not in batch:
+                column.pad(size)
+        self.rows += size
+
+    def finish(self, topology_id: str, timings_ms: Optional[Dict[str, float]] = None) -> Topology:
+        ids = self.ids
+        if ids is not None and len(set(ids)) != len(ids):
+            raise ValueError("Node ids are not unique")
+        return Topology(
+            topology_id,
+            list(self.type_codes),
+            self.types.array(),
+            self.x.array(),
+            self.y.array(),
+            {name: column.array() for name, column in self.parameters.items()},
+            ids=ids,
+            timings_ms=timings_ms,
+        )
+
+
+class _EdgeBuilder:
+    def __init__(self, nodes: Topology):
+        self.nodes = nodes
+        self.source = _Column(np.int64)
+        self.target = _Column(np.int64)
+        self.distance = _Column(np.float64, np.nan)
+        self.rows = 0
+
+    def _indices(self, values: Sequence[Any], name: str) -> np.ndarray:
+        if self.nodes.ids is not None:
+            index = self.nodes.id_index
+            try:
+                return np.array([index[str(v)] for v in values], dtype=np.int64)
+            except KeyError as e:
+                raise ValueError(f"Edge '{name}' refers to unknown node {e}")
+        indices = _floats(values, name)
+        if np.isnan(indices).any() or (indices != np.round(indices)).any():
+            raise ValueError(f"Edge '{name}' column must hold node indices")
+        indices = indices.astype(np.int64)
+        bad = (indices < 0) | (indices >= self.nodes.num_nodes)
+        if bad.any():
+            raise ValueError(f"Edge {self.rows + int(np.flatnonzero(bad)[0])} refers to node {indices[bad][0]}, "
+                             f"but there are {self.nodes.num_nodes} nodes")
+        return indices
+
+    def append(self, batch: Dict[str, Sequence[Any]]) -> None:
+        size = len(next(iter(batch.values()), ()))
+        if not size:
+            return
+        for name in ("source", "target"):
+            if name not in batch:
+                raise ValueError(f"Edge column '{name}' is missing")
+        self.source.extend(self._indices(batch["source"], "source"))
+        self.target.extend(self._indices(batch["target"], "target"))
+        if "distance" in batch:
+            self.distance.extend(_floats(batch["distance"], "distance"))
+        else:
+            self.distance.pad(size)
+        self.rows += size
+
+    def finish(self, topology_id: str, timings_ms: Optional[Dict[str, float]] = None) -> Topology:
+        nodes = self.nodes
+        source, target, distance = self.source.array(), self.target.array(), self.distance.array()
+        # Straight-line length wherever no distance was given
+        missing = np.isnan(distance)
+        if missing.any():
+            s, t = source[missing], target[missing]
+            distance[missing] = np.sqrt((nodes.x[s] - nodes.x[t])**2 + (nodes.y[s] - nodes.y[t])**2)
+        return Topology(
+            topology_id,
+            nodes.type_names,
+            nodes.types,
+            nodes.x,
+            nodes.y,
+            nodes.parameters,
+            ids=nodes.ids,
+            source=source,
+            target=target,
+            distance=distance,
+            timings_ms={**nodes.timings_ms, **(timings_ms or {})},
+        )
+
+
+def _ndjson_batch(records: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Records as columns; nested position/parameters objects are flattened"""
+    flat = []
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("Every NDJSON line must be an object")
+        record = dict(record)
+        position = record.pop("position", None) or {}
+        parameters = record.pop("parameters", None) or {}
+        flat.append({**parameters, **record, **{k: position[k] for k in ("x", "y") if k in position}})
+    names = {name: None for record in flat for name in record}
+    return {name: [record.get(name) for record in flat] for name in names}
+
+
+class TopologyImport:
+    """
+    Streams a node list (``nodes`` is None) or an edge list for ``nodes``
+    into a Topology, parsing complete lines as they arrive
+    """
+
+    def __init__(self, fmt: str, nodes: Optional[Topology] = None):
+        self.format = fmt
+        self.builder = _NodeBuilder() if nodes is None else _EdgeBuilder(nodes)
+        self.digest = hashlib.sha256(b"" if nodes is None else nodes.topology_id.encode())
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.pending = ""
+        self.header: Optional[List[str]] = None
+        self.size = 0
+        self.parse_seconds = 0.0
+        self.spool = tempfile.TemporaryFile() if fmt == "parquet" else None
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"Topology uploads are limited to {MAX_UPLOAD_BYTES // 2**20} MB")
+        self.digest.update(chunk)
+        if self.spool is not None:
+            self.spool.write(chunk)
+            return
+        start = time.perf_counter()
+        text = self.pending + self.decoder.decode(chunk)
+        cut = text.rfind("\n") + 1
+        self.pending = text[cut:]
+        self._parse(text[:cut].splitlines())
+        self.parse_seconds += time.perf_counter() - start
+
+    def _parse(self, lines: List[str]) -> None:
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return
+        if self.format == "ndjson":
+            try:
+                records = [json.loads(line) for line in lines]
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid NDJSON line: {e}")
+            self.builder.append(_ndjson_batch(records))
+            return
+        rows = csv.reader(lines)
+        if self.header is None:
+            self.header = [name.strip() for name in next(rows)]
+        rows = list(rows)
+        if not rows:
+            return
+        if any(len(row) != len(self.header) for row in rows):
+            raise ValueError(f"CSV rows must have {len(self.header)} fields, like the header")
+        self.builder.append({name: [v.strip() for v in column] for name, column in zip(self.header, zip(*rows))})
+
+    def _parse_parquet(self) -> None:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet import needs pyarrow. Please install with 'pip install pyarrow'")
+        self.spool.seek(0)
+        for batch in pq.ParquetFile(self.spool).iter_batches(batch_size=PARQUET_BATCH_ROWS):
+            self.builder.append({
+                name: column.to_numpy(zero_copy_only=False)
+                for name, column in zip(batch.schema.names, batch.columns)
+            })
+
+    def finish(self) -> Topology:
+        if not self.size:
+            raise ValueError("Empty upload: send the node or edge list as the request body")
+        start = time.perf_counter()
+        if self.spool is not None:
+            try:
+                self._parse_parquet()
+            finally:
+                self.spool.close()
+        else:
+            self._parse((self.pending + self.decoder.decode(b"", final=True)).splitlines())
+        self.parse_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        kind = "nodes" if isinstance(self.builder, _NodeBuilder) else "edges"
+        if self.builder.rows == 0:
+            raise ValueError(f"The upload has no {kind}")
+        topology = self.builder.finish(self.digest.hexdigest()[:16], {f"{kind}_parse_ms": round(self.parse_seconds * 1000, 2)})
+        topology.timings_ms[f"{kind}_build_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        topology.timings_ms[f"{kind}_bytes"] = self.size
+        return topology
+
+    def abort(self) -> None:
+        if self.spool is not None:
+            self.spool.close()
+
+
+# In-memory store of imported topologies
+
+_lock = threading.Lock()
+_topologies: "OrderedDict[str, Topology]" = OrderedDict()
+
+
+def store(topology: Topology) -> Topology:
+    with _lock:
+        _topologies[topology.topology_id] = topology
+        _topologies.move_to_end(topology.topology_id)
+        while len(_topologies) > MAX_TOPOLOGIES:
+            _topologies.popitem(last=False)
+    return topology
+
+
+def get(topology_id: str) -> Topology:
+    with _lock:
+        topology = _topologies.get(topology_id)
+        if topology is None:
+            raise KeyError(f"Unknown topology '{topology_id}'")
+        _topologies.move_to_end(topology_id)
+        return topology
+
@@ -0,0 +1,377 @@
+"""
+BB84 simulation and classical post-processing.
+
+The quantum transmission is sampled for all qubits at once. The sifted key
+then goes through the usual post-processing chain:
+
+1. parameter estimation on a random sample of sifted bits (then discarded)
+2. Cascade error correction, with leaked parity bits counted
+3. verification with a 64-bit universal hash
+4. privacy amplification with a random Toeplitz matrix, multiplied by FFT
+   convolution for long blocks
+
+Keys are kept bit-packed (``np.packbits``) between stages. Cascade unpacks
+them once per pass to apply that pass's permutation.
+
+Transmission and sifting run in fixed-size seeded shards on the worker pool
+(see ``sharding``), so a seed gives the same key for any number of workers.
+"""
+import math
+from statistics import NormalDist
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    from quantum_backend import sharding
+except ImportError:
+    import sharding
+
+MAX_QUBITS = 10_000_000
+# Qubits transmitted per shard
+SHARD_QUBITS = 1 << 20
+
+CASCADE_PASSES = 4
+# Initial Cascade block size is about this constant divided by the QBER
+CASCADE_BLOCK_CONSTANT = 0.73
+VERIFICATION_HASH_BITS = 64
+# Security parameter for privacy amplification (leftover hash lemma)
+PA_EPSILON = 1e-10
+# Above this block length the Toeplitz product uses FFT convolution
+FFT_TOEPLITZ_THRESHOLD = 4096
+
+BB84_QBER_THRESHOLD = 0.11
+
+
+def binary_entropy(p: float) -> float:
+    if p <= 0 or p >= 1:
+        return 0.0
+    return -p * math.log2(p) - (1 - p) * math.log2(1 - p)
+
+
+def simulate_transmission(
+    num_qubits: int,
+    error_rate: float,
+    eavesdropping: bool,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sample Alice's bits and bases, Bob's bases and Bob's measured bits.
+    Eve performs intercept-resend in a random basis. The channel flips each
+    bit with probability ``error_rate``. Returns uint8 arrays.
+    """
+    if not 0 < num_qubits <= MAX_QUBITS:
+        raise ValueError(f"num_qubits must be between 1 and {MAX_QUBITS}")
+    alice_bits = rng.integers(0, 2, num_qubits, dtype=np.uint8)
+    alice_bases = rng.integers(0, 2, num_qubits, dtype=np.uint8)
+    bob_bases = rng.integers(0, 2, num_qubits, dtype=np.uint8)
+
+    sent_bits, sent_bases = alice_bits, alice_bases
+    if eavesdropping:
+        eve_bases = rng.integers(0, 2, num_qubits, dtype=np.uint8)
+        random_bits = rng.integers(0, 2, num_qubits, dtype=np.uint8)
+        sent_bits = np.where(eve_bases == alice_bases, alice_bits, random_bits)
+        sent_bases = eve_bases
+
+    # Measuring in the wrong basis gives a uniformly random outcome
+    random_bits = rng.integers(0, 2, num_qubits, dtype=np.uint8)
+    bob_bits = np.where(bob_bases == sent_bases, sent_bits, random_bits)
+    if error_rate > 0:
+        bob_bits ^= (rng.random(num_qubits) < error_rate).astype(np.uint8)
+    return alice_bits, alice_bases, bob_bases, bob_bits
+
+
+def sift(alice_bits, alice_bases, bob_bases, bob_bits) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Keep positions with matching bases. Returns packed keys and their bit length."""
+    matching = alice_bases == bob_bases
+    alice_key = alice_bits[matching]
+    bob_key = bob_bits[matching]
+    return np.packbits(alice_key), np.packbits(bob_key), len(alice_key)
+
+
+def _transmit_shard(
+    num_qubits: int,
+    error_rate: float,
+    eavesdropping: bool,
+    seed: np.random.SeedSequence,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Transmit and sift one shard. Returns the unpacked sifted keys."""
+    rng = np.random.default_rng(seed)
+    alice_bits, alice_bases, bob_bases, bob_bits = simulate_transmission(
+        num_qubits, error_rate, eavesdropping, rng
+    )
+    matching = alice_bases == bob_bases
+    return alice_bits[matching], bob_bits[matching]
+
+
+def transmit_and_sift(
+    num_qubits: int,
+    error_rate: float,
+    eavesdropping: bool,
+    seed: np.random.SeedSequence,
+    workers: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Sharded ``simulate_transmission`` + ``sift``. Returns packed keys and their bit length."""
+    if not 0 < num_qubits <= MAX_QUBITS:
+        raise ValueError(f"num_qubits must be between 1 and {MAX_QUBITS}")
+    bounds = sharding.shard_bounds(num_qubits, SHARD_QUBITS)
+    shard_args = [
+        (hi - lo, error_rate, eavesdropping, shard_seed)
+        for (lo, hi), shard_seed in zip(bounds, seed.spawn(len(bounds)))
+    ]
+    parts = sharding.run_sharded(_transmit_shard, shard_args, sharding.concat_reduce, workers=workers)
+    alice_key = np.concatenate([alice for alice, _ in parts])
+    bob_key = np.concatenate([bob for _, bob in parts])
+    return np.packbits(alice_key), np.packbits(bob_key), len(alice_key)
+
+
+def estimate_parameters(
+    alice_packed: np.ndarray,
+    bob_packed: np.ndarray,
+    length: int,
+    fraction: float,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray, int, float, int]:
+    """
+    Publicly compare a random sample of sifted bits and discard it.
+    Returns (alice, bob, remaining length, estimated QBER, sample size).
+    """
+    alice = np.unpackbits(alice_packed, count=length)
+    bob = np.unpackbits(bob_packed, count=length)
+    sample_size = min(length, max(1, int(round(length * fraction)))) if length else 0
+    sampled = np.zeros(length, dtype=bool)
+    sampled[rng.choice(length, size=sample_size, replace=False)] = True
+    errors = np.count_nonzero(alice[sampled] != bob[sampled])
+    qber = errors / sample_size if sample_size else 0.0
+    keep = ~sampled
+    return np.packbits(alice[keep]), np.packbits(bob[keep]), int(keep.sum()), qber, sample_size
+
+
+def _range_parities(bits: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Parity of bits[start:end] for sorted, disjoint, non-empty ranges"""
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends
+    if bounds[-1] == len(bits):
+        bounds = bounds[:-1]
+    return np.bitwise_xor.reduceat(bits, bounds)[0::2]
+
+
+def _bisect(alice_perm, bob_perm, starts, ends) -> Tuple[np.ndarray, int]:
+    """
+    Parallel binary search for one error in each block with odd parity
+    mismatch. Returns the permuted positions of the errors and the number
+    of parity bits disclosed.
+    """
+    leaked = 0
+    starts = starts.copy()
+    ends = ends.copy()
+    while True:
+        active = ends - starts > 1
+        if not active.any():
+            return starts, leaked
+        # Blocks stay sorted and disjoint, as required by _range_parities
+        index = np.flatnonzero(active)
+        s, e = starts[index], ends[index]
+        mid = (s + e) // 2
+        error_left = _range_parities(alice_perm, s, mid) != _range_parities(bob_perm, s, mid)
+        leaked += len(index)
+        ends[index[error_left]] = mid[error_left]
+        starts[index[~error_left]] = mid[~error_left]
+
+
+def cascade(
+    alice_packed: np.ndarray,
+    bob_packed: np.ndarray,
+    length: int,
+    qber: float,
+    rng: np.random.Generator,
+    passes: int = CASCADE_PASSES,
+) -> Tuple[np.ndarray, int, int]:
+    """
+    Cascade error correction of Bob's key against Alice's.
+    Returns (corrected packed key, leaked bits, corrected errors).
+    """
+    if length == 0:
+        return bob_packed, 0, 0
+    alice = np.unpackbits(alice_packed, count=length)
+    bob = np.unpackbits(bob_packed, count=length)
+
+    block = int(CASCADE_BLOCK_CONSTANT / max(qber, 1e-4))
+    block = min(max(8, block - block % 8), length)
+
+    perms, inverses, alice_perms, bob_perms, block_sizes = [], [], [], [], []
+    leaked = 0
+    corrected = 0
+
+    for pass_index in range(passes):
+        if pass_index == 0:
+            perm = np.arange(length)
+        else:
+            perm = rng.permutation(length)
+        inverse = np.empty(length, dtype=np.int64)
+        inverse[perm] = np.arange(length)
+        perms.append(perm)
+        inverses.append(inverse)
+        alice_perms.append(alice[perm])
+        bob_perms.append(bob[perm])
+        block_sizes.append(block)
+        leaked += -(-length // block)  # Alice discloses every block parity
+
+        # Correct this pass, then revisit earlier passes whose blocks changed parity
+        pending = {pass_index}
+        while pending:
+            p = pending.pop()
+            starts = np.arange(0, length, block_sizes[p])
+            ends = np.minimum(starts + block_sizes[p], length)
+            mismatch = _range_parities(alice_perms[p], starts, ends) != _range_parities(bob_perms[p], starts, ends)
+            if not mismatch.any():
+                continue
+            positions, bisect_leak = _bisect(alice_perms[p], bob_perms[p], starts[mismatch], ends[mismatch])
+            leaked += bisect_leak
+            errors = perms[p][positions]
+            bob[errors] ^= 1
+            corrected += len(errors)
+            for q in range(pass_index + 1):
+                bob_perms[q][inverses[q][errors]] ^= 1
+            pending.update(q for q in range(pass_index + 1) if q != p)
+        block = min(2 * block, length)
+
+    return np.packbits(bob), leaked, corrected
+
+
+def toeplitz_hash(key_packed: np.ndarray, length: int, output_bits: int, seed_packed: np.ndarray) -> np.ndarray:
+    """
+    Multiply the key by a binary Toeplitz matrix over GF(2). The matrix is
+    given by ``length + output_bits - 1`` seed bits. Long blocks use FFT
+    convolution. Returns the packed hash.
+    """
+    if output_bits <= 0 or length == 0:
+        return np.zeros(0, dtype=np.uint8)
+    x = np.unpackbits(key_packed, count=length)
+    t = np.unpackbits(seed_packed, count=length + output_bits - 1)
+    if length < FFT_TOEPLITZ_THRESHOLD:
+        full = np.convolve(t.astype(np.int64), x.astype(np.int64))
+    else:
+        size = 1 << int(math.ceil(math.log2(len(t) + length - 1)))
+        full = np.fft.irfft(np.fft.rfft(t, size) * np.fft.rfft(x, size), size)
+        full = np.rint(full).astype(np.int64)
+    # y_i = sum_j t[i - j + length - 1] * x_j
+    y = full[length - 1:length - 1 + output_bits] & 1
+    return np.packbits(y.astype(np.uint8))
+
+
+def secret_key_length(
+    length: int,
+    qber: float,
+    sample_size: int,
+    leaked_bits: int,
+    confidence: float = 0.999,
+) -> Tuple[int, float]:
+    """
+    Asymptotic BB84 key length after privacy amplification, with the QBER
+    bounded from above by a normal approximation of the estimation sample.
+    Returns (secret key length, QBER upper bound).
+    """
+    if sample_size:
+        z = NormalDist().inv_cdf(confidence)
+        qber_upper = min(0.5, qber + z * math.sqrt(max(qber * (1 - qber), 1.0 / sample_size) / sample_size))
+    else:
+        qber_upper = 0.5
+    security_margin = 2 * math.log2(1 / PA_EPSILON)
+    raw = length * (1 - binary_entropy(qber_upper)) - leaked_bits - security_margin
+    return max(0, int(math.floor(raw))), qber_upper
+
+
+def post_process(
+    alice_packed: np.ndarray,
+    bob_packed: np.ndarray,
+    length: int,
+    rng: np.random.Generator,
+    estimation_fraction: float = 0.1,
+) -> Dict[str, Any]:
+    """Run parameter estimation, Cascade, verification and privacy amplification"""
+    alice_packed, bob_packed, length, qber, sample_size = estimate_parameters(
+        alice_packed, bob_packed, length, estimation_fraction, rng
+    )
+    result: Dict[str, Any] = {
+        "estimation_sample_size": sample_size,
+        "estimated_qber": qber,
+        "reconciled_length": length,
+    }
+    if qber >= BB84_QBER_THRESHOLD or length == 0:
+        result.update(leaked_bits=0, secret_key_length=0, aborted=True, secret_key=np.zeros(0, dtype=np.uint8))
+        return result
+
+    corrected_packed, leaked, corrected = cascade(alice_packed, bob_packed, length, qber, rng)
+
+    # Verification: compare a short universal hash of both keys
+    verify_seed = np.packbits(rng.integers(0, 2, length + VERIFICATION_HASH_BITS - 1, dtype=np.uint8))
+    verified = np.array_equal(
+        toeplitz_hash(alice_packed, length, VERIFICATION_HASH_BITS, verify_seed),
+        toeplitz_hash(corrected_packed, length, VERIFICATION_HASH_BITS, verify_seed),
+    )
+    leaked += VERIFICATION_HASH_BITS
+    residual_errors = int(np.unpackbits(alice_packed ^ corrected_packed).sum())
+
+    final_length, qber_upper = secret_key_length(length, qber, sample_size, leaked)
+    secret = np.zeros(0, dtype=np.uint8)
+    if verified and final_length > 0:
+        pa_seed = np.packbits(rng.integers(0, 2, length + final_length - 1, dtype=np.uint8))
+        secret = toeplitz_hash(alice_packed, length, final_length, pa_seed)
+    else:
+        final_length = 0
+
+    result.update(
+        qber_upper_bound=qber_upper,
+        corrected_errors=corrected,
+        residual_errors=residual_errors,
+        verified=verified,
+        leaked_bits=leaked,
+        secret_key_length=final_length,
+        aborted=final_length == 0,
+        secret_key=secret,
+    )
+    return result
+
+
+def run_bb84(
+    num_qubits: int,
+    error_rate: float,
+    eavesdropping: bool,
+    seed: Optional[int] = None,
+    post_processing: bool = False,
+    estimation_fraction: float = 0.1,
+    workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Simulate BB84 end to end and build the API response fields"""
+    # Separate streams for the quantum transmission and the classical post-processing
+    transmission_seed, classical_seed = np.random.SeedSequence(seed).spawn(2)
+    alice_packed, bob_packed, sifted_length = transmit_and_sift(
+        num_qubits, error_rate, eavesdropping, transmission_seed, workers
+    )
+    alice_key = np.unpackbits(alice_packed, count=sifted_length)
+    bob_key = np.unpackbits(bob_packed, count=sifted_length)
+    sifted_qber = float(np.mean(alice_key != bob_key)) if sifted_length else 0.0
+
+    response: Dict[str, Any] = {
+        "key_rate": sifted_length / num_qubits,
+        "error_rate": sifted_qber,
+        "secure": sifted_qber < BB84_QBER_THRESHOLD,  # BB84 security threshold
+        "sifted_key_length": sifted_length,
+        "final_key_length": sifted_length,
+        "sample_bits": {
+            "alice": alice_key[:10],
+            "bob": bob_key[:10],
+        },
+    }
+    if post_processing:
+        rng = np.random.default_rng(classical_seed)
+        processed = post_process(alice_packed, bob_packed, sifted_length, rng, estimation_fraction)
+        secret = processed.pop("secret_key")
+        processed["secret_key_sample"] = secret[:8].tobytes().hex()
+        processed["secret_key_rate"] = processed["secret_key_length"] / num_qubits
+        response["final_key_length"] = processed["secret_key_length"]
+        response["secure"] = not processed["aborted"]
+        response["post_processing"] = processed
+    return response
@@ -2,22 +2,31 @@
 import matplotlib
 matplotlib.use('Agg')  # Use Agg backend for server environment (no GUI)
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional, Tuple
 import numpy as np
-import pennylane as qml
-import gdsfactory as gf
 import networkx as nx
 import json
-import base64
-from io import BytesIO, StringIO
+from io import StringIO
 import matplotlib.pyplot as plt
 import sys
 import contextlib
+import threading
+import asyncio
+import time
 
-app = FastAPI()
+try:
+    from quantum_backend import boson_sampling, circuit_batch, forkserver, gds_index, kernel, layout, link_noise, measurements, network_events, network_topology, qkd, rendering, sharding, simulators, snippets, tiles
+    from quantum_backend.serialization import CompressionMiddleware, NumpyJSONResponse, complex_matrix_rows, dumps
+except ImportError:
+    # Running as a script from inside quantum_backend/
+    import boson_sampling, circuit_batch, forkserver, gds_index, kernel, layout, link_noise, measurements, network_events, network_topology, qkd, rendering, sharding, simulators, snippets, tiles
+    from serialization import CompressionMiddleware, NumpyJSONResponse, complex_matrix_rows, dumps
+
+app = FastAPI(default_response_class=NumpyJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,8 +35,32 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+# Module path the fork server imports to find the snippet executors
+SERVICE_MODULE = "quantum_service" if __name__ == "__main__" else __name__
+
+@app.on_event("startup")
+def start_forkserver():
+    # Warm the snippet fork server in the background; requests wait for it if needed
+    if forkserver.ENABLED:
+        server = forkserver.get_server(preload=(SERVICE_MODULE,))
+        threading.Thread(target=server.start, daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    kernel.sessions.close_all()
+    sharding.shutdown()
+    forkserver.shutdown()
 
 # Models for request/response
+class RenderOptions(BaseModel):
+    format: str = "png"  # png, webp or svg
+    dpi: Optional[int] = None
+    width: Optional[float] = None  # inches
+    height: Optional[float] = None  # inches
+    thumbnail: bool = False
+
 class PhotonicComponent(BaseModel):
     type: str
     params: Dict[str, float]
@@ -36,26 +69,84 @@ class PhotonicComponent(BaseModel):
 class PhotonicCircuit(BaseModel):
     components: List[PhotonicComponent]
     connections: List[Dict[str, int]]
+    render: Optional[RenderOptions] = None
+    backend: Optional[str] = None  # override automatic simulator selection
+    output: str = "state"  # state, counts or top_k
+    shots: Optional[int] = None
+    top_k: Optional[int] = None
+    seed: Optional[int] = None
 
 class NetworkNode(BaseModel):
     type: str
     position: Dict[str, float]
     parameters: Dict[str, Any]
 
+class LinkNoiseParameters(BaseModel):
+    attempts: int = 100000  # entanglement attempts per edge
+    attempt_rate: float = 1e6  # Hz
+    detector_efficiency: float = 0.1
+    dark_count_probability: float = 1e-6  # per attempt
+    initial_fidelity: float = 0.95
+    depolarization_length: float = 10.0  # km
+    memory_coherence_time: float = 1e-3  # s
+    memory_wait_time: float = 1e-5  # s, mean extra storage before use
+    confidence: float = 0.95
+    seed: Optional[int] = None
+    workers: Optional[int] = None  # worker processes; default: QUANTUM_SHARD_WORKERS
+
+class DiscreteEventParameters(BaseModel):
+    duration: float = 0.1  # simulated seconds
+    requests: Optional[List[Dict[str, Any]]] = None  # source/target node ids (or indices); default: all endpoint pairs
+    attempt_rate: float = 1e6  # Hz
+    detector_efficiency: float = 0.1
+    initial_fidelity: float = 0.95
+    depolarization_length: float = 10.0  # km
+    default_coherence_time: float = 1e-3  # s, for nodes without a coherence_time parameter (µs)
+    cutoff_time: Optional[float] = None  # s, memory cutoff; default: shortest coherence time
+    max_events: int = 2_000_000
+    seed: Optional[int] = None
+
 class QuantumNetwork(BaseModel):
-    nodes: List[NetworkNode]
-    connections: List[Dict[str, int]]
+    nodes: List[NetworkNode] = []
+    connections: List[Dict[str, int]] = []
+    topology_id: Optional[str] = None  # bulk-imported topology, instead of nodes and connections
+    monte_carlo: Optional[LinkNoiseParameters] = None
+    discrete_event: Optional[DiscreteEventParameters] = None
 
 class BB84Parameters(BaseModel):
     num_qubits: int
     error_rate: float
     eavesdropping: bool
+    post_processing: bool = False  # error correction + privacy amplification
+    estimation_fraction: float = 0.1  # share of sifted bits sacrificed for QBER estimation
+    seed: Optional[int] = None
+    workers: Optional[int] = None  # worker processes; default: QUANTUM_SHARD_WORKERS
+
+class BosonSamplingRequest(BaseModel):
+    unitary: Optional[List[List[Any]]] = None  # rows of numbers, [re, im] pairs or {"real", "imag"} cells
+    input_state: Optional[List[int]] = None  # photons per mode; default: one per circuit source
+    circuit: Optional[PhotonicCircuit] = None  # used when no unitary is given
+    mode: str = "auto"  # auto, exact or sample
+    outputs: Optional[List[List[int]]] = None  # only these output occupations, exactly
+    shots: int = 10000
+    seed: Optional[int] = None
+    top_k: int = 64
+
+class CircuitBatchRequest(BaseModel):
+    circuits: List[Dict[str, Any]]  # PhotonicCircuit payloads, validated one by one
+    render: bool = False  # state plots and GDS layouts for every circuit, not only those with render options
 
 class PercevalCodeRequest(BaseModel):
     code: str
 
+class PercevalRunRequest(BaseModel):
+    code: str
+    artifacts: Optional[List[str]] = None  # subset of PERCEVAL_ARTIFACTS; default: all
+    render: Optional[RenderOptions] = None
+
 class GDSFactoryCodeRequest(BaseModel):
     code: str
+    render: Optional[RenderOptions] = None
 
 class PercevalCodeResponse(BaseModel):
     stdout: str
@@ -68,6 +159,17 @@ class PercevalVisualizationResponse(BaseModel):
     state_visualization: Optional[str] = None
     error: Optional[str] = None
 
+class PercevalRunResponse(BaseModel):
+    stdout: str
+    stderr: str
+    plots: Optional[List[str]] = None
+    unitary: Optional[str] = None
+    distribution: Optional[Dict[str, Any]] = None
+    circuit_visualization: Optional[str] = None
+    state_visualization: Optional[str] = None
+    errors: Dict[str, str] = {}  # artifact name -> error
+    timings_ms: Dict[str, float] = {}  # execution and each artifact
+
 class GDSFactoryCodeResponse(BaseModel):
     stdout: str
     stderr: str
@@ -77,278 +179,503 @@ class GDSFactoryCodeResponse(BaseModel):
     gds_file: Optional[str] = None
     simulation_results: Optional[Dict[str, Any]] = None
     simulation_plots: Optional[List[str]] = None
+    render_metrics: Optional[Dict[str, Any]] = None
+    tiles: Optional[Dict[str, Any]] = None  # tile pyramid for zoomable previews
 
-def plot_to_base64():
-    buf = BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', dpi=100)
-    buf.seek(0)
-    return base64.b64encode(buf.getvalue()).decode('utf-8')
+def plot_to_base64(options: Optional[RenderOptions] = None):
+    # Encode the current pyplot figure in one render pass (no bbox_inches='tight')
+    return rendering.render_pyplot_figure(plt.gcf(), options, kind="pyplot").to_base64()
 
-def create_gds_layout(circuit: PhotonicCircuit) -> str:
-    # Create a new GDS cell
-    c = gf.Component("quantum_circuit")
-    
-    # Define component dimensions
-    width = 0.5
-    length = 10
-    spacing = 20
-    
-    # Create waveguides and components
-    y_offset = 0
-    component_refs = {}
+def create_gds_layout(circuit: PhotonicCircuit) -> Tuple[rendering.RenderedImage, Dict[str, Any]]:
+    # Hierarchical layout: shared cells, arrayed columns and bundled routes
+    c, layout_metrics = layout.build_layout(circuit.components, circuit.connections)
     
-    for idx, component in enumerate(circuit.components):
-        x = component.position["x"] * 0.1  # Scale position to appropriate dimensions
-        y = component.position["y"] * 0.1
-        
-        if component.type == "source":
-            # Create input waveguide
-            wg = c << gf.components.straight(length=length, width=width)
-            wg.move((x, y))
-            component_refs[idx] = wg
-            
-        elif component.type == "beamsplitter":
-            # Create directional coupler
-            dc = c << gf.components.coupler(
-                gap=0.2,
-                length=length,
-                dx=spacing
-            )
-            dc.move((x, y))
-            component_refs[idx] = dc
-            
-        elif component.type == "phaseshift":
-            # Create phase shifter
-            ps = c << gf.components.straight_heater_metal(
-                length=length,
-                width=width
-            )
-            ps.move((x, y))
-            component_refs[idx] = ps
-            
-        elif component.type == "detector":
-            # Create output waveguide with termination
-            wg = c << gf.components.taper(
-                length=length,
-                width1=width,
-                width2=width*2
+    # Render the layout polygons on a reused figure template
+    return rendering.render_component(c, circuit.render), layout_metrics
+
+# Quantum Circuit Routes
+def select_circuit_backend(circuit: PhotonicCircuit, from_state: bool = False) -> simulators.BackendChoice:
+    # Choose a simulator for the circuit size and requested output; with
+    # from_state, counts are sampled from the returned state (batch endpoint),
+    # otherwise a state too large to return from an MPS is sampled instead
+    num_wires = len(circuit.components)
+    num_gates = len(circuit.connections) + sum(
+        comp.type in ("source", "beamsplitter", "phaseshift") for comp in circuit.components
+    )
+    return simulators.select_backend(
+        num_wires,
+        num_gates,
+        [(conn["source"], conn["target"]) for conn in circuit.connections],
+        requested=circuit.backend,
+        output_bytes=(
+            simulators.dense_output_bytes(num_wires)
+            if circuit.output == "state"
+            else measurements.sampled_output_bytes(
+                num_wires, circuit.output, circuit.shots, circuit.top_k, from_state=from_state
             )
-            wg.move((x, y))
-            component_refs[idx] = wg
-    
-    # Connect components with waveguides
-    for conn in circuit.connections:
-        src = component_refs[conn["source"]]
-        dst = component_refs[conn["target"]]
-        
-        # Create connecting waveguide
-        route = gf.routing.get_route(
-            src.ports["o1"],
-            dst.ports["o2"],
-            cross_section=gf.cross_section.strip(width=width)
+        ),
+        sampled_output_bytes=(
+            measurements.sampled_output_bytes(num_wires, "counts", circuit.shots or measurements.DEFAULT_SHOTS)
+            if circuit.output == "state" and not from_state
+            else None
+        ),
+    )
+
+def circuit_output(
+    circuit: PhotonicCircuit,
+    state: Optional[np.ndarray],
+    render: bool = True,
+    counts: Optional[Dict[str, int]] = None,
+) -> Dict[str, Any]:
+    # Requested output for a final state, or for counts sampled by the
+    # simulator, with its plot and the GDS layout when rendering
+    if counts is not None:
+        result, labels, values = measurements.counts_output(counts, sum(counts.values()))
+        plot = {"probabilities": values, "labels": labels, "title": "Sampled Frequencies"}
+    elif circuit.output == "state":
+        probabilities = np.abs(state) ** 2
+        result = {"state": state, "probabilities": probabilities}
+        plot = {"probabilities": probabilities}
+    else:
+        # Sampled counts or top-k states, without a dense output array
+        result, labels, values = measurements.measurement_output(
+            state, len(circuit.components), circuit.output, circuit.shots, circuit.top_k, circuit.seed
         )
-        c.add(route.references)
-    
-    # Generate GDS layout
-    gds_data = c.to_gds()
-    
-    # Convert GDS to image for visualization
-    plt.figure(figsize=(10, 10))
-    c.plot()
-    plt.axis('off')
-    gds_image = plot_to_base64()
-    plt.close()
-    
-    return gds_image
+        plot = {
+            "probabilities": values,
+            "labels": labels,
+            "title": "Sampled Frequencies" if circuit.output == "counts" else "Most Likely Basis States",
+        }
+    result["output"] = "counts" if counts is not None else circuit.output
+    if not render:
+        return result
+
+    state_viz = rendering.render_state_probabilities(options=circuit.render, **plot)
+    gds_layout, layout_metrics = create_gds_layout(circuit)
+    return {
+        **result,
+        "state_visualization": state_viz.to_base64(),
+        "gds_layout": gds_layout.to_base64(),
+        "image_format": state_viz.format,
+        "layout_metrics": layout_metrics,
+        "render_metrics": {
+            "state_visualization": state_viz.metadata(),
+            "gds_layout": gds_layout.metadata()
+        },
+    }
 
-# Quantum Circuit Routes
 @app.post("/api/quantum/circuit/simulate")
-async def simulate_quantum_circuit(circuit: PhotonicCircuit):
+def simulate_quantum_circuit(circuit: PhotonicCircuit):
     try:
-        # Create a PennyLane device with enough wires for our circuit
-        num_wires = len(circuit.components)
-        dev = qml.device("default.qubit", wires=num_wires)
-
-        @qml.qnode(dev)
-        def quantum_circuit():
-            # Initialize input states
-            for i, comp in enumerate(circuit.components):
-                if comp.type == "source":
-                    qml.Hadamard(wires=i)
-
-            # Add components
-            for idx, component in enumerate(circuit.components):
-                if component.type == "beamsplitter":
-                    theta = np.arccos(np.sqrt(component.params.get("transmittivity", 0.5)))
-                    qml.RY(2 * theta, wires=idx)
-                elif component.type == "phaseshift":
-                    phase = component.params.get("phase", 0)
-                    qml.PhaseShift(phase, wires=idx)
-
-            # Add connections
-            for conn in circuit.connections:
-                qml.CNOT(wires=[conn["source"], conn["target"]])
-
-            return qml.state()
-
-        # Run simulation
-        state = quantum_circuit()
-        probabilities = np.abs(state) ** 2
+        measurements.validate_output(circuit.output, circuit.shots, circuit.top_k)
         
-        # Generate GDS layout
-        gds_layout = create_gds_layout(circuit)
-        
-        # Create visualization of the quantum state
-        plt.figure(figsize=(8, 4))
-        plt.bar(range(len(probabilities)), probabilities)
-        plt.xlabel('Basis State')
-        plt.ylabel('Probability')
-        plt.title('Quantum State Probabilities')
-        state_viz = plot_to_base64()
-        plt.close()
+        backend = select_circuit_backend(circuit)
+        # Seeded counts from a device that can't seed its sampler are drawn
+        # from its state, which then has to fit the budget too
+        sample_state = circuit.output == "counts" and circuit.seed is not None
+        if sample_state and backend.name in simulators.UNSEEDED_SAMPLERS:
+            backend = select_circuit_backend(circuit, from_state=True)
+        sample_state = sample_state and backend.name in simulators.UNSEEDED_SAMPLERS
+
+        # Same circuit as the batch endpoint, with this circuit's parameters
+        key = circuit_batch.topology(circuit.components, circuit.connections)
+        angles, phases = circuit_batch.gate_parameters([circuit.components])
+
+        # Run simulation; counts, and states too large to return from an
+        # MPS, are sampled by the simulator without a state vector
+        state = counts = None
+        if (circuit.output == "counts" or backend.sampled) and not sample_state:
+            counts = circuit_batch.sample_counts(
+                backend, key, angles[:, 0], phases[:, 0],
+                circuit.shots or measurements.DEFAULT_SHOTS, circuit.seed
+            )
+        else:
+            dev = simulators.create_device(backend, len(circuit.components))
+            state = circuit_batch.build_qnode(dev, key)(angles[:, 0], phases[:, 0])
         
-        return {
-            "state": state.tolist(),
-            "probabilities": probabilities.tolist(),
-            "state_visualization": state_viz,
-            "gds_layout": gds_layout,
+        return NumpyJSONResponse({
+            **circuit_output(circuit, state, counts=counts),
+            "backend": backend.as_dict(),
             "success": True
-        }
+        })
+    except simulators.SimulationTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def batch_item_error(index: int, error: Exception) -> Dict[str, Any]:
+    status_code = 413 if isinstance(error, simulators.SimulationTooLargeError) else 400
+    return {"index": index, "success": False, "status_code": status_code, "error": str(error)}
+
+@app.post("/api/quantum/circuit/simulate/batch")
+def simulate_quantum_circuit_batch(request: CircuitBatchRequest):
+    """
+    Simulate many circuits in one request. Circuits sharing a topology run
+    together with broadcast parameters; results come back in input order,
+    and a failing circuit is reported in its slot without failing the batch.
+    """
+    start = time.perf_counter()
+    results: List[Optional[Dict[str, Any]]] = [None] * len(request.circuits)
+    groups: Dict[Any, Tuple[simulators.BackendChoice, List[Tuple[int, PhotonicCircuit]]]] = {}
+    for index, payload in enumerate(request.circuits):
+        try:
+            circuit = PhotonicCircuit(**payload)
+            measurements.validate_output(circuit.output, circuit.shots, circuit.top_k)
+            backend = select_circuit_backend(circuit, from_state=True)
+            key = (circuit_batch.topology(circuit.components, circuit.connections), backend.name, backend.bond_dim)
+            groups.setdefault(key, (backend, []))[1].append((index, circuit))
+        except Exception as e:
+            results[index] = batch_item_error(index, e)
+
+    group_metrics = []
+    for backend, members in groups.values():
+        circuits = [circuit for _, circuit in members]
+        try:
+            states, metrics = circuit_batch.simulate_group(
+                [circuit.components for circuit in circuits], circuits[0].connections, backend
+            )
+        except Exception as e:
+            for index, _ in members:
+                results[index] = batch_item_error(index, e)
+            continue
+        group_metrics.append(metrics)
+        for (index, circuit), state in zip(members, states):
+            if isinstance(state, Exception):
+                results[index] = batch_item_error(index, state)
+                continue
+            try:
+                results[index] = {
+                    "index": index,
+                    **circuit_output(circuit, state, render=request.render or circuit.render is not None),
+                    "backend": backend.as_dict(),
+                    "success": True,
+                }
+            except Exception as e:
+                results[index] = batch_item_error(index, e)
+
+    elapsed = time.perf_counter() - start
+    return NumpyJSONResponse({
+        "results": results,
+        "groups": group_metrics,
+        "succeeded": sum(result["success"] for result in results),
+        "failed": sum(not result["success"] for result in results),
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "per_circuit_ms": round(elapsed * 1000 / len(results), 3) if results else None,
+    })
+
 # Network Simulation Routes
+def calculate_channel_loss(distance):
+    # Fiber transmittance over distance (km); works on scalars and arrays
+    fiber_loss = 0.2  # dB/km
+    return 10**(-fiber_loss * np.asarray(distance) / 10)
+
+# Endpoint pairs routed by default when no explicit requests are given
+MAX_DEFAULT_ROUTES = 1000
+
+def run_discrete_event_simulation(G: nx.Graph, topology: network_topology.Topology, params: DiscreteEventParameters) -> Dict[str, Any]:
+    """
+    Route each request along its shortest path and run the event-driven
+    repeater simulation over those paths
+    """
+    if params.requests:
+        # Requests name nodes like the edge list does: by id, or by row index without ids
+        pairs = [(topology.node_index(req["source"]), topology.node_index(req["target"])) for req in params.requests]
+    else:
+        endpoints = topology.node_indices("endpoint").tolist()
+        if len(endpoints) >= 2:
+            pairs = [(a, b) for i, a in enumerate(endpoints) for b in endpoints[i + 1:]][:MAX_DEFAULT_ROUTES]
+        else:
+            pairs = list(G.edges())
+    
+    routes, hop_distances = [], []
+    for source, target in pairs:
+        path = nx.shortest_path(G, source, target, weight="distance")
+        routes.append(path)
+        hop_distances.append([G[u][v]["distance"] for u, v in zip(path, path[1:])])
+    
+    # Node coherence times are given in µs by the frontend
+    coherence = topology.node_parameter("coherence_time", params.default_coherence_time * 1e6) * 1e-6
+    swap_efficiency = topology.node_parameter("swap_efficiency", topology.node_parameter("efficiency", 1.0))
+    cutoff = params.cutoff_time if params.cutoff_time is not None else float(coherence.min())
+    
+    return network_events.simulate(
+        routes,
+        hop_distances,
+        coherence,
+        swap_efficiency,
+        params.duration,
+        np.random.default_rng(params.seed),
+        transmittance_fn=calculate_channel_loss,
+        detector_efficiency=params.detector_efficiency,
+        attempt_rate=params.attempt_rate,
+        initial_fidelity=params.initial_fidelity,
+        depolarization_length=params.depolarization_length,
+        cutoff_time=cutoff,
+        max_events=params.max_events,
+    )
+
 @app.post("/api/quantum/network/simulate")
-async def simulate_quantum_network(network: QuantumNetwork):
+def simulate_quantum_network(network: QuantumNetwork):
+    if network.topology_id is not None:
+        try:
+            topology = network_topology.get(network.topology_id)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e.args[0]))
     try:
-        # Create NetworkX graph for quantum network
-        G = nx.Graph()
-        
-        # Add nodes
-        for idx, node in enumerate(network.nodes):
-            G.add_node(idx, **{
-                "type": node.type,
-                "position": node.position,
-                "parameters": node.parameters
-            })
+        if network.topology_id is None:
+            topology = network_topology.Topology.from_network(network.nodes, network.connections)
         
-        # Add edges
-        for conn in network.connections:
-            source = conn["source"]
-            target = conn["target"]
-            # Calculate distance between nodes
-            pos1 = network.nodes[source].position
-            pos2 = network.nodes[target].position
-            distance = np.sqrt((pos1["x"] - pos2["x"])**2 + (pos1["y"] - pos2["y"])**2)
-            
-            G.add_edge(source, target, distance=distance)
+        # NetworkX graph only where routes are needed; rates, fidelities and
+        # large-graph metrics work on the topology's edge columns
+        G = topology.graph() if network.discrete_event else None
         
         # Calculate network metrics
-        avg_path_length = nx.average_shortest_path_length(G, weight="distance")
-        clustering = nx.average_clustering(G)
-        
-        # Simulate quantum channel losses
-        def calculate_channel_loss(distance):
-            fiber_loss = 0.2  # dB/km
-            return 10**(-fiber_loss * distance / 10)
+        metrics = topology.metrics(G)
         
         # Calculate entanglement rates and fidelities
-        entanglement_rates = {}
-        fidelities = {}
+        sources, targets, distances = topology.links()
+        labels = topology.edge_labels(zip(sources.tolist(), targets.tolist()))
+        channel_loss = calculate_channel_loss(distances)
         
-        for source, target in G.edges():
-            distance = G[source][target]["distance"]
-            channel_loss = calculate_channel_loss(distance)
-            
-            # Basic entanglement rate calculation
-            base_rate = 1e6  # 1 MHz attempt rate
-            success_prob = channel_loss * 0.1  # Detection efficiency
-            entanglement_rates[f"{source}-{target}"] = base_rate * success_prob
-            
-            # Basic fidelity calculation
-            base_fidelity = 0.95
-            noise_factor = 0.1
-            fidelity = base_fidelity * np.exp(-distance * noise_factor)
-            fidelities[f"{source}-{target}"] = fidelity
+        # Basic entanglement rate calculation
+        base_rate = 1e6  # 1 MHz attempt rate
+        success_prob = channel_loss * 0.1  # Detection efficiency
+        entanglement_rates = dict(zip(labels, (base_rate * success_prob).tolist()))
+        
+        # Basic fidelity calculation
+        base_fidelity = 0.95
+        noise_factor = 0.1
+        fidelities = dict(zip(labels, (base_fidelity * np.exp(-distances * noise_factor)).tolist()))
+        
+        monte_carlo = None
+        if network.monte_carlo:
+            # Batched Monte-Carlo attempts on every edge, sharded across workers
+            mc = network.monte_carlo
+            stats = link_noise.simulate_links(
+                distances,
+                channel_loss,
+                mc.attempts,
+                seed=mc.seed,
+                workers=mc.workers,
+                attempt_rate=mc.attempt_rate,
+                detector_efficiency=mc.detector_efficiency,
+                dark_count_probability=mc.dark_count_probability,
+                initial_fidelity=mc.initial_fidelity,
+                depolarization_length=mc.depolarization_length,
+                memory_coherence_time=mc.memory_coherence_time,
+                memory_wait_time=mc.memory_wait_time,
+                confidence=mc.confidence,
+            )
+            monte_carlo = {
+                "links": link_noise.link_statistics_by_edge(labels, stats),
+                "attempts_per_edge": stats["attempts_per_edge"],
+                "confidence": stats["confidence"],
+                "shards": stats["shards"],
+                "workers": stats["workers"],
+                "elapsed_seconds": stats["elapsed_seconds"],
+                "attempts_per_second": stats["attempts_per_second"],
+            }
         
-        return {
+        discrete_event = None
+        if network.discrete_event:
+            discrete_event = run_discrete_event_simulation(G, topology, network.discrete_event)
+        
+        return NumpyJSONResponse({
             "network_metrics": {
-                "avg_path_length": avg_path_length,
-                "clustering": clustering,
-                "num_nodes": len(G.nodes),
-                "num_edges": len(G.edges)
+                **metrics,
+                "num_nodes": topology.num_nodes,
+                "num_edges": len(distances)
             },
             "quantum_metrics": {
                 "entanglement_rates": entanglement_rates,
                 "fidelities": fidelities
-            }
-        }
+            },
+            "monte_carlo": monte_carlo,
+            "discrete_event": discrete_event
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def stream_topology_upload(request: Request, importer: network_topology.TopologyImport) -> network_topology.Topology:
+    """Feed the request body to a topology import as it arrives"""
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(importer.feed, chunk)
+        return network_topology.store(await run_in_threadpool(importer.finish))
+    except network_topology.UploadTooLarge as e:
+        importer.abort()
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
+        importer.abort()
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/api/quantum/network/topology/nodes")
+async def import_network_nodes(request: Request, format: Optional[str] = None):
+    """
+    Bulk-import a node list (CSV, NDJSON or Parquet request body). Edges are
+    added with the edges route, which returns the topology id to simulate.
+    """
+    try:
+        importer = network_topology.TopologyImport(
+            network_topology.upload_format(format, request.headers.get("content-type")))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    topology = await stream_topology_upload(request, importer)
+    return NumpyJSONResponse(topology.summary())
+
+@app.post("/api/quantum/network/topology/{topology_id}/edges")
+async def import_network_edges(topology_id: str, request: Request, format: Optional[str] = None):
+    """
+    Bulk-import the edge list of an imported node list. The response's
+    topology_id can be passed to /api/quantum/network/simulate.
+    """
+    try:
+        nodes = network_topology.get(topology_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    try:
+        importer = network_topology.TopologyImport(
+            network_topology.upload_format(format, request.headers.get("content-type")), nodes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    topology = await stream_topology_upload(request, importer)
+    return NumpyJSONResponse(topology.summary())
+
+@app.get("/api/quantum/network/topology/{topology_id}")
+def get_network_topology(topology_id: str):
+    try:
+        return NumpyJSONResponse(network_topology.get(topology_id).summary())
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
 # BB84 Protocol Routes
 @app.post("/api/quantum/bb84/simulate")
-async def simulate_bb84(params: BB84Parameters):
+def simulate_bb84(params: BB84Parameters):
     try:
-        # Simulate BB84 protocol using PennyLane
-        dev = qml.device("default.qubit", wires=1)
-        
-        @qml.qnode(dev)
-        def bb84_state_prep(bit, basis):
-            if bit:
-                qml.PauliX(wires=0)
-            if basis:
-                qml.Hadamard(wires=0)
-            return qml.state()
-        
-        # Generate random bits for Alice
-        num_qubits = params.num_qubits
-        alice_bits = np.random.randint(0, 2, num_qubits)
-        alice_bases = np.random.randint(0, 2, num_qubits)
-        bob_bases = np.random.randint(0, 2, num_qubits)
-        
-        # Simulate quantum transmission
-        bob_measurements = []
-        for i in range(num_qubits):
-            # Prepare state
-            state = bb84_state_prep(alice_bits[i], alice_bases[i])
-            
-            # Add channel noise
-            if params.eavesdropping:
-                eve_basis = np.random.randint(0, 2)
-                if eve_basis:
-                    state = qml.apply(qml.Hadamard(wires=0))(state)
-            
-            # Bob's measurement
-            if bob_bases[i]:
-                state = qml.apply(qml.Hadamard(wires=0))(state)
-            
-            # Simulate measurement
-            prob_one = np.abs(state[1])**2
-            measurement = 1 if np.random.random() < prob_one else 0
-            bob_measurements.append(measurement)
-        
-        # Sift keys
-        matching_bases = alice_bases == bob_bases
-        key_bits = alice_bits[matching_bases]
-        measured_bits = np.array(bob_measurements)[matching_bases]
-        
-        # Calculate error rate
-        error_rate = np.mean(key_bits != measured_bits)
-        
-        return {
-            "key_rate": len(key_bits) / num_qubits,
-            "error_rate": float(error_rate),
-            "secure": error_rate < 0.11,  # BB84 security threshold
-            "final_key_length": len(key_bits),
-            "sample_bits": {
-                "alice": key_bits[:10].tolist(),
-                "bob": measured_bits[:10].tolist()
-            }
-        }
+        # Sample the quantum transmission in seeded shards, then sift and
+        # optionally run error correction and privacy amplification
+        return NumpyJSONResponse(qkd.run_bb84(
+            params.num_qubits,
+            params.error_rate,
+            params.eavesdropping,
+            seed=params.seed,
+            post_processing=params.post_processing,
+            estimation_fraction=params.estimation_fraction,
+            workers=params.workers,
+        ))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# Multi-Photon Interference Routes
+@app.post("/api/quantum/boson/simulate")
+def simulate_boson_sampling(request: BosonSamplingRequest):
+    """
+    Multi-photon output probabilities of a mode unitary or a photonic
+    circuit: exact (SLOS or permanents) or estimated by sampling
+    """
+    try:
+        mode_labels = None
+        if request.unitary is not None:
+            unitary = boson_sampling.parse_unitary(request.unitary)
+            input_state = request.input_state
+        elif request.circuit is not None:
+            modes = boson_sampling.circuit_unitary(request.circuit.components, request.circuit.connections)
+            unitary, mode_labels = modes["unitary"], modes["modes"]
+            input_state = request.input_state or modes["input_state"]
+        else:
+            raise ValueError("Provide a unitary or a circuit")
+        if input_state is None:
+            raise ValueError("input_state is required with a unitary")
+        result = boson_sampling.simulate(
+            unitary,
+            input_state,
+            mode=request.mode,
+            outputs=request.outputs,
+            shots=request.shots,
+            seed=request.seed,
+            top_k=request.top_k,
+        )
+        return NumpyJSONResponse({
+            **result,
+            "input_state": input_state,
+            "mode_labels": mode_labels,
+            "unitary": complex_matrix_rows(unitary),
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Snippet Execution Cache
+def run_memoized(
+    kind: str,
+    code: str,
+    options: Any,
+    execute: Callable[[], Any],
+    succeeded: Callable[[Any], bool],
+    context_of: Callable[[Any], Any] = lambda result: None,
+    still_valid: Callable[[Any], bool] = lambda context: True,
+) -> Response:
+    """
+    Serve a snippet's response from the execution cache, or execute it and
+    cache the serialized response if the snippet is deterministic
+    """
+    reason = snippets.nondeterminism(code)
+    if reason:
+        snippets.cache.bypass()
+        response = NumpyJSONResponse(execute())
+        response.headers["X-Snippet-Cache"] = "bypass"
+        return response
+    
+    key = snippets.cache_key(kind, code, options)
+    entry = snippets.cache.get(key)
+    if entry is not None:
+        body, context = entry
+        if still_valid(context):
+            return Response(content=body, media_type="application/json", headers={"X-Snippet-Cache": "hit"})
+        snippets.cache.discard(key)
+    
+    result = execute()
+    response = NumpyJSONResponse(result)
+    if succeeded(result):
+        snippets.cache.put(key, response.body, context_of(result))
+    response.headers["X-Snippet-Cache"] = "miss"
+    return response
+
+def run_isolated(function_name: str, *args):
+    """
+    Run a snippet executor of this module in a child forked from the
+    pre-warmed fork server, or in-process if the fork server is unavailable
+    """
+    if forkserver.ENABLED:
+        try:
+            server = forkserver.get_server(preload=(SERVICE_MODULE,))
+            result, _ = server.run(f"{SERVICE_MODULE}:{function_name}", *args)
+            return result
+        except forkserver.ExecutorUnavailable:
+            pass
+    return globals()[function_name](*args)
+
+def run_perceval_snippet(code: str) -> PercevalCodeResponse:
+    try:
+        return run_isolated("execute_perceval_code", code)
+    except RuntimeError as e:
+        return PercevalCodeResponse(stdout="", stderr=f"Error: {str(e)}\n", plots=[], unitary=None)
+
+def run_perceval_combined_snippet(code: str, artifacts: List[str], render_options: Optional[RenderOptions] = None) -> PercevalRunResponse:
+    try:
+        return run_isolated("execute_and_visualize_perceval_code", code, artifacts, render_options)
+    except RuntimeError as e:
+        return PercevalRunResponse(stdout="", stderr=f"Error: {str(e)}\n")
+
+def run_gdsfactory_snippet(code: str, render_options: Optional[RenderOptions] = None) -> GDSFactoryCodeResponse:
+    try:
+        response, layout_tiles = run_isolated("execute_gdsfactory_isolated", code, render_options)
+    except RuntimeError as e:
+        return GDSFactoryCodeResponse(stdout="", stderr=f"Error executing GDSFactory code: {str(e)}\n")
+    # The polygons were extracted in the child: keep them for tile requests
+    if layout_tiles is not None:
+        tiles.adopt(layout_tiles)
+    return response
+
 # Perceval Integration Routes
 def execute_perceval_code(code: str) -> PercevalCodeResponse:
     """
@@ -387,15 +714,12 @@ def execute_perceval_code(code: str) -> PercevalCodeResponse:
         # Override matplotlib show to capture plots
         original_show = plt.show
         def capture_show():
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            plots.append(base64.b64encode(buf.read()).decode('utf-8'))
+            plots.append(plot_to_base64())
             plt.close()
         plt.show = capture_show
         
         # Execute the code
-        exec(code, {}, local_vars)
+        exec(snippets.compile_snippet(code, "<perceval>"), {}, local_vars)
         
         # Get the stdout and stderr
         stdout = stdout_capture.getvalue()
@@ -407,19 +731,12 @@ def execute_perceval_code(code: str) -> PercevalCodeResponse:
                 try:
                     # Try to get the unitary matrix
                     u_matrix = var_value.compute_unitary()
-                    # Convert to list for JSON serialization
-                    unitary_matrix = u_matrix.tolist()
+                    u_matrix = np.asarray(u_matrix)
                     # For complex numbers, convert to dict representation
                     if np.iscomplexobj(u_matrix):
-                        unitary_matrix = []
-                        for row in u_matrix:
-                            unitary_row = []
-                            for elem in row:
-                                unitary_row.append({
-                                    "real": float(elem.real),
-                                    "imag": float(elem.imag)
-                                })
-                            unitary_matrix.append(unitary_row)
+                        unitary_matrix = complex_matrix_rows(u_matrix)
+                    else:
+                        unitary_matrix = u_matrix
                 except Exception as e:
                     stderr_capture.write(f"Error computing unitary: {str(e)}\n")
         
@@ -434,7 +751,7 @@ def execute_perceval_code(code: str) -> PercevalCodeResponse:
         stdout=stdout,
         stderr=stderr_capture.getvalue(),
         plots=plots,
-        unitary=json.dumps(unitary_matrix) if unitary_matrix else None
+        unitary=dumps(unitary_matrix).decode('utf-8') if unitary_matrix is not None else None
     )
 
 def generate_perceval_visualizations(code: str) -> PercevalVisualizationResponse:
@@ -468,7 +785,7 @@ def generate_perceval_visualizations(code: str) -> PercevalVisualizationResponse
         }
         
         # Execute the code to get the circuit and state
-        exec(code, {}, local_vars)
+        exec(snippets.compile_snippet(code, "<perceval>"), {}, local_vars)
         
         # Look for circuit and state objects
         circuit = None
@@ -532,28 +849,177 @@ def generate_perceval_visualizations(code: str) -> PercevalVisualizationResponse
         error=error
     )
 
+PERCEVAL_ARTIFACTS = ("plots", "unitary", "distribution", "circuit_visualization", "state_visualization")
+
+def execute_and_visualize_perceval_code(
+    code: str, artifacts: List[str], render_options: Optional[RenderOptions] = None
+) -> PercevalRunResponse:
+    """
+    Execute Perceval code once and derive the requested artifacts from its
+    namespace: the unitary and output distribution of the last circuit for
+    the last input state, the figures shown, and circuit/state plots
+    """
+    try:
+        import perceval as pcvl
+    except ImportError:
+        try:
+            import perceval_quandela as pcvl
+        except ImportError:
+            return PercevalRunResponse(
+                stdout="",
+                stderr="Error: Perceval is not installed. Please install with 'pip install perceval-quandela'",
+            )
+
+    requested = set(artifacts)
+    timings: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+    response: Dict[str, Any] = {}
+    output, stderr_capture = StringIO(), StringIO()
+    plots = []
+
+    def timed(name: str, produce: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return produce()
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+        finally:
+            timings[name] = round(timings.get(name, 0) + (time.perf_counter() - start) * 1000, 3)
+
+    # Figures shown by the snippet are only encoded when plots were requested
+    original_show = plt.show
+    def capture_show():
+        if "plots" in requested:
+            timed("plots", lambda: plots.append(plot_to_base64(render_options)))
+        plt.close()
+    plt.show = capture_show
+
+    local_vars = {"pcvl": pcvl, "np": np, "plt": plt}
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(stderr_capture):
+            exec(snippets.compile_snippet(code, "<perceval>"), {}, local_vars)
+    except Exception as e:
+        stderr_capture.write(f"Error: {str(e)}\n")
+    finally:
+        plt.show = original_show
+        plt.close("all")
+    timings["execute"] = round((time.perf_counter() - start) * 1000 - timings.get("plots", 0), 3)
+
+    # The last circuit and input state the snippet defined
+    circuit = state = None
+    for var_value in local_vars.values():
+        if isinstance(var_value, pcvl.Circuit):
+            circuit = var_value
+        elif isinstance(var_value, pcvl.BasicState) or (hasattr(pcvl, "StateVector") and isinstance(var_value, pcvl.StateVector)):
+            state = var_value
+
+    unitary = None
+    if circuit is not None and requested & {"unitary", "distribution", "state_visualization"}:
+        unitary = timed("unitary", lambda: np.asarray(circuit.compute_unitary()))
+        if unitary is not None and "unitary" in requested:
+            rows = complex_matrix_rows(unitary) if np.iscomplexobj(unitary) else unitary
+            response["unitary"] = dumps(rows).decode("utf-8")
+
+    distribution = None
+    if unitary is not None and state is not None and requested & {"distribution", "state_visualization"}:
+        def output_distribution():
+            if not isinstance(state, pcvl.BasicState):
+                raise ValueError("The output distribution needs a BasicState input")
+            return boson_sampling.simulate(unitary, [int(n) for n in state], mode="exact")
+        distribution = timed("distribution", output_distribution)
+        if "distribution" in requested:
+            response["distribution"] = distribution
+
+    if circuit is not None and "circuit_visualization" in requested:
+        def draw_circuit():
+            plt.figure(figsize=(10, 4))
+            try:
+                pcvl.pdisplay(circuit)
+                return plot_to_base64(render_options)
+            finally:
+                plt.close()
+        response["circuit_visualization"] = timed("circuit_visualization", draw_circuit)
+
+    cause = errors.get("distribution") or errors.get("unitary")
+    if distribution is None and "state_visualization" in requested and cause:
+        # e.g. a StateVector input: there is no distribution to plot
+        errors["state_visualization"] = f"No output distribution to plot: {cause}"
+    if distribution is not None and "state_visualization" in requested:
+        entries = distribution["results"]
+        response["state_visualization"] = timed(
+            "state_visualization",
+            lambda: rendering.render_state_probabilities(
+                [entry["probability"] for entry in entries],
+                render_options,
+                labels=["|" + ",".join(map(str, entry["state"])) + ">" for entry in entries],
+                title="Output State Probabilities",
+                xlabel="Output State",
+            ).to_base64(),
+        )
+
+    if "plots" in requested:
+        response["plots"] = plots
+    return PercevalRunResponse(
+        stdout=output.getvalue(),
+        stderr=stderr_capture.getvalue(),
+        errors=errors,
+        timings_ms=timings,
+        **response,
+    )
+
 @app.post("/api/quantum/perceval/execute")
-async def execute_code(request: PercevalCodeRequest) -> PercevalCodeResponse:
+def execute_code(request: PercevalCodeRequest) -> PercevalCodeResponse:
     """
     Execute Perceval quantum circuit code and return results
     """
     try:
-        return execute_perceval_code(request.code)
+        return run_memoized(
+            "perceval",
+            request.code,
+            None,
+            lambda: run_perceval_snippet(request.code),
+            succeeded=lambda result: not result.stderr,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/quantum/perceval/visualize")
-async def visualize_circuit(request: PercevalCodeRequest) -> PercevalVisualizationResponse:
+def visualize_circuit(request: PercevalCodeRequest) -> PercevalVisualizationResponse:
     """
     Generate visualizations from Perceval code
     """
     try:
-        return generate_perceval_visualizations(request.code)
+        return NumpyJSONResponse(generate_perceval_visualizations(request.code))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/quantum/perceval/run")
+def run_and_visualize(request: PercevalRunRequest) -> PercevalRunResponse:
+    """
+    Execute Perceval code once and return the requested artifacts (default:
+    all of PERCEVAL_ARTIFACTS) with per-artifact timings
+    """
+    artifacts = sorted(set(PERCEVAL_ARTIFACTS if request.artifacts is None else request.artifacts))
+    unknown = set(artifacts) - set(PERCEVAL_ARTIFACTS)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown artifacts: {', '.join(sorted(unknown))}. Use any of: {', '.join(PERCEVAL_ARTIFACTS)}",
+        )
+    try:
+        return run_memoized(
+            "perceval_run:" + ",".join(artifacts),
+            request.code,
+            request.render,
+            lambda: run_perceval_combined_snippet(request.code, artifacts, request.render),
+            succeeded=lambda result: not result.stderr and not result.errors,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # GDSFactory Integration Routes
-def execute_gdsfactory_code(code: str) -> GDSFactoryCodeResponse:
+def execute_gdsfactory_code(code: str, render_options: Optional[RenderOptions] = None) -> GDSFactoryCodeResponse:
     """
     Execute the provided GDSFactory code and capture all outputs
     """
@@ -578,10 +1044,14 @@ def execute_gdsfactory_code(code: str) -> GDSFactoryCodeResponse:
     gds_data = None
     simulation_results = None
     simulation_plots = []
+    render_metrics = {}
+    layout_tiles = None
     
     try:
-        # Create a custom namespace for execution
+        # Create a custom namespace for execution; it is the snippet's global
+        # scope too, so functions it defines see gf, np and plt
         local_namespace = {
+            '__name__': '__gdsfactory_snippet__',
             'gf': gf,
             'np': np,
             'plt': plt,
@@ -599,106 +1069,51 @@ def execute_gdsfactory_code(code: str) -> GDSFactoryCodeResponse:
         modified_code += "        break\n"
         
         # Execute the modified code
-        exec(modified_code, globals(), local_namespace)
+        exec(snippets.compile_snippet(modified_code, "<gdsfactory>"), local_namespace)
         
         # Get the preview component
         preview_component = local_namespace.get('__preview_component')
         
         if preview_component:
-            # Create a temporary directory for our files
-            import tempfile
-            import os
-            import gdsfactory as gf
-            from pathlib import Path
-            
-            temp_dir = tempfile.mkdtemp()
-            temp_gds_path = Path(temp_dir) / "component.gds"
-            temp_png_path = Path(temp_dir) / "preview.png"
-            
-            # Save the GDS file directly - this is the most fundamental operation
-            preview_component.write_gds(temp_gds_path)
-            
-            # Use a simplified visualization approach that works with built-in modules
+            # Extract the polygons once: they feed both the preview and the tile pyramid
             try:
-                # Create a clear visualization focusing on the chip layout
-                plt.figure(figsize=(10, 8), dpi=150)
-                ax = plt.subplot(111)
-                
-                # Plot with simplified settings to clearly show the chip
-                preview_component.plot(
-                    with_labels=False,  # Turn off the crowded labels
-                    show_ports=True,
-                    show_subports=False,
-                    new_window=False,
+                layout_tiles = tiles.register(preview_component)
+                preview = rendering.render_layout(
+                    layout_tiles.polygons_by_layer(),
+                    layout_tiles.bbox,
+                    render_options,
+                    title="Quantum Photonic Chip - MZI Layout",
                 )
-                
-                # Enhance colors and line widths for better visibility
-                for collection in ax.collections:
-                    collection.set_linewidth(2)  # Make waveguides thicker
-                
-                # Focus on the actual chip area
-                bounds = preview_component.bbox
-                margin = max(bounds.width, bounds.height) * 0.2
-                plt.xlim(bounds.xmin - margin, bounds.xmax + margin)
-                plt.ylim(bounds.ymin - margin, bounds.ymax + margin)
-                
-                # Add a proper title
-                plt.title("Quantum Photonic Chip - MZI Layout", fontsize=16)
-                plt.grid(False)  # Remove distracting grid
-                
-                # Save the visualization
-                plt.tight_layout()
-                plt.savefig(str(temp_png_path))
-                plt.close()
-                
+                render_metrics["preview"] = preview.metadata()
                 stdout_capture.write(f"\n# DEBUG: Generated clean 2D visualization\n")
-            
             except Exception as e:
                 stderr_capture.write(f"\nError generating visualization: {str(e)}\n")
                 import traceback
                 stderr_capture.write(traceback.format_exc())
                 
-                # Fallback to extremely simple visualization as last resort
+                # Fallback to the library's own plotting as last resort
+                fallback_fig = plt.figure(figsize=(10, 8))
                 try:
-                    plt.figure(figsize=(10, 8))
-                    plt.title("Quantum Photonic Chip", fontsize=16)
                     preview_component.plot(show_ports=True)
-                    plt.savefig(str(temp_png_path), dpi=150)
-                    plt.close()
-                    stdout_capture.write(f"\n# DEBUG: Generated fallback visualization\n")
                 except Exception as e2:
                     stderr_capture.write(f"\nError in fallback visualization: {str(e2)}\n")
-                    
-                    # Absolute last resort - just text
-                    plt.figure(figsize=(8, 6))
-                    plt.text(0.5, 0.5, f"Component: {preview_component.name}", 
+                    plt.text(0.5, 0.5, f"Component: {preview_component.name}",
                             ha='center', va='center', fontsize=16)
                     plt.axis('off')
-                    plt.savefig(str(temp_png_path), dpi=100)
-                    plt.close()
+                preview = rendering.render_pyplot_figure(plt.gcf(), render_options, kind="layout")
+                plt.close(fallback_fig)
+                stdout_capture.write(f"\n# DEBUG: Generated fallback visualization\n")
             
-            # Read the file as raw binary data
-            with open(temp_png_path, 'rb') as f:
-                preview_data = f.read()
-            
-            # Convert to base64
-            preview_image = "data:image/png;base64," + base64.b64encode(preview_data).decode('utf-8')
-            
-            # Log success and the length of the data
-            stdout_capture.write(f"\n# DEBUG: Successfully saved preview to {temp_png_path}\n")
+            preview_image = preview.to_data_url()
             stdout_capture.write(f"# DEBUG: Preview image data length: {len(preview_image)} bytes\n")
             
-            # Clean up the temporary directory
-            import shutil
-            shutil.rmtree(temp_dir)
-            
             # Generate detailed visualization
             viz_fig = plt.figure(figsize=(12, 12))
             preview_component.plot(show_ports=True, show_subports=True)
-            buffer = BytesIO()
-            viz_fig.savefig(buffer, format='png')
+            visualization = rendering.render_pyplot_figure(plt.gcf(), render_options, kind="layout")
             plt.close(viz_fig)
-            visualization_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            render_metrics["visualization"] = visualization.metadata()
+            visualization_image = visualization.to_base64()
             
             # Export GDS file
             try:
@@ -745,45 +1160,37 @@ def execute_gdsfactory_code(code: str) -> GDSFactoryCodeResponse:
                     
                     # For MZI, run a simple wavelength sweep
                     if 'mzi' in code.lower():
-                        sim_fig = plt.figure(figsize=(10, 6))
                         wavelengths = np.linspace(1500, 1600, 100)
                         transmission = 0.5 * (1 + np.cos(2 * np.pi * (wavelengths - 1550) / 20))
-                        plt.plot(wavelengths, transmission)
-                        plt.xlabel('Wavelength (nm)')
-                        plt.ylabel('Transmission')
-                        plt.title('Simulated MZI Transmission')
-                        buffer = BytesIO()
-                        sim_fig.savefig(buffer, format='png')
-                        plt.close(sim_fig)
-                        simulation_plots.append(base64.b64encode(buffer.getvalue()).decode('utf-8'))
+                        spectrum = rendering.render_spectrum(
+                            wavelengths, transmission, render_options, title='Simulated MZI Transmission'
+                        )
+                        render_metrics["spectrum"] = spectrum.metadata()
+                        simulation_plots.append(spectrum.to_base64())
                         
                         sim_result = {
                             "device_type": "mzi",
-                            "wavelengths": wavelengths.tolist(),
-                            "transmission": transmission.tolist(),
+                            "wavelengths": wavelengths,
+                            "transmission": transmission,
                             "insertion_loss": f"{-10 * np.log10(np.max(transmission)):.2f} dB",
                             "extinction_ratio": f"{10 * np.log10(np.max(transmission) / np.min(transmission)):.2f} dB"
                         }
                     
                     # For ring resonators, simulate resonances
                     elif 'ring' in code.lower():
-                        sim_fig = plt.figure(figsize=(10, 6))
                         wavelengths = np.linspace(1540, 1560, 1000)
                         fsr = 5  # nm
                         resonances = 1 - 0.9 * np.exp(-((wavelengths - 1550) % fsr - fsr/2)**2 / 0.05)
-                        plt.plot(wavelengths, resonances)
-                        plt.xlabel('Wavelength (nm)')
-                        plt.ylabel('Transmission')
-                        plt.title('Simulated Ring Resonator Response')
-                        buffer = BytesIO()
-                        sim_fig.savefig(buffer, format='png')
-                        plt.close(sim_fig)
-                        simulation_plots.append(base64.b64encode(buffer.getvalue()).decode('utf-8'))
+                        spectrum = rendering.render_spectrum(
+                            wavelengths, resonances, render_options, title='Simulated Ring Resonator Response'
+                        )
+                        render_metrics["spectrum"] = spectrum.metadata()
+                        simulation_plots.append(spectrum.to_base64())
                         
                         sim_result = {
                             "device_type": "ring",
-                            "wavelengths": wavelengths.tolist()[:100],  # Limit data size
-                            "transmission": resonances.tolist()[:100],  # Limit data size
+                            "wavelengths": wavelengths[:100],  # Limit data size
+                            "transmission": resonances[:100],  # Limit data size
                             "fsr": f"{fsr} nm",
                             "q_factor": "~10,000",
                             "extinction_ratio": "~10 dB"
@@ -809,7 +1216,10 @@ def execute_gdsfactory_code(code: str) -> GDSFactoryCodeResponse:
         visualization=visualization_image if 'visualization_image' in locals() else None,
         visualization_3d=visualization_3d_image if 'visualization_3d_image' in locals() else None,
         gds_file=gds_data if 'gds_data' in locals() else None,
-        simulation_results=simulation_results if 'simulation_results' in locals() else None
+        simulation_results=simulation_results if 'simulation_results' in locals() else None,
+        simulation_plots=simulation_plots or None,
+        render_metrics=render_metrics or None,
+        tiles=layout_tiles.metadata() if layout_tiles else None
     )
     
     # Add more debugging information to help troubleshoot visualization issues
@@ -823,12 +1233,193 @@ def execute_gdsfactory_code(code: str) -> GDSFactoryCodeResponse:
     
     return response
 
+def execute_gdsfactory_isolated(code: str, render_options: Optional[RenderOptions] = None):
+    """
+    Snippet-process entry point: the response plus the extracted layout
+    polygons, which the server adopts so tile requests can find them
+    """
+    response = execute_gdsfactory_code(code, render_options)
+    layout_tiles = tiles.get_layout(response.tiles["layout_id"]) if response.tiles else None
+    return response, layout_tiles
+
 @app.post("/api/quantum/gdsfactory/execute", response_model=GDSFactoryCodeResponse)
 def execute_gdsfactory(request: GDSFactoryCodeRequest):
     """
     Execute GDSFactory quantum photonic chip design code and return results
     """
-    return execute_gdsfactory_code(request.code)
+    return run_memoized(
+        "gdsfactory",
+        request.code,
+        request.render,
+        lambda: run_gdsfactory_snippet(request.code, request.render),
+        succeeded=lambda result: result.preview is not None,
+        # A cached response is only useful while its tile pyramid is still registered
+        context_of=lambda result: result.tiles["layout_id"] if result.tiles else None,
+        still_valid=lambda layout_id: layout_id is None or tiles.get_layout(layout_id) is not None,
+    )
+
+@app.get("/api/render/stats")
+async def get_render_stats():
+    """
+    Average render time and payload size per plot kind and image format
+    """
+    return {**rendering.render_stats(), "tiles": tiles.tile_stats(), "gds": gds_index.index_stats()}
+
+@app.get("/api/executor/stats")
+async def get_executor_stats():
+    """
+    Fork server state, spawn-to-exec latency and per-child unique memory
+    """
+    if not forkserver.ENABLED:
+        return {"enabled": False}
+    return forkserver.get_server(preload=(SERVICE_MODULE,)).stats()
+
+@app.get("/api/snippets/cache")
+async def get_snippet_cache_stats():
+    """
+    Hit rate, size and library versions of the snippet execution cache
+    """
+    return snippets.cache.stats()
+
+# Interactive Kernel Sessions
+@app.websocket("/api/kernel/{kind}")
+async def kernel_session(websocket: WebSocket, kind: str, session_id: Optional[str] = None):
+    """
+    Interactive GDSFactory or Perceval session. Each ``execute`` message
+    re-runs only the cells its edit affected, in a namespace kept alive
+    between messages. Reconnect with ``?session_id=`` to resume a session.
+    """
+    await websocket.accept()
+
+    async def send(message: Dict[str, Any]):
+        await websocket.send_text(dumps(message).decode("utf-8"))
+
+    try:
+        session = await run_in_threadpool(kernel.sessions.open, kind, session_id)
+    except (ValueError, RuntimeError) as e:
+        await send({"type": "error", "error": str(e)})
+        await websocket.close(code=1011)
+        return
+    await send({"type": "session", **session.info()})
+
+    try:
+        while True:
+            try:
+                text = await asyncio.wait_for(websocket.receive_text(), timeout=kernel.IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                kernel.sessions.close(session.session_id)
+                await send({"type": "closed", "reason": "idle"})
+                await websocket.close()
+                return
+            try:
+                reply = await run_in_threadpool(session.handle, json.loads(text))
+            except Exception as e:
+                reply = {"type": "error", "error": str(e)}
+            await send(reply)
+            if session.closed:
+                kernel.sessions.close(session.session_id)
+                await websocket.close()
+                return
+    except WebSocketDisconnect:
+        # Keep the session for a reconnect until it idles out
+        pass
+
+@app.get("/api/kernel/sessions")
+async def get_kernel_sessions():
+    """
+    Open interactive sessions, their age, idle time and submission counts
+    """
+    return kernel.sessions.stats()
+
+# Layout Tile Routes
+@app.get("/api/layout/tiles/{layout_id}")
+def get_layout_tiles(layout_id: str):
+    """
+    Bounding box, zoom range and layers of a registered layout
+    """
+    layout_tiles = tiles.get_layout(layout_id)
+    if layout_tiles is None:
+        raise HTTPException(status_code=404, detail=f"Unknown layout '{layout_id}'")
+    return NumpyJSONResponse(layout_tiles.metadata())
+
+@app.get("/api/layout/tiles/{layout_id}/{z}/{x}/{y}")
+def get_layout_tile(layout_id: str, z: int, x: int, y: int, format: str = "png"):
+    """
+    One tile of a layout's zoomable preview, rasterized from its polygons
+    """
+    layout_tiles = tiles.get_layout(layout_id)
+    if layout_tiles is None:
+        raise HTTPException(status_code=404, detail=f"Unknown layout '{layout_id}'")
+    try:
+        data = tiles.render_tile(layout_tiles, z, x, y, format)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Tiles of a layout id never change
+    return Response(
+        content=data,
+        media_type=rendering.SUPPORTED_FORMATS[format],
+        headers={"Cache-Control": "public, max-age=86400, immutable"},
+    )
+
+# GDS Library Routes
+GDS_FORM_CHUNK_BYTES = 1 << 20
+
+async def gds_upload_chunks(request: Request):
+    """The uploaded file as it arrives: the raw body, or the first file of a multipart form"""
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        async for chunk in request.stream():
+            yield chunk
+        return
+    # Parsing the form needs python-multipart (see docker-requirements.txt)
+    form = await request.form()
+    try:
+        files = [value for value in form.values() if hasattr(value, "read")]
+        if not files:
+            raise ValueError("The multipart form has no file field")
+        while True:
+            chunk = await files[0].read(GDS_FORM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await form.close()
+
+@app.post("/api/layout/gds")
+async def analyze_gds(request: Request, cell: Optional[str] = None):
+    """
+    Index an uploaded GDSII file (the raw request body, or a file field of a
+    multipart form) and return its cell hierarchy, per-layer statistics,
+    labels and a tiled preview of a top cell
+    """
+    upload = gds_index.Upload()
+    try:
+        async for chunk in gds_upload_chunks(request):
+            await run_in_threadpool(upload.write, chunk)
+        file_hash = await run_in_threadpool(upload.finish)
+    except gds_index.UploadTooLarge as e:
+        upload.abort()
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        upload.abort()
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return NumpyJSONResponse(await run_in_threadpool(gds_index.analyze, file_hash, cell))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/layout/gds/{file_hash}")
+def get_gds_analysis(file_hash: str, cell: Optional[str] = None):
+    """
+    Analysis of a previously uploaded GDSII file, from its cached index
+    """
+    if not gds_index.is_known(file_hash):
+        raise HTTPException(status_code=404, detail=f"Unknown GDS file '{file_hash}'")
+    try:
+        return NumpyJSONResponse(gds_index.analyze(file_hash, cell))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,376 @@
+"""
+Figure rendering for the quantum backend.
+
+Recurring plot types (state probability bars, layout previews, spectra) are
+drawn on figure templates that are built once per thread, plot kind and size,
+and then updated in place. Each thread keeps its few most recently used
+templates. Images are encoded straight from the Agg buffer,
+so there is no second render pass from ``bbox_inches='tight'``, and PNG output
+is palette-quantized, which shrinks the mostly flat-colour plots we produce.
+"""
+import base64
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from io import BytesIO
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator, ScalarFormatter
+from PIL import Image
+
+SUPPORTED_FORMATS = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "svg": "image/svg+xml",
+}
+
+# Default figure sizes (inches) per plot kind
+DEFAULT_SIZES = {
+    "state_probabilities": (8.0, 4.0),
+    "layout": (10.0, 8.0),
+    "spectrum": (10.0, 6.0),
+    "pyplot": (10.0, 6.0),  # figures drawn by snippets (matplotlib, Perceval)
+}
+
+THUMBNAIL_SIZE = (3.2, 2.0)
+THUMBNAIL_DPI = 48
+
+MIN_DPI = 24
+MAX_DPI = 300
+MAX_SIZE_INCHES = 20.0
+
+# Number of colours kept when quantizing PNG output
+PNG_PALETTE_COLORS = 64
+WEBP_QUALITY = 80
+
+# Figure templates kept per thread; each holds a figure and its Agg buffer,
+# so sizes cycled by clients evict the least recently used one
+MAX_TEMPLATES_PER_THREAD = 4
+
+LAYER_COLORS = [
+    "#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd",
+    "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
+]
+
+_templates = threading.local()
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = defaultdict(
+    lambda: {"count": 0, "render_ms": 0.0, "bytes": 0}
+)
+
+
+class RenderedImage:
+    """Encoded image plus the measurements taken while producing it."""
+
+    def __init__(self, data: bytes, fmt: str, width: int, height: int, render_ms: float):
+        self.data = data
+        self.format = fmt
+        self.width = width
+        self.height = height
+        self.render_ms = render_ms
+
+    @property
+    def mime_type(self) -> str:
+        return SUPPORTED_FORMATS[self.format]
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.to_base64()}"
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "format": self.format,
+            "mime_type": self.mime_type,
+            "width": self.width,
+            "height": self.height,
+            "bytes": len(self.data),
+            "render_ms": round(self.render_ms, 3),
+        }
+
+
+class FigureTemplate:
+    """A figure, canvas and axes kept alive between renders of one plot kind."""
+
+    def __init__(self, width: float, height: float, thumbnail: bool):
+        self.fig = Figure(figsize=(width, height))
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111)
+        self.thumbnail = thumbnail
+        self.artists: Dict[str, Any] = {}
+        if thumbnail:
+            self.fig.subplots_adjust(left=0.02, right=0.98, bottom=0.02, top=0.98)
+            self.ax.set_axis_off()
+        else:
+            # Fixed margins replace bbox_inches='tight'
+            self.fig.subplots_adjust(left=0.1, right=0.97, bottom=0.14, top=0.9)
+
+
+def resolve_options(options: Any, kind: str) -> Tuple[str, int, float, float, bool]:
+    """
+    Normalize client render options (any object with format/dpi/width/height/
+    thumbnail attributes, or None) into (format, dpi, width, height, thumbnail)
+    """
+    fmt = (getattr(options, "format", None) or "png").lower()
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(
+            f"Unsupported image format '{fmt}'. Use one of: {', '.join(SUPPORTED_FORMATS)}"
+        )
+    thumbnail = bool(getattr(options, "thumbnail", False))
+    default_width, default_height = THUMBNAIL_SIZE if thumbnail else DEFAULT_SIZES[kind]
+    width = float(getattr(options, "width", None) or default_width)
+    height = float(getattr(options, "height", None) or default_height)
+    width = min(max(width, 1.0), MAX_SIZE_INCHES)
+    height = min(max(height, 1.0), MAX_SIZE_INCHES)
+    dpi = getattr(options, "dpi", None) or (THUMBNAIL_DPI if thumbnail else 100)
+    dpi = int(min(max(dpi, MIN_DPI), MAX_DPI))
+    return fmt, dpi, width, height, thumbnail
+
+
+def get_template(kind: str, width: float, height: float, thumbnail: bool) -> FigureTemplate:
+    """Return this thread's template for the given plot kind and size"""
+    cache = getattr(_templates, "cache", None)
+    if cache is None:
+        cache = _templates.cache = OrderedDict()
+    key = (kind, round(width, 2), round(height, 2), thumbnail)
+    template = cache.get(key)
+    if template is None:
+        template = cache[key] = FigureTemplate(width, height, thumbnail)
+        while len(cache) > MAX_TEMPLATES_PER_THREAD:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return template
+
+
+def encode_figure(fig: Figure, fmt: str = "png", dpi: int = 100) -> Tuple[bytes, int, int]:
+    """
+    Encode a figure to bytes in a single render pass.
+    Returns (data, width_px, height_px).
+    """
+    if fmt == "svg":
+        buf = BytesIO()
+        fig.savefig(buf, format="svg")
+        width, height = fig.get_size_inches() * 72
+        return buf.getvalue(), int(width), int(height)
+
+    canvas = fig.canvas
+    if not isinstance(canvas, FigureCanvasAgg):
+        canvas = FigureCanvasAgg(fig)
+    fig.set_dpi(dpi)
+    canvas.draw()
+    rgba = np.asarray(canvas.buffer_rgba())
+    image = Image.fromarray(rgba, "RGBA").convert("RGB")
+
+    buf = BytesIO()
+    if fmt == "png":
+        image.quantize(colors=PNG_PALETTE_COLORS, method=Image.Quantize.FASTOCTREE).save(
+            buf, format="PNG", compress_level=6
+        )
+    else:
+        image.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+    return buf.getvalue(), image.width, image.height
+
+
+def _record(kind: str, image: RenderedImage) -> RenderedImage:
+    with _stats_lock:
+        entry = _stats[f"{kind}:{image.format}"]
+        entry["count"] += 1
+        entry["render_ms"] += image.render_ms
+        entry["bytes"] += len(image.data)
+    return image
+
+
+def render_stats() -> Dict[str, Dict[str, float]]:
+    """Average render time and payload size per plot kind and format"""
+    with _stats_lock:
+        return {
+            key: {
+                "count": int(entry["count"]),
+                "avg_render_ms": round(entry["render_ms"] / entry["count"], 3),
+                "avg_bytes": int(entry["bytes"] / entry["count"]),
+            }
+            for key, entry in _stats.items()
+            if entry["count"]
+        }
+
+
+def render_pyplot_figure(fig: Figure, options: Any = None, *, kind: str) -> RenderedImage:
+    """Encode an existing (e.g. pyplot or library-created) figure, counted under ``kind``"""
+    fmt, dpi, _, _, _ = resolve_options(options, kind)
+    start = time.perf_counter()
+    data, width, height = encode_figure(fig, fmt, dpi)
+    return _record(
+        f"{kind}_figure",
+        RenderedImage(data, fmt, width, height, (time.perf_counter() - start) * 1000),
+    )
+
+
+def _bar_vertices(heights: np.ndarray) -> np.ndarray:
+    n = len(heights)
+    left = np.arange(n) - 0.4
+    right = left + 0.8
+    verts = np.empty((n, 4, 2))
+    verts[:, 0, 0] = verts[:, 1, 0] = left
+    verts[:, 2, 0] = verts[:, 3, 0] = right
+    verts[:, 0, 1] = verts[:, 3, 1] = 0.0
+    verts[:, 1, 1] = verts[:, 2, 1] = heights
+    return verts
+
+
+def _downsample_bars(values: np.ndarray, max_bars: int) -> Tuple[np.ndarray, int]:
+    """Reduce to at most max_bars bars by taking the maximum over each bin"""
+    if len(values) <= max_bars:
+        return values, 1
+    stride = int(np.ceil(len(values) / max_bars))
+    return np.maximum.reduceat(values, np.arange(0, len(values), stride)), stride
+
+
+def render_state_probabilities(
+    probabilities: Sequence[float],
+    options: Any = None,
+    labels: Optional[Sequence[str]] = None,
+    title: str = "Quantum State Probabilities",
+    xlabel: str = "Basis State",
+) -> RenderedImage:
+    """
+    Render a probability bar chart. All bars are drawn as one PolyCollection,
+    and more bars than pixel columns are binned (max per bin) before drawing.
+    """
+    fmt, dpi, width, height, thumbnail = resolve_options(options, "state_probabilities")
+    start = time.perf_counter()
+    template = get_template("state_probabilities", width, height, thumbnail)
+    ax = template.ax
+
+    values = np.asarray(probabilities, dtype=float).ravel()
+    values, stride = _downsample_bars(values, max(int(width * dpi), 1))
+    bars = template.artists.get("bars")
+    if bars is None:
+        bars = PolyCollection([], facecolors="#1f77b4", edgecolors="none")
+        ax.add_collection(bars)
+        template.artists["bars"] = bars
+    bars.set_verts(_bar_vertices(values))
+
+    ax.set_xlim(-0.5, max(len(values), 1) - 0.5)
+    ax.set_ylim(0, max(float(values.max()) if len(values) else 0.0, 1e-12) * 1.05)
+    if not thumbnail:
+        ax.set_title(title)
+        ax.set_xlabel(xlabel if stride == 1 else f"{xlabel} (bins of {stride})")
+        ax.set_ylabel("Probability")
+        if labels is not None and stride == 1 and len(labels) <= 32:
+            ax.set_xticks(range(len(labels)))
+            ax.set_xticklabels([str(label) for label in labels], rotation=45, ha="right")
+        else:
+            ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+            ax.xaxis.set_major_formatter(ScalarFormatter())
+
+    data, px_width, px_height = encode_figure(template.fig, fmt, dpi)
+    return _record(
+        "state_probabilities",
+        RenderedImage(data, fmt, px_width, px_height, (time.perf_counter() - start) * 1000),
+    )
+
+
+def layer_color(layer: Tuple[int, int]) -> str:
+    return LAYER_COLORS[(layer[0] * 7 + layer[1]) % len(LAYER_COLORS)]
+
+
+def render_layout(
+    polygons_by_layer: Dict[Tuple[int, int], Sequence[np.ndarray]],
+    bbox: Optional[Sequence[Sequence[float]]] = None,
+    options: Any = None,
+    title: Optional[str] = None,
+) -> RenderedImage:
+    """
+    Render layout polygons, one PolyCollection per layer, on a reused canvas.
+    ``polygons_by_layer`` is the ``Component.get_polygons(by_spec=True)`` mapping.
+    """
+    fmt, dpi, width, height, thumbnail = resolve_options(options, "layout")
+    start = time.perf_counter()
+    template = get_template("layout", width, height, thumbnail)
+    ax = template.ax
+
+    for collection in template.artists.pop("layers", []):
+        collection.remove()
+    collections = []
+    for layer, polygons in sorted(polygons_by_layer.items()):
+        if not len(polygons):
+            continue
+        collection = PolyCollection(
+            polygons,
+            facecolors=layer_color(layer),
+            edgecolors="none",
+            alpha=0.6,
+        )
+        ax.add_collection(collection)
+        collections.append(collection)
+    template.artists["layers"] = collections
+
+    if bbox is None:
+        points = [np.asarray(p) for polygons in polygons_by_layer.values() for p in polygons]
+        if points:
+            stacked = np.concatenate(points)
+            bbox = (stacked.min(axis=0), stacked.max(axis=0))
+        else:
+            bbox = ((0.0, 0.0), (1.0, 1.0))
+    (xmin, ymin), (xmax, ymax) = np.asarray(bbox, dtype=float)
+    margin = max(xmax - xmin, ymax - ymin, 1e-9) * 0.05
+    ax.set_xlim(xmin - margin, xmax + margin)
+    ax.set_ylim(ymin - margin, ymax + margin)
+    ax.set_aspect("equal", adjustable="box")
+    if not thumbnail:
+        ax.set_title(title or "")
+
+    data, px_width, px_height = encode_figure(template.fig, fmt, dpi)
+    return _record(
+        "layout",
+        RenderedImage(data, fmt, px_width, px_height, (time.perf_counter() - start) * 1000),
+    )
+
+
+def render_component(component: Any, options: Any = None, title: Optional[str] = None) -> RenderedImage:
+    """Render a gdsfactory component from its flattened polygons"""
+    polygons = component.get_polygons(by_spec=True)
+    return render_layout(polygons, np.asarray(component.bbox), options, title)
+
+
+def render_spectrum(
+    x: Sequence[float],
+    y: Sequence[float],
+    options: Any = None,
+    title: str = "",
+    xlabel: str = "Wavelength (nm)",
+    ylabel: str = "Transmission",
+) -> RenderedImage:
+    """Render a single line plot (e.g. a transmission spectrum)"""
+    fmt, dpi, width, height, thumbnail = resolve_options(options, "spectrum")
+    start = time.perf_counter()
+    template = get_template("spectrum", width, height, thumbnail)
+    ax = template.ax
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    line = template.artists.get("line")
+    if line is None:
+        (line,) = ax.plot([], [], color="#1f77b4")
+        template.artists["line"] = line
+    line.set_data(x, y)
+    if len(x):
+        ax.set_xlim(float(x.min()), float(x.max()))
+        span = float(y.max() - y.min()) or 1.0
+        ax.set_ylim(float(y.min()) - 0.05 * span, float(y.max()) + 0.05 * span)
+    if not thumbnail:
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+
+    data, px_width, px_height = encode_figure(template.fig, fmt, dpi)
+    return _record(
+        "spectrum",
+        RenderedImage(data, fmt, px_width, px_height, (time.perf_counter() - start) * 1000),
+    )
@@ -0,0 +1,163 @@
+"""
+Response serialization and compression for the quantum backend.
+
+NumPy arrays are handed to orjson as-is (complex arrays as separate real and
+imaginary arrays), so large state vectors are never expanded into Python
+lists. ``CompressionMiddleware`` then gzip/brotli-encodes bodies above a size
+threshold according to the client's ``Accept-Encoding``.
+"""
+import gzip
+from typing import Any, Dict, List
+
+import numpy as np
+import orjson
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+# Above this size, favour compression speed over ratio
+FAST_COMPRESSION_SIZE = 1 << 20
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "image/svg+xml")
+
+
+def _default(obj: Any) -> Any:
+    """Fallback for objects orjson does not serialize natively"""
+    if isinstance(obj, np.ndarray):
+        if np.iscomplexobj(obj):
+            return {
+                "real": np.ascontiguousarray(obj.real),
+                "imag": np.ascontiguousarray(obj.imag),
+            }
+        if obj.ndim == 0:
+            return obj.item()
+        if obj.dtype.kind in "biuf" and obj.dtype != np.float16 and obj.dtype.isnative:
+            # ndarray subclasses (e.g. PennyLane tensors) and strided views
+            return np.ascontiguousarray(obj).view(np.ndarray)
+        return obj.tolist()
+    if isinstance(obj, (complex, np.complexfloating)):
+        return {"real": float(obj.real), "imag": float(obj.imag)}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+def complex_matrix_rows(matrix: np.ndarray) -> List[List[Dict[str, float]]]:
+    """
+    Rows of {"real", "imag"} cells, the unitary format the frontend renders.
+    Built from two bulk ``tolist()`` calls instead of per-element float().
+    """
+    matrix = np.asarray(matrix)
+    return [
+        [{"real": re, "imag": im} for re, im in zip(real_row, imag_row)]
+        for real_row, imag_row in zip(matrix.real.tolist(), np.imag(matrix).tolist())
+    ]
+
+
+class NumpyJSONResponse(Response):
+    """JSON response rendered with orjson, with native NumPy array support"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _select_encoding(accept_encoding: str) -> str:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return ""
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    fast = len(body) >= FAST_COMPRESSION_SIZE
+    if encoding == "br":
+        return brotli.compress(body, quality=1 if fast else 5)
+    return gzip.compress(body, compresslevel=1 if fast else 6, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses complete (non-streaming) responses with
+    brotli or gzip when the client accepts it and the body is large enough.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = _select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            pending, start_message = start_message, None
+            headers = MutableHeaders(raw=pending["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                # Streaming or small responses pass through untouched
+                await send(pending)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(pending)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
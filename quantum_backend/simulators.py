@@ -0,0 +1,256 @@
+"""
+Simulator backend selection for the qubit circuit model.
+
+The backend is chosen from the circuit's wire count, gate count and a memory
+budget:
+
+- ``default.qubit`` for small circuits, where its low setup cost wins
+- ``lightning.qubit`` for medium widths, while a dense state vector fits
+- ``default.tensor`` (MPS) for wide circuits whose two-qubit gates leave the
+  bond dimension small enough to be represented exactly
+
+When only an MPS fits and the dense output it would have to return does
+not, the circuit is sampled instead (``BackendChoice.sampled``). Requests
+that fit none of these are refused before any device is created, with the
+estimate that ruled them out.
+"""
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pennylane as qml
+
+BYTES_PER_AMPLITUDE = 16  # complex128
+
+# Copies of the state vector each simulator holds at peak
+STATEVECTOR_OVERHEAD = {
+    "default.qubit": 3.0,
+    "lightning.qubit": 1.5,
+}
+# Workspace factor for MPS tensors during SVD truncation
+MPS_OVERHEAD = 4.0
+MPS_MAX_BOND_DIM = 256
+
+# Up to this width default.qubit is fast enough and cheapest to set up
+DEFAULT_QUBIT_MAX_WIRES = 12
+DEFAULT_QUBIT_MAX_GATES = 200
+# From this width an MPS is preferred whenever the bond dimension allows it
+MPS_MIN_WIRES = 24
+
+MEMORY_BUDGET_BYTES = int(os.environ.get("QUANTUM_SIM_MEMORY_BUDGET_MB", "4096")) * 2**20
+
+SUPPORTED_BACKENDS = ("default.qubit", "lightning.qubit", "default.tensor")
+# Devices whose shot sampling ignores the seed (PennyLane-Lightning 0.40)
+UNSEEDED_SAMPLERS = ("lightning.qubit",)
+
+
+class SimulationTooLargeError(ValueError):
+    """Raised when no simulator can run a circuit within the memory budget."""
+
+    def __init__(self, message: str, estimated_bytes: int, budget_bytes: int):
+        super().__init__(message)
+        self.estimated_bytes = estimated_bytes
+        self.budget_bytes = budget_bytes
+
+
+class BackendChoice:
+    """Selected simulator plus the estimate that justified it."""
+
+    def __init__(
+        self,
+        name: str,
+        reason: str,
+        estimated_peak_memory: int,
+        bond_dim: Optional[int] = None,
+        sampled: bool = False,
+    ):
+        self.name = name
+        self.reason = reason
+        self.estimated_peak_memory = estimated_peak_memory
+        self.bond_dim = bond_dim
+        self.sampled = sampled  # dense output doesn't fit; return samples instead
+
+    def as_dict(self) -> Dict[str, Any]:
+        info = {
+            "name": self.name,
+            "reason": self.reason,
+            "estimated_peak_memory_bytes": int(self.estimated_peak_memory),
+        }
+        if self.bond_dim is not None:
+            info["max_bond_dim"] = self.bond_dim
+        if self.sampled:
+            info["sampled"] = True
+        return info
+
+
+@lru_cache(maxsize=None)
+def is_available(name: str) -> bool:
+    """Whether the PennyLane device plugin is installed"""
+    try:
+        qml.device(name, wires=1)
+        return True
+    except Exception:
+        return False
+
+
+def format_bytes(num_bytes: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} PiB"
+
+
+def dense_output_bytes(num_wires: int) -> int:
+    """Memory for returning the full state and probabilities as JSON"""
+    # complex state + float probabilities + ~60 bytes of JSON text per entry
+    return (2 ** num_wires) * (BYTES_PER_AMPLITUDE + 8 + 60)
+
+
+def mps_bond_dimension(num_wires: int, two_qubit_gates: Iterable[Tuple[int, int]]) -> int:
+    """
+    Upper bound on the MPS bond dimension needed to hold the final state
+    exactly. Each two-qubit gate at most doubles the bond dimension of every
+    cut it spans, and no cut needs more than 2**min(left, right) wires.
+    """
+    if num_wires < 2:
+        return 1
+    crossings = np.zeros(num_wires, dtype=np.int64)
+    for a, b in two_qubit_gates:
+        lo, hi = min(a, b), max(a, b)
+        crossings[lo] += 1
+        crossings[hi] -= 1
+    crossings = np.cumsum(crossings)[:-1]
+    cuts = np.arange(1, num_wires)
+    exponents = np.minimum(crossings, np.minimum(cuts, num_wires - cuts))
+    return int(2 ** min(int(exponents.max()), 62))
+
+
+def estimate_memory(name: str, num_wires: int, bond_dim: Optional[int] = None) -> int:
+    """Peak simulator memory in bytes, excluding the response payload"""
+    if name == "default.tensor":
+        bond_dim = bond_dim or 1
+        return int(num_wires * 2 * bond_dim * bond_dim * BYTES_PER_AMPLITUDE * MPS_OVERHEAD)
+    return int((2 ** num_wires) * BYTES_PER_AMPLITUDE * STATEVECTOR_OVERHEAD[name])
+
+
+def select_backend(
+    num_wires: int,
+    num_gates: int,
+    two_qubit_gates: Iterable[Tuple[int, int]] = (),
+    requested: Optional[str] = None,
+    output_bytes: int = 0,
+    budget_bytes: Optional[int] = None,
+    sampled_output_bytes: Optional[int] = None,
+) -> BackendChoice:
+    """
+    Pick a simulator for the circuit. ``requested`` overrides the heuristic,
+    but is still checked against the memory budget. ``output_bytes`` is the
+    memory the response itself will need (e.g. ``dense_output_bytes``).
+    With ``sampled_output_bytes``, an MPS whose dense output doesn't fit
+    may return samples of that size instead.
+    """
+    budget = MEMORY_BUDGET_BYTES if budget_bytes is None else budget_bytes
+    bond_dim = mps_bond_dimension(num_wires, list(two_qubit_gates))
+
+    def choice(name: str, reason: str, sampled: bool = False) -> BackendChoice:
+        output = sampled_output_bytes if sampled else output_bytes
+        peak = estimate_memory(name, num_wires, bond_dim) + output
+        return BackendChoice(name, reason, peak, bond_dim if name == "default.tensor" else None, sampled)
+
+    def fits(candidate: BackendChoice) -> bool:
+        return candidate.estimated_peak_memory <= budget
+
+    def sampled_mps(reason: str) -> Optional[BackendChoice]:
+        if sampled_output_bytes is None:
+            return None
+        candidate = choice("default.tensor", f"{reason}; dense output exceeds budget, sampling", sampled=True)
+        return candidate if fits(candidate) else None
+
+    if requested:
+        if requested not in SUPPORTED_BACKENDS:
+            raise ValueError(
+                f"Unknown simulator backend '{requested}'. Use one of: {', '.join(SUPPORTED_BACKENDS)}"
+            )
+        if not is_available(requested):
+            raise ValueError(f"Simulator backend '{requested}' is not installed on the server")
+        if requested == "default.tensor" and bond_dim > MPS_MAX_BOND_DIM:
+            raise SimulationTooLargeError(
+                f"Circuit needs an MPS bond dimension of {bond_dim}, above the limit of {MPS_MAX_BOND_DIM}",
+                estimate_memory(requested, num_wires, bond_dim) + output_bytes,
+                budget,
+            )
+        selected = choice(requested, "requested by client")
+        if not fits(selected) and requested == "default.tensor":
+            selected = sampled_mps("requested by client") or selected
+        if not fits(selected):
+            raise SimulationTooLargeError(
+                f"{requested} would need about {format_bytes(selected.estimated_peak_memory)} "
+                f"for {num_wires} wires, above the {format_bytes(budget)} budget",
+                selected.estimated_peak_memory,
+                budget,
+            )
+        return selected
+
+    candidates = []
+    mps_usable = is_available("default.tensor") and bond_dim <= MPS_MAX_BOND_DIM
+    if num_wires <= DEFAULT_QUBIT_MAX_WIRES and num_gates <= DEFAULT_QUBIT_MAX_GATES:
+        candidates.append(choice("default.qubit", f"small circuit ({num_wires} wires, {num_gates} gates)"))
+    if mps_usable and num_wires >= MPS_MIN_WIRES:
+        candidates.append(choice("default.tensor", f"wide circuit with low entanglement (bond dimension {bond_dim})"))
+    if is_available("lightning.qubit"):
+        candidates.append(choice("lightning.qubit", f"dense state vector for {num_wires} wires"))
+    candidates.append(choice("default.qubit", f"dense state vector for {num_wires} wires"))
+    if mps_usable:
+        candidates.append(choice("default.tensor", f"state vector exceeds budget, bond dimension {bond_dim}"))
+
+    for candidate in candidates:
+        if fits(candidate):
+            return candidate
+    if mps_usable:
+        sampled = sampled_mps(f"wide circuit with low entanglement (bond dimension {bond_dim})")
+        if sampled is not None:
+            return sampled
+
+    smallest = min(candidates, key=lambda c: c.estimated_peak_memory)
+    raise SimulationTooLargeError(
+        f"Circuit with {num_wires} wires and {num_gates} gates needs at least "
+        f"{format_bytes(smallest.estimated_peak_memory)} ({smallest.name}), "
+        f"above the {format_bytes(budget)} memory budget",
+        smallest.estimated_peak_memory,
+        budget,
+    )
+
+
+def create_device(choice: BackendChoice, num_wires: int, **kwargs):
+    """Instantiate the PennyLane device for a backend choice"""
+    if choice.name == "default.tensor":
+        return qml.device(
+            "default.tensor", wires=num_wires, method="mps", max_bond_dim=choice.bond_dim, **kwargs
+        )
+    return qml.device(choice.name, wires=num_wires, **kwargs)
+
+
+def mps_tensors(choice: BackendChoice, num_wires: int, operations: Sequence[Any]) -> List[np.ndarray]:
+    """
+    Final MPS of a circuit, built with quimb as ``default.tensor`` does, as
+    right-canonical site tensors shaped (left bond, 2, right bond)
+    """
+    import quimb.tensor as qtn
+
+    circuit = qtn.CircuitMPS(num_wires, max_bond=choice.bond_dim)
+    for op in operations:
+        circuit.apply_gate_raw(qml.matrix(op), op.wires.tolist(), contract="swap+split")
+    psi = circuit.psi.copy()
+    psi.right_canonize()
+
+    tensors = []
+    for site in range(num_wires):
+        left = [psi.bond(site - 1, site)] if site > 0 else []
+        right = [psi.bond(site, site + 1)] if site < num_wires - 1 else []
+        data = psi[site].transpose(*left, psi.site_ind(site), *right).data
+        tensors.append(np.asarray(data).reshape(
+            data.shape[0] if left else 1, 2, data.shape[-1] if right else 1
+        ))
+    return tensors
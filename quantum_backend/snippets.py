@@ -0,0 +1,210 @@
+"""
+Memoized execution of user code snippets.
+
+The GDSFactory and Perceval pages mostly submit the same template snippets
+over and over. Two caches avoid redoing that work:
+
+- compiled code objects, keyed by the exact source (so line numbers in
+  tracebacks and whitespace inside string literals are the user's own)
+- complete serialized responses, keyed by a hash of the snippet kind, the
+  normalized source, the versions of the libraries it runs against, and
+  the render options. Entries are evicted least recently used, within an
+  entry count and a byte budget.
+
+A snippet is only memoized if it looks deterministic. Code that touches
+random number generators (any ``random*`` name or attribute, and modules
+such as ``numpy.random``), clocks, UUIDs, samplers or files is detected
+from its syntax tree and always executed.
+"""
+import ast
+import hashlib
+import io
+import os
+import threading
+import tokenize
+from collections import OrderedDict
+from functools import lru_cache
+from importlib import metadata
+from types import CodeType
+from typing import Any, Dict, Optional, Tuple
+
+MAX_ENTRIES = 512
+MAX_BYTES = int(os.environ.get("QUANTUM_SNIPPET_CACHE_MB", 256)) * 1024 * 1024
+COMPILE_CACHE_SIZE = 256
+
+# Distributions whose versions change snippet output
+LIBRARIES = ("gdsfactory", "perceval-quandela", "numpy", "matplotlib")
+
+# Modules (and their submodules) and names whose results differ from run to run;
+# any name starting with "random" counts too (random_unitary, random_state, ...)
+NONDETERMINISTIC_MODULES = {
+    "random", "secrets", "time", "datetime", "uuid", "numpy.random", "scipy.stats",
+}
+NONDETERMINISTIC_PREFIX = "random"
+NONDETERMINISTIC_NAMES = {
+    "default_rng", "RandomState", "seed",
+    "urandom", "uuid1", "uuid4", "now", "today", "utcnow",
+    "time", "perf_counter", "monotonic", "time_ns",
+    "Sampler", "samples", "sample_count",
+    "open", "input",
+}
+
+
+def normalize(code: str) -> str:
+    """
+    Line endings, trailing whitespace outside string literals and surrounding
+    blank lines don't change behaviour. Source that doesn't tokenize is only
+    given uniform line endings.
+    """
+    code = code.replace("\r\n", "\n").replace("\r", "\n")
+    # Lines that end inside a multi-line string keep their trailing whitespace
+    inside_string = set()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            inside_string.update(range(token.start[0], token.end[0]))
+    except (tokenize.TokenError, SyntaxError):
+        return code
+    lines = [line if row in inside_string else line.rstrip() for row, line in enumerate(code.split("\n"), 1)]
+    return "\n".join(lines).strip("\n") + "\n"
+
+
+def _nondeterministic_module(module: str) -> bool:
+    return any(module == name or module.startswith(name + ".") for name in NONDETERMINISTIC_MODULES)
+
+
+def _nondeterministic_name(name: str) -> bool:
+    return name in NONDETERMINISTIC_NAMES or name.startswith(NONDETERMINISTIC_PREFIX)
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _compile(source: str, filename: str) -> CodeType:
+    return compile(source, filename, "exec")
+
+
+def compile_snippet(code: str, filename: str = "<snippet>") -> CodeType:
+    """Compile a snippet as written, reusing the code object for repeated sources"""
+    return _compile(code, filename)
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _nondeterminism(source: str) -> Optional[str]:
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return "syntax error"
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if _nondeterministic_module(alias.name):
+                    return f"imports {alias.name}"
+        elif isinstance(node, ast.ImportFrom):
+            if _nondeterministic_module(node.module or ""):
+                return f"imports {node.module}"
+            for alias in node.names:
+                if _nondeterministic_name(alias.name) or _nondeterministic_module(f"{node.module}.{alias.name}"):
+                    return f"imports {alias.name}"
+        elif isinstance(node, ast.Attribute) and _nondeterministic_name(node.attr):
+            return f"uses .{node.attr}"
+        elif isinstance(node, ast.Name) and _nondeterministic_name(node.id):
+            return f"uses {node.id}"
+    return None
+
+
+def nondeterminism(code: str) -> Optional[str]:
+    """Why a snippet can't be memoized, or None if it looks deterministic"""
+    return _nondeterminism(normalize(code))
+
+
+@lru_cache(maxsize=1)
+def library_versions() -> Tuple[Tuple[str, str], ...]:
+    versions = []
+    for name in LIBRARIES:
+        try:
+            versions.append((name, metadata.version(name)))
+        except metadata.PackageNotFoundError:
+            versions.append((name, ""))
+    return tuple(versions)
+
+
+def cache_key(kind: str, code: str, options: Any = None) -> str:
+    """Hash of everything that determines a snippet's response"""
+    digest = hashlib.sha256()
+    digest.update(kind.encode())
+    digest.update(b"\0")
+    digest.update(normalize(code).encode())
+    digest.update(b"\0")
+    digest.update(repr(library_versions()).encode())
+    digest.update(b"\0")
+    if options is not None:
+        fields = ("format", "dpi", "width", "height", "thumbnail")
+        digest.update(repr([getattr(options, field, None) for field in fields]).encode())
+    return digest.hexdigest()
+
+
+class ExecutionCache:
+    """LRU of serialized responses, bounded by entry count and bytes"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[bytes, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Any]]:
+        """The cached (body, context) pair, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, body: bytes, context: Any = None) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = (body, context)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def discard(self, key: str) -> None:
+        """Drop an entry whose context is no longer valid, and count it as a miss"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[0])
+                self.hits -= 1
+                self.misses += 1
+
+    def bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "compiled": _compile.cache_info()._asdict(),
+                "library_versions": dict(library_versions()),
+            }
+
+
+cache = ExecutionCache()
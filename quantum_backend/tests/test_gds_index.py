@@ -0,0 +1,21 @@
+"""Indexed bounding boxes agree with gdstk's outline of each shape"""
+import numpy as np
+import pytest
+
+from quantum_backend import gds_index
+
+gdstk = pytest.importorskip("gdstk")
+
+
+def test_path_boxes_match_outlines(tmp_path):
+    lib = gdstk.Library()
+    cell = lib.new_cell("TOP")
+    cell.add(gdstk.FlexPath([(0, 0), (10, 0)], 0.1, ends="flush", simple_path=True))
+    cell.add(gdstk.FlexPath([(0, 5), (10, 5), (10, 15)], 0.2, ends="extended", simple_path=True))
+    cell.add(gdstk.FlexPath([(20, 0), (25, 3)], 0.4, simple_path=True))
+    path = tmp_path / "paths.gds"
+    lib.write_gds(str(path))
+    index = gds_index.scan(str(path), "0" * 64)
+    expected = [np.ravel(p.bounding_box()) for p in cell.get_polygons()]
+    np.testing.assert_allclose(index.arrays["bbox"], expected, atol=1e-9)
+    np.testing.assert_allclose(index.arrays["bbox"][0], [0.0, -0.05, 10.0, 0.05])
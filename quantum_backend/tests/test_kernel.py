@@ -0,0 +1,46 @@
+"""Incremental re-execution must leave the namespace as a full run would"""
+import pytest
+
+pytest.importorskip("gdsfactory")
+
+from quantum_backend import kernel
+
+
+def run_edits(*scripts):
+    """Run each script in turn in one session; return the last result and the session"""
+    session = kernel.Kernel("gdsfactory")
+    for script in scripts:
+        result = session.execute(script)
+    return result, session
+
+
+@pytest.mark.parametrize("script", [
+    # an alias changed in place changes the aliased list
+    "a = [1, 2]\nb = a\nb.append({v})\nprint(a)\n",
+    # an element of a list changed through an alias
+    "a = [[1], [2]]\nb = a[0]\nb.append({v})\nprint(a)\n",
+    # aliases of aliases
+    "a = [1]\nb = a\nc = b\nc += [{v}]\nprint(a)\n",
+    # a name passed to a call that shuffles it
+    "a = np.arange(6)\nnp.random.default_rng({v}).shuffle(a)\nprint(a)\n",
+])
+def test_edit_matches_full_run(script):
+    edited, session = run_edits(script.format(v=3), script.format(v=4))
+    expected, fresh = run_edits(script.format(v=4))
+    assert [cell["stdout"] for cell in edited["cells"]] == [cell["stdout"] for cell in expected["cells"]]
+    assert repr(session.namespace["a"]) == repr(fresh.namespace["a"])
+
+
+def test_alias_edit_reruns_the_aliased_cells():
+    script = "a = [1, 2]\nb = a\nb.append({v})\nprint(a)\n"
+    result, session = run_edits(script.format(v=3), script.format(v=4))
+    assert result["executed"] == 4
+    assert session.namespace["a"] == [1, 2, 4]
+    assert result["cells"][-1]["stdout"] == "[1, 2, 4]\n"
+
+
+def test_unrelated_edit_reuses_cells():
+    script = "a = [1, 2]\nb = a\nb.append(3)\nprint(a)\nx = {v}\n"
+    result, _ = run_edits(script.format(v=1), script.format(v=2))
+    assert result["executed"] == 1
+    assert result["reused"] == 4
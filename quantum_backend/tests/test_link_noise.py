@@ -0,0 +1,33 @@
+"""Link statistics depend only on the seed, not on how the shards are spread"""
+import numpy as np
+import pytest
+
+from quantum_backend import link_noise, sharding
+
+
+@pytest.fixture
+def pool_of_four(monkeypatch):
+    sharding.shutdown()
+    monkeypatch.setattr(sharding, "MAX_WORKERS", 4)
+    yield
+    sharding.shutdown()
+
+
+def test_workers_give_identical_results(pool_of_four):
+    distances = np.linspace(1.0, 80.0, 40)
+    transmittance = 10 ** (-0.2 * distances / 10)  # 0.2 dB/km fiber
+    attempts = 200_000  # 8M edge-attempts, several shards
+    serial = link_noise.simulate_links(distances, transmittance, attempts, seed=7, workers=1)
+    parallel = link_noise.simulate_links(distances, transmittance, attempts, seed=7, workers=4)
+    assert serial["shards"] == parallel["shards"] > 1
+    assert parallel["workers"] == 4
+    for key in ("successes", "success_probability", "fidelity", "fidelity_ci", "dark_count_fraction"):
+        np.testing.assert_array_equal(serial[key], parallel[key])
+
+
+def test_shards_follow_problem_size_only(pool_of_four):
+    distances = np.full(10, 20.0)
+    transmittance = 10 ** (-0.2 * distances / 10)
+    stats = link_noise.simulate_links(distances, transmittance, 300_000, seed=1, workers=2)
+    attempts_per_shard = link_noise.SHARD_ELEMENTS // 10
+    assert stats["shards"] == -(-300_000 // attempts_per_shard)
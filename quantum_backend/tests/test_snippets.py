@@ -0,0 +1,35 @@
+"""Snippets that differ from run to run must never be memoized"""
+import pytest
+
+from quantum_backend import snippets
+
+
+@pytest.mark.parametrize("code", [
+    "from numpy.random import rand\nx = rand(3)\n",
+    "import numpy.random as npr\nx = npr.rand(3)\n",
+    "from numpy import random\nx = random.rand(3)\n",
+    "from scipy.stats import unitary_group\nU = unitary_group.rvs(4)\n",
+    "U = pcvl.Matrix.random_unitary(4)\n",
+    "x = np.random.rand(3)\n",
+    "import time\nt = time.time()\n",
+])
+def test_nondeterministic_snippets_are_detected(code):
+    assert snippets.nondeterminism(code) is not None
+
+
+@pytest.mark.parametrize("code", [
+    "c = pcvl.Circuit(2) // pcvl.BS()\n",
+    "import numpy as np\nx = np.linspace(0, 1, 5)\n",
+])
+def test_deterministic_snippets_are_cacheable(code):
+    assert snippets.nondeterminism(code) is None
+
+
+def test_cache_key_ignores_formatting_outside_strings():
+    assert snippets.cache_key("gdsfactory", "x = 1  \r\ny = 2\n\n") == snippets.cache_key("gdsfactory", "\nx = 1\ny = 2\n")
+
+
+def test_cache_key_keeps_whitespace_inside_strings():
+    padded = 'text = """a  \nb"""\nprint(text)\n'
+    plain = 'text = """a\nb"""\nprint(text)\n'
+    assert snippets.cache_key("gdsfactory", padded) != snippets.cache_key("gdsfactory", plain)
@@ -0,0 +1,392 @@
+"""
+Tiled, level-of-detail previews of chip layouts.
+
+A component's polygons are extracted once into flat per-layer NumPy arrays
+(vertices, polygon offsets and bounding boxes). They are stored under a
+content hash, so re-running the same design reuses both the extraction and
+any tiles already rendered.
+
+Tiles follow the usual z/x/y pyramid over the square that encloses the
+layout: zoom 0 is one tile, and zoom z has 2**z x 2**z tiles with y=0 at the
+top. Each tile is rasterized straight from the polygons, with no matplotlib:
+
+1. cull polygons against the tile with their bounding boxes
+2. level of detail: polygons under a pixel become single pixels, polygons
+   a few pixels across become their bounding boxes, and only the rest are
+   scan-converted exactly
+3. scanline fill, vectorized over every edge of every polygon in the layer:
+   edge/row crossings become spans, and the spans are accumulated in a
+   difference image and cumulatively summed along each row. Outlines are
+   stroked as well, so waveguides thinner than a pixel do not break up
+4. layers are alpha-blended in layer order, with the preview colours
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    from quantum_backend import rendering
+except ImportError:
+    import rendering
+
+TILE_SIZE = 256
+MAX_ZOOM = 20
+# Deepest zoom needed: one pixel per this many µm
+MIN_PIXEL_SIZE = 0.005
+# Polygons smaller than this (pixels) are drawn as their bounding box
+LOD_BOX_PIXELS = 4.0
+LAYER_ALPHA = 0.6
+TILE_FORMATS = ("png", "webp")
+
+# Cache budgets
+MAX_LAYOUT_BYTES = 512 * 1024 * 1024
+MAX_TILE_BYTES = 64 * 1024 * 1024
+
+_lock = threading.Lock()
+_layouts: "OrderedDict[str, LayoutPolygons]" = OrderedDict()
+_layout_bytes = 0
+_tiles: "OrderedDict[tuple, bytes]" = OrderedDict()
+_tile_bytes = 0
+_stats = {"tiles_rendered": 0, "tile_cache_hits": 0, "render_ms": 0.0}
+
+
+class LayerPolygons:
+    """All polygons of one layer: vertex i of polygon p is vertices[starts[p] + i]"""
+
+    __slots__ = ("vertices", "starts", "counts", "bboxes")
+
+    def __init__(self, polygons):
+        polygons = [np.asarray(p, dtype=float).reshape(-1, 2) for p in polygons]
+        polygons = [p for p in polygons if len(p) >= 3]
+        self.counts = np.array([len(p) for p in polygons], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        self.vertices = np.concatenate(polygons) if polygons else np.empty((0, 2))
+        if polygons:
+            self.bboxes = np.concatenate([
+                np.minimum.reduceat(self.vertices, self.starts),
+                np.maximum.reduceat(self.vertices, self.starts),
+            ], axis=1)
+        else:
+            self.bboxes = np.empty((0, 4))
+
+    @classmethod
+    def from_arrays(cls, vertices: np.ndarray, counts: np.ndarray) -> "LayerPolygons":
+        """From flat vertices and per-polygon vertex counts (each at least 3)"""
+        layer = cls.__new__(cls)
+        layer.vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        layer.counts = np.asarray(counts, dtype=np.int64)
+        layer.starts = (np.cumsum(layer.counts) - layer.counts).astype(np.int64)
+        if len(layer.counts):
+            layer.bboxes = np.concatenate([
+                np.minimum.reduceat(layer.vertices, layer.starts),
+                np.maximum.reduceat(layer.vertices, layer.starts),
+            ], axis=1)
+        else:
+            layer.bboxes = np.empty((0, 4))
+        return layer
+
+    @property
+    def nbytes(self) -> int:
+        return self.vertices.nbytes + self.starts.nbytes + self.counts.nbytes + self.bboxes.nbytes
+
+    def polygons(self):
+        return np.split(self.vertices, self.starts[1:]) if len(self.counts) else []
+
+
+class LayoutPolygons:
+    """The extracted polygons of a component and its tile pyramid geometry"""
+
+    def __init__(self, layout_id: str, name: str, layers: Dict[Tuple[int, int], LayerPolygons]):
+        self.layout_id = layout_id
+        self.name = name
+        self.layers = layers
+        boxes = [layer.bboxes for layer in layers.values() if len(layer.bboxes)]
+        if boxes:
+            stacked = np.concatenate(boxes)
+            self.bbox = np.array([stacked[:, :2].min(axis=0), stacked[:, 2:].max(axis=0)])
+        else:
+            self.bbox = np.array([[0.0, 0.0], [1.0, 1.0]])
+        # The pyramid covers the square enclosing the layout
+        self.side = float(max(np.ptp(self.bbox[:, 0]), np.ptp(self.bbox[:, 1]), 1e-9))
+        zoom = np.ceil(np.log2(max(self.side / (TILE_SIZE * MIN_PIXEL_SIZE), 1.0)))
+        self.max_zoom = int(min(zoom, MAX_ZOOM))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(layer.nbytes for layer in self.layers.values())
+
+    def polygons_by_layer(self) -> Dict[Tuple[int, int], list]:
+        """The ``get_polygons(by_spec=True)`` mapping, for ``rendering.render_layout``"""
+        return {layer: polygons.polygons() for layer, polygons in self.layers.items()}
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "layout_id": self.layout_id,
+            "name": self.name,
+            "bbox": self.bbox,
+            "side": self.side,
+            "tile_size": TILE_SIZE,
+            "min_zoom": 0,
+            "max_zoom": self.max_zoom,
+            "layers": {
+                f"{layer[0]}/{layer[1]}": int(len(polygons.counts))
+                for layer, polygons in sorted(self.layers.items())
+            },
+            "tile_url": f"/api/layout/tiles/{self.layout_id}/{{z}}/{{x}}/{{y}}",
+        }
+
+
+def _layout_id(layers: Dict[Tuple[int, int], LayerPolygons]) -> str:
+    digest = hashlib.sha1()
+    for layer, polygons in sorted(layers.items()):
+        digest.update(np.asarray(layer, dtype=np.int64).tobytes())
+        digest.update(polygons.counts.tobytes())
+        digest.update(polygons.vertices.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def register(component: Any) -> LayoutPolygons:
+    """Extract a component's polygons once and keep them for tile requests"""
+    layers = {
+        tuple(int(v) for v in layer): LayerPolygons(polygons)
+        for layer, polygons in component.get_polygons(by_spec=True).items()
+    }
+    layout_id = _layout_id(layers)
+    with _lock:
+        existing = _layouts.get(layout_id)
+        if existing is not None:
+            _layouts.move_to_end(layout_id)
+            return existing
+    return adopt(LayoutPolygons(layout_id, getattr(component, "name", ""), layers))
+
+
+def adopt(layout: LayoutPolygons) -> LayoutPolygons:
+    """Store polygons extracted elsewhere (e.g. in a snippet process)"""
+    global _layout_bytes
+    with _lock:
+        existing = _layouts.get(layout.layout_id)
+        if existing is not None:
+            _layouts.move_to_end(layout.layout_id)
+            return existing
+        _layouts[layout.layout_id] = layout
+        _layout_bytes += layout.nbytes
+        # Evict least recently used layouts, but always keep the new one
+        while _layout_bytes > MAX_LAYOUT_BYTES and len(_layouts) > 1:
+            _, evicted = _layouts.popitem(last=False)
+            _layout_bytes -= evicted.nbytes
+        return layout
+
+
+def get_layout(layout_id: str) -> Optional[LayoutPolygons]:
+    with _lock:
+        layout = _layouts.get(layout_id)
+        if layout is not None:
+            _layouts.move_to_end(layout_id)
+        return layout
+
+
+def _index_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenated arange(start, start + count) for each pair"""
+    total = int(counts.sum())
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(total)
+
+
+def _add_spans(diff: np.ndarray, rows: np.ndarray, x_start: np.ndarray, x_end: np.ndarray) -> None:
+    """Mark pixel centres x + 0.5 in [x_start, x_end) of each row as covered"""
+    size = diff.shape[0]
+    c0 = np.clip(np.ceil(x_start - 0.5), 0, size).astype(np.int64)
+    c1 = np.clip(np.ceil(x_end - 0.5), 0, size).astype(np.int64)
+    keep = c1 > c0
+    rows, c0, c1 = rows[keep], c0[keep], c1[keep]
+    width = size + 1
+    diff += np.bincount(rows * width + c0, minlength=size * width).reshape(size, width)
+    diff -= np.bincount(rows * width + c1, minlength=size * width).reshape(size, width)
+
+
+def _scanline_spans(vertices: np.ndarray, starts: np.ndarray, counts: np.ndarray, size: int):
+    """Even-odd spans (row, x_start, x_end) of polygons in pixel coordinates"""
+    polygon = np.repeat(np.arange(len(counts)), counts)
+    following = np.arange(len(vertices)) + 1
+    following[starts + counts - 1] = starts
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = vertices[following, 0], vertices[following, 1]
+
+    # Rows whose centre r + 0.5 lies in [min(y0, y1), max(y0, y1))
+    r0 = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, size).astype(np.int64)
+    r1 = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, size).astype(np.int64)
+    n = r1 - r0
+    edges = np.flatnonzero(n > 0)
+    if not len(edges):
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    n = n[edges]
+    edge = np.repeat(edges, n)
+    rows = _index_ranges(r0[edges], n)
+    slope = (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    xs = x0[edge] + (rows + 0.5 - y0[edge]) * slope
+
+    # Pair up consecutive crossings of each polygon on each row
+    order = np.lexsort((xs, rows, polygon[edge]))
+    rows, xs = rows[order], xs[order]
+    return rows[0::2], xs[0::2], xs[1::2]
+
+
+def _edge_pixels(vertices: np.ndarray, starts: np.ndarray, counts: np.ndarray, size: int):
+    """Pixels along every polygon edge, sampled at least once per pixel"""
+    following = np.arange(len(vertices)) + 1
+    following[starts + counts - 1] = starts
+    delta = vertices[following] - vertices
+
+    # Clip each edge to the tile (slab method) so long edges stay cheap
+    t_lo = np.zeros(len(vertices))
+    t_hi = np.ones(len(vertices))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for axis in (0, 1):
+            p, d = vertices[:, axis], delta[:, axis]
+            t0, t1 = (-1 - p) / d, (size + 1 - p) / d
+            outside = (p < -1) | (p > size + 1)
+            t_lo = np.maximum(t_lo, np.where(d != 0, np.minimum(t0, t1), np.where(outside, np.inf, -np.inf)))
+            t_hi = np.minimum(t_hi, np.where(d != 0, np.maximum(t0, t1), np.where(outside, -np.inf, np.inf)))
+    keep = np.flatnonzero(t_hi >= t_lo)
+    origin = vertices[keep] + t_lo[keep, None] * delta[keep]
+    delta = (t_hi[keep] - t_lo[keep])[:, None] * delta[keep]
+
+    steps = np.ceil(np.abs(delta).max(axis=1)).astype(np.int64) + 1
+    edge = np.repeat(np.arange(len(keep)), steps)
+    t = (_index_ranges(np.zeros(len(steps), dtype=np.int64), steps) / np.repeat(steps, steps))[:, None]
+    points = np.floor(origin[edge] + t * delta[edge]).astype(np.int64)
+    inside = (points >= 0).all(axis=1) & (points < size).all(axis=1)
+    return points[inside, 1], points[inside, 0]
+
+
+def rasterize_layer(polygons: LayerPolygons, bounds: Tuple[float, float, float, float], size: int = TILE_SIZE) -> np.ndarray:
+    """Coverage mask of one layer over ``bounds`` = (xmin, ymin, xmax, ymax) in µm"""
+    xmin, ymin, xmax, ymax = bounds
+    scale = size / (xmax - xmin)
+    diff = np.zeros((size, size + 1), dtype=np.int32)
+
+    boxes = polygons.bboxes
+    visible = np.flatnonzero(
+        (boxes[:, 0] < xmax) & (boxes[:, 2] > xmin) & (boxes[:, 1] < ymax) & (boxes[:, 3] > ymin)
+    )
+    if not len(visible):
+        return np.zeros((size, size), dtype=bool)
+
+    # Bounding boxes in pixels, y down
+    px = np.empty((len(visible), 4))
+    px[:, 0] = (boxes[visible, 0] - xmin) * scale
+    px[:, 2] = (boxes[visible, 2] - xmin) * scale
+    px[:, 1] = (ymax - boxes[visible, 3]) * scale
+    px[:, 3] = (ymax - boxes[visible, 1]) * scale
+    extent = np.maximum(px[:, 2] - px[:, 0], px[:, 3] - px[:, 1])
+
+    # Sub-pixel polygons: the pixel under their centre
+    tiny = extent < 1.0
+    if tiny.any():
+        cx = np.clip(((px[tiny, 0] + px[tiny, 2]) / 2).astype(np.int64), 0, size - 1)
+        cy = np.clip(((px[tiny, 1] + px[tiny, 3]) / 2).astype(np.int64), 0, size - 1)
+        _add_spans(diff, cy, cx + 0.5, cx + 1.5)
+
+    # Small polygons: their bounding box, at least one pixel thick
+    small = (extent >= 1.0) & (extent < LOD_BOX_PIXELS)
+    if small.any():
+        b = px[small]
+        r0 = np.clip(np.floor(b[:, 1]), 0, size - 1).astype(np.int64)
+        r1 = np.clip(np.maximum(np.ceil(b[:, 3]), r0 + 1), 0, size).astype(np.int64)
+        n = np.maximum(r1 - r0, 0)
+        rows = _index_ranges(r0, n)
+        x_start = np.repeat(np.floor(b[:, 0]) + 0.5, n)
+        x_end = np.repeat(np.maximum(np.ceil(b[:, 2]), np.floor(b[:, 0]) + 1) + 0.5, n)
+        _add_spans(diff, rows, x_start, x_end)
+
+    # Everything else is scan-converted exactly
+    large = visible[extent >= LOD_BOX_PIXELS]
+    if len(large):
+        counts = polygons.counts[large]
+        vertices = polygons.vertices[_index_ranges(polygons.starts[large], counts)]
+        pixel_vertices = np.empty_like(vertices)
+        pixel_vertices[:, 0] = (vertices[:, 0] - xmin) * scale
+        pixel_vertices[:, 1] = (ymax - vertices[:, 1]) * scale
+        starts = np.cumsum(counts) - counts
+        rows, x_start, x_end = _scanline_spans(pixel_vertices, starts, counts, size)
+        _add_spans(diff, rows, x_start, x_end)
+        # Stroke the outlines too, so features thinner than a pixel stay visible
+        rows, cols = _edge_pixels(pixel_vertices, starts, counts, size)
+        _add_spans(diff, rows, cols + 0.5, cols + 1.5)
+
+    return np.cumsum(diff, axis=1)[:, :size] > 0
+
+
+def tile_bounds(layout: LayoutPolygons, z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    tile = layout.side / (1 << z)
+    xmin = layout.bbox[0, 0] + x * tile
+    ymax = layout.bbox[0, 1] + layout.side - y * tile
+    return xmin, ymax - tile, xmin + tile, ymax
+
+
+def _hex_rgb(color: str) -> np.ndarray:
+    return np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)], dtype=np.float32)
+
+
+def render_tile(layout: LayoutPolygons, z: int, x: int, y: int, fmt: str = "png") -> bytes:
+    """Encoded tile image; tiles are cached by layout, position and format"""
+    global _tile_bytes
+    if fmt not in TILE_FORMATS:
+        raise ValueError(f"Unsupported tile format '{fmt}'. Use one of: {', '.join(TILE_FORMATS)}")
+    if not 0 <= z <= layout.max_zoom or not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise KeyError(f"Tile {z}/{x}/{y} is outside the layout pyramid (max zoom {layout.max_zoom})")
+
+    key = (layout.layout_id, z, x, y, fmt)
+    with _lock:
+        cached = _tiles.get(key)
+        if cached is not None:
+            _tiles.move_to_end(key)
+            _stats["tile_cache_hits"] += 1
+            return cached
+
+    start = time.perf_counter()
+    bounds = tile_bounds(layout, z, x, y)
+    image = np.full((TILE_SIZE, TILE_SIZE, 3), 255.0, dtype=np.float32)
+    for layer, polygons in sorted(layout.layers.items()):
+        mask = rasterize_layer(polygons, bounds)
+        if mask.any():
+            color = _hex_rgb(rendering.layer_color(layer))
+            image[mask] = image[mask] * (1 - LAYER_ALPHA) + color * LAYER_ALPHA
+
+    buf = BytesIO()
+    pil_image = Image.fromarray(image.astype(np.uint8), "RGB")
+    if fmt == "png":
+        pil_image.save(buf, format="PNG", optimize=False, compress_level=6)
+    else:
+        pil_image.save(buf, format="WEBP", quality=rendering.WEBP_QUALITY, method=4)
+    data = buf.getvalue()
+
+    with _lock:
+        _stats["tiles_rendered"] += 1
+        _stats["render_ms"] += (time.perf_counter() - start) * 1000
+        _tiles[key] = data
+        _tile_bytes += len(data)
+        while _tile_bytes > MAX_TILE_BYTES and _tiles:
+            _, evicted = _tiles.popitem(last=False)
+            _tile_bytes -= len(evicted)
+    return data
+
+
+def tile_stats() -> Dict[str, Any]:
+    with _lock:
+        rendered = _stats["tiles_rendered"]
+        return {
+            "layouts": len(_layouts),
+            "layout_bytes": _layout_bytes,
+            "cached_tiles": len(_tiles),
+            "tile_cache_bytes": _tile_bytes,
+            "tiles_rendered": rendered,
+            "tile_cache_hits": _stats["tile_cache_hits"],
+            "avg_tile_render_ms": round(_stats["render_ms"] / rendered, 3) if rendered else None,
+        }
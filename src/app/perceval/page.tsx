@@ -43,7 +43,8 @@ print(result)
     })
     
     try {
-      const response = await fetch('http://localhost:8000/api/quantum/perceval/execute', {
+      // One run returns the output, plots, unitary and the visualizations
+      const response = await fetch('http://localhost:8000/api/quantum/perceval/run', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -17,12 +17,20 @@ export default function PercevalVisualizer({ code, results }: PercevalVisualizer
   const [processingVisualization, setProcessingVisualization] = useState(false)
   const { toast } = useToast()
   
+  // A run already returns the visualizations, so don't ask for them again
+  useEffect(() => {
+    if (results) {
+      setCircuitVisualization(results.circuit_visualization ?? null)
+      setStateVisualization(results.state_visualization ?? null)
+    }
+  }, [results])
+  
   // Parse the code to extract circuit information for visualization
   useEffect(() => {
     if (code) {
       generateVisualizations()
     }
-  }, [code, results])
+  }, [code])
   
   const generateVisualizations = async () => {
     if (!code) return
@@ -30,12 +38,12 @@ export default function PercevalVisualizer({ code, results }: PercevalVisualizer
     setProcessingVisualization(true)
     
     try {
-      const response = await fetch('http://localhost:8000/api/quantum/perceval/visualize', {
+      const response = await fetch('http://localhost:8000/api/quantum/perceval/run', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ code }),
+        body: JSON.stringify({ code, artifacts: ['circuit_visualization', 'state_visualization'] }),
       })
       
       if (!response.ok) {
@@ -116,6 +124,9 @@ export default function PercevalVisualizer({ code, results }: PercevalVisualizer
                 <p className="text-sm text-muted-foreground max-w-lg">
                   Process a quantum state through your circuit and visualize the results to see a state visualization.
                 </p>
+                {results?.errors?.state_visualization && (
+                  <p className="text-sm text-red-500 max-w-lg">{results.errors.state_visualization}</p>
+                )}
                 <Button onClick={generateVisualizations}>Generate Visualization</Button>
               </div>
             )}